@@ -0,0 +1,13 @@
+@echo off
+setlocal
+
+echo Starting bridge worker...
+python\python.exe manage.py run_bridge
+if %ERRORLEVEL% neq 0 (
+    echo ERROR: bridge worker failed to run!
+    pause
+    exit /b
+)
+
+echo Bridge worker stopped.
+pause
@@ -1,3 +1,10 @@
 from django.contrib import admin
 
-# Register your models here.
+from shared.models import Site
+
+
+# sites are read when the bridge starts, restart it after adding or disabling one
+@admin.register(Site)
+class SiteAdmin(admin.ModelAdmin):
+    list_display = ("key", "name", "local_server", "cloud_server", "enabled")
+    list_filter = ("enabled",)
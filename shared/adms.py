@@ -0,0 +1,110 @@
+import datetime
+
+from django.conf import settings
+
+from shared.ingestion import PUNCH_TIME_FORMAT
+from shared.models import AdmsDevice, AttendanceData, Site
+from shared.storage import serialized_write
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+ATTLOG = "ATTLOG"
+
+
+class PushedPunch:
+    def __init__(self, user_id, timestamp, status=None, verify=None):
+        self.user_id = user_id
+        self.timestamp = timestamp
+        self.status = status
+        self.verify = verify
+
+    @property
+    def key(self):
+        return self.user_id, self.timestamp
+
+
+def parse_attlog_line(line):
+    # PIN \t YYYY-MM-DD HH:MM:SS \t status \t verify \t workcode ..., some firmwares send spaces instead of tabs
+    if "\t" in line:
+        pin, punch_time, *rest = line.split("\t")
+    else:
+        pin, day, clock, *rest = line.split()
+        punch_time = f"{day} {clock}"
+    return PushedPunch(
+        user_id=int(pin.strip()),
+        timestamp=datetime.datetime.strptime(punch_time.strip(), PUNCH_TIME_FORMAT),
+        status=rest[0].strip() if len(rest) > 0 else None,
+        verify=rest[1].strip() if len(rest) > 1 else None,
+    )
+
+
+# returns (punches, rejected line count)
+def parse_attlog(body):
+    punches, rejected = [], 0
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            punches.append(parse_attlog_line(line))
+        except (ValueError, IndexError):
+            rejected += 1
+            logger.warning("Invalid ATTLOG line: %s", line[:200])
+    return punches, rejected
+
+
+def device_allowed(serial_number):
+    if not serial_number:
+        return False
+    if serial_number in settings.ADMS_ALLOWED_SERIALS:
+        return True
+    # devices assigned to a site are allowed without repeating them in ADMS_ALLOWED_SERIALS
+    return any(serial_number in site.serials() for site in Site.objects.exclude(device_serials=""))
+
+
+def attlog_stamp(serial_number):
+    return AdmsDevice.objects.filter(serial_number=serial_number).values_list('attlog_stamp', flat=True).first()
+
+
+# the device resumes its ATTLOG upload after this stamp instead of re-pushing its whole log
+@serialized_write
+def record_attlog_stamp(serial_number, stamp, now=None):
+    AdmsDevice.objects.update_or_create(
+        serial_number=serial_number,
+        defaults={"attlog_stamp": stamp, "last_seen_at": now or datetime.datetime.now()},
+    )
+
+
+def device_options(serial_number):
+    return "\n".join([
+        f"GET OPTION FROM: {serial_number}",
+        f"ATTLOGStamp={attlog_stamp(serial_number) or 'None'}",
+        "OPERLOGStamp=9999",
+        "ATTPHOTOStamp=None",
+        f"ErrorDelay={settings.ADMS_ERROR_DELAY}",
+        f"Delay={settings.ADMS_DELAY}",
+        f"TransTimes={settings.ADMS_TRANS_TIMES}",
+        "TransInterval=1",
+        "TransFlag=TransData AttLog",
+        "Realtime=1",
+        "Encrypt=None",
+    ])
+
+
+@serialized_write
+def store_pushed_punches(punches, site):
+    if not punches:
+        return 0
+    punches = list({punch.key: punch for punch in punches}.values())
+    timestamps = [punch.timestamp for punch in punches]
+    # the same punch may already be here from an earlier push or from polling ZKBioTime
+    existing = set(AttendanceData.objects.filter(
+        site=site, timestamp__range=(min(timestamps), max(timestamps)),
+        user_id__in={punch.user_id for punch in punches},
+    ).values_list('user_id', 'timestamp'))
+    rows = [
+        AttendanceData(site=site, user_id=punch.user_id, timestamp=punch.timestamp)
+        for punch in punches if punch.key not in existing
+    ]
+    AttendanceData.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
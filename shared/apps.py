@@ -6,9 +6,7 @@ class SharedConfig(AppConfig):
     name = 'shared'
 
     def ready(self):
-        from .scheduler import start
-        import os
+        from django.db.backends.signals import connection_created
+        from .storage import configure_sqlite
 
-        if os.getenv('DISABLE_SCHEDULER') == '1':
-            return
-        start()
\ No newline at end of file
+        connection_created.connect(configure_sqlite)
@@ -0,0 +1,427 @@
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from shared import user_mirror
+from shared.executor import ExecutionResult, TokenBucket
+from shared.ingestion import IngestionResult
+from shared.log_pipeline import endpoint_of, truncate
+from shared.outbox import BISECT, settle_chunk, upload_outcome
+from shared.pagination import async_page_stream
+from shared.pipeline import UploadWorker
+from shared.storage import async_db_write
+from shared.token_manager import store_token, stored_token
+from shared.transport import IDEMPOTENT_METHODS, AdaptiveThrottle, observe_request
+from shared.upload_format import JSON_FORMAT, encode_chunk
+from shared.wi3bit_sync_bridge import (
+    Wi3bitSyncBridge, attendance_idempotency_key, check_user_response, cloud_total_pages, cloud_users_changed,
+    cloud_users_page, cloud_users_url, employee_payload, employees_url, local_users_changed, log_cloud_response,
+    log_upload_response, transactions_url, user_sync_operations,
+)
+import logging
+logger = logging.getLogger("debug_logger")
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+def run_sync(func, *args, **kwargs):
+    # ORM reads run on the shared thread pool rather than asgiref's single sync thread, so one site's event loop
+    # doesn't queue behind another's, writes inside them still go through the db writer
+    return sync_to_async(func, thread_sensitive=False)(*args, **kwargs)
+
+
+class AsyncTokenManager:
+    # the token itself lives in the blocking bridge's TokenManager, so a site holds one token whichever engine
+    # asks for it, only the refresh I/O is async here
+    def __init__(self, bridge, cache):
+        self.bridge = bridge
+        self.cache = cache
+        self.lock = asyncio.Lock()
+
+    @property
+    def token(self):
+        return self.cache.token
+
+    async def get(self):
+        if self.cache.is_fresh():
+            return self.cache.token
+        return await self.refresh(stale_token=self.cache.token)
+
+    async def refresh(self, stale_token=None):
+        cache = self.cache
+        async with self.lock:
+            if cache.replaced(stale_token):
+                return cache.token
+            if cache.should_check_store(stale_token) and cache.adopt_stored(await run_sync(stored_token, cache.site), stale_token):
+                return cache.token
+            return cache.fetched(await self.fetch_token())
+
+    async def fetch_token(self):
+        url, body, headers = self.cache.token_request()
+        response = await self.bridge.request("post", url, content=body, headers=headers, timeout=5)
+        token = self.cache.token_from_response(response)
+        await async_db_write(store_token, token, self.cache.site)
+        return token
+
+
+class AsyncWi3bitSyncBridge:
+    def __init__(self, site=None):
+        if httpx is None:
+            raise Exception("The async bridge engine needs httpx, install it with: pip install httpx")
+        # persistence and the area/dept bootstrap are shared with the blocking bridge
+        self.sync_bridge = Wi3bitSyncBridge(site)
+        self.site = self.sync_bridge.site
+        self.tokens = AsyncTokenManager(self, self.sync_bridge.tokens)
+        self.local_slots = asyncio.Semaphore(settings.ASYNC_LOCAL_CONCURRENCY)
+        self.cloud_slots = asyncio.Semaphore(settings.ASYNC_CLOUD_CONCURRENCY)
+        self.client = None
+
+    def get_client(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.ASYNC_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.ASYNC_MAX_CONNECTIONS,
+                ),
+                timeout=httpx.Timeout(settings.HTTP_READ_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT),
+            )
+        return self.client
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        self.sync_bridge.close()
+
+    def slots_for(self, url):
+        return self.cloud_slots if self.site.cloud_url and url.startswith(self.site.cloud_url) else self.local_slots
+
+    async def request(self, method, url, timeout=None, **kwargs):
+        method = method.lower()
+        timeout = httpx.Timeout(timeout or settings.HTTP_READ_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                async with self.slots_for(url):
+                    response = await self.get_client().request(method.upper(), url, timeout=timeout, **kwargs)
+                observe_request(method, url, response.status_code, started)
+                return response
+            except httpx.TransportError as e:
+                observe_request(method, url, "error", started)
+                retryable = method in IDEMPOTENT_METHODS or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if not retryable or attempt >= settings.HTTP_RETRIES:
+                    raise
+                delay = random.uniform(0, settings.HTTP_BACKOFF * (2 ** attempt))
+                attempt += 1
+                logger.warning("Transient error on %s %s: %s, retry %s in %.2fs", method.upper(), endpoint_of(url), e, attempt, delay)
+                await asyncio.sleep(delay)
+
+    async def local_api_call(self, url, method='get', data=None, timeout=5, retry=True):
+        logger.debug("Local API Calling: %s %s, data: %s", method, endpoint_of(url), truncate(data, settings.LOG_PAYLOAD_LIMIT))
+
+        async def get_response(token):
+            headers = {"Content-Type": "application/json", "Authorization": f"JWT {token}"}
+            if method.lower() in ("get", "delete"):
+                return await self.request(method, url, headers=headers, timeout=timeout)
+            elif method.lower() in ("post", "put"):
+                return await self.request(method, url, content=json.dumps(data or {}), headers=headers, timeout=timeout)
+            logger.info("Invalid method: %s", method)
+            raise Exception(f"Invalid method: {method}")
+
+        token = await self.tokens.get()
+        started = time.monotonic()
+        response = await get_response(token)
+        logger.info(
+            "Local API responded: %s", response.status_code,
+            extra={"endpoint": endpoint_of(url), "method": method.upper(), "status": response.status_code,
+                   "latency": round(time.monotonic() - started, 3)},
+        )
+        logger.debug("Local API response: %s", truncate(response.text, settings.LOG_PAYLOAD_LIMIT))
+        if retry and response.status_code in (401, 403):
+            logger.info("Got %s status code, getting new token and retrying", response.status_code)
+            response = await get_response(await self.tokens.refresh(stale_token=token))
+            if not (200 <= response.status_code <= 299):
+                logger.info("Got new token but failed again, exiting with error: %s", truncate(response.text, settings.LOG_PAYLOAD_LIMIT))
+                raise Exception(response.text)
+        return response
+
+    async def cloud_get(self, url, headers=None, throttle=None, **extra):
+        started = time.monotonic()
+        headers = {"Content-Type": "application/json", **(headers or {})}
+        if throttle:
+            response = await throttle.async_request(self.request, "get", url, headers=headers, timeout=20)
+        else:
+            response = await self.request("get", url, headers=headers, timeout=20)
+        log_cloud_response(url, response, started, **extra)
+        return response
+
+    def local_page_stream(self, name, url, start_page=1):
+        async def fetch_page(page_number):
+            started = time.monotonic()
+            response = await self.local_api_call(url=f"{url}&page={page_number}")
+            return response.json(), time.monotonic() - started
+
+        def total_pages(response_json):
+            if response_json.get('count') and response_json['data']:
+                return math.ceil(int(response_json['count']) / len(response_json['data']))
+            return None
+
+        return async_page_stream(
+            name, fetch_page, lambda response_json: response_json['next'], total_pages,
+            start_page=start_page, window=settings.ASYNC_PAGE_WINDOW,
+        )
+
+    def cloud_user_stream(self, start_page=1):
+        throttle = AdaptiveThrottle()
+
+        async def fetch_page(page_number):
+            started = time.monotonic()
+            response = await self.cloud_get(cloud_users_url(self.site, page_number), throttle=throttle, page=page_number)
+            return cloud_users_page(response), time.monotonic() - started
+
+        return async_page_stream(
+            "cloud users", fetch_page, lambda response_json: response_json['has_more'], cloud_total_pages,
+            start_page=start_page, max_pages=settings.CLOUD_USERS_MAX_PAGES, window=settings.ASYNC_PAGE_WINDOW,
+        )
+
+    async def get_local_users(self):
+        logger.info("Getting local users")
+        users = []
+        async for page in self.local_page_stream("local users", f"{employees_url(self.site)}?page_size=100"):
+            users.extend(page.records)
+        return users
+
+    async def get_cloud_users(self):
+        logger.info("Getting cloud users")
+        users = []
+        async for page in self.cloud_user_stream():
+            users.extend(page.records)
+        return users
+
+    async def update_local_attendance(self, start_time=None, start_page=1, progress=None):
+        logger.info("Updating local attendance, %s", start_time)
+        url = transactions_url(self.site, start_time)
+
+        result = IngestionResult()
+        last_page = start_page - 1
+        try:
+            async for page in self.local_page_stream("transactions", url, start_page=start_page):
+                result.add_page(page.records, await run_sync(self.sync_bridge.store_attendance_page, page.records))
+                last_page = page.number
+                if progress:
+                    progress.update(page=page.number, seen=result.records_seen, new=result.new_count)
+        except Exception:
+            logger.error("Attendance ingestion failed, resume from page %s", last_page + 1)
+            raise
+        logger.info("Local attendance updated, %s", result)
+        return result
+
+    async def send_attendance_chunk(self, chunk, upload_format):
+        encoded = encode_chunk(chunk, upload_format)
+        url = f"{self.site.cloud_url}/zkteco/sync/bridge/attendance_data/?token={self.site.cloud_token}"
+        started = time.monotonic()
+        response = await self.request(
+            "post", url, content=encoded.body,
+            headers={**encoded.headers, "Idempotency-Key": attendance_idempotency_key(chunk)},
+            timeout=settings.CLOUD_UPLOAD_TIMEOUT,
+        )
+        log_upload_response(self.site, url, response, chunk, encoded, started)
+        return response
+
+    async def post_attendance_chunk(self, chunk):
+        negotiator = self.sync_bridge.upload_format
+        upload_format = negotiator.choose()
+        response = await self.send_attendance_chunk(chunk, upload_format)
+        if negotiator.observe(upload_format, response.status_code):
+            response = await self.send_attendance_chunk(chunk, JSON_FORMAT)
+        return response
+
+    # same contract as Wi3bitSyncBridge.upload_attendance_chunk
+    async def upload_attendance_chunk(self, chunk):
+        try:
+            response = await self.post_attendance_chunk(chunk)
+        except httpx.HTTPError as e:
+            self.sync_bridge.upload_backoff.failed(e)
+            return 0, False
+
+        outcome = upload_outcome(response.status_code, len(chunk))
+        if outcome == BISECT:
+            middle = len(chunk) // 2
+            uploaded, can_continue = await self.upload_attendance_chunk(chunk[:middle])
+            if not can_continue:
+                return uploaded, False
+            more, can_continue = await self.upload_attendance_chunk(chunk[middle:])
+            return uploaded + more, can_continue
+        backoff = self.sync_bridge.upload_backoff
+        return await run_sync(settle_chunk, self.site, outcome, chunk, response.status_code, response.text, backoff)
+
+    async def update_cloud_attendance(self, progress=None):
+        if not self.sync_bridge.upload_backoff.ready():
+            logger.info("Cloud attendance upload is backing off, skipping")
+            return 0
+        logger.info("Uploading attendance data to cloud:")
+        chunks = self.sync_bridge.pending_attendance_chunks(settings.CLOUD_UPLOAD_CHUNK_SIZE)
+        uploaded = 0
+        while True:
+            window = await run_sync(lambda: list(islice(chunks, settings.ASYNC_UPLOAD_WINDOW)))
+            if not window:
+                break
+            results = await asyncio.gather(*(self.upload_attendance_chunk(chunk) for chunk in window))
+            uploaded += sum(count for count, _ in results)
+            if progress:
+                progress.update(uploaded=uploaded)
+            if not all(can_continue for _, can_continue in results):
+                logger.error("Attendance upload stopped after %s records, remaining rows will be retried", uploaded)
+                return uploaded
+
+        if not uploaded:
+            logger.info("No pending attendance data to sync, exiting")
+            return uploaded
+        logger.info("Attendance Synced Successfully! uploaded: %s", uploaded)
+        return uploaded
+
+    async def probe_local_users(self, state):
+        return local_users_changed(await self.local_api_call(url=f"{employees_url(self.site)}?page_size=1&page=1"), state)
+
+    # returns (changed, etag)
+    async def probe_cloud_users(self, state):
+        headers = {"If-None-Match": state.etag} if state.etag else None
+        return cloud_users_changed(await self.cloud_get(cloud_users_url(self.site, 1, per_page=1), headers=headers), state)
+
+    # same flow as Wi3bitSyncBridge.update_users, with both sides probed and fetched concurrently
+    async def update_users(self, full_scan=None, progress=None):
+        local_source, cloud_source = self.sync_bridge.local_source, self.sync_bridge.cloud_source
+        run = await run_sync(user_mirror.UserSyncRun, local_source, cloud_source, full_scan, progress)
+        if run.full_scan:
+            cloud_changed, cloud_etag = await self.probe_cloud_users(run.cloud_state)
+            local_changed = True
+        else:
+            (cloud_changed, cloud_etag), local_changed = await asyncio.gather(
+                self.probe_cloud_users(run.cloud_state), self.probe_local_users(run.local_state),
+            )
+        if not (run.full_scan or cloud_changed or local_changed):
+            return await run_sync(run.skip)
+
+        run.report(phase="fetching")
+        local_users, cloud_users = await asyncio.gather(
+            self.get_local_users() if local_changed else run_sync(user_mirror.mirrored_records, local_source),
+            self.get_cloud_users() if run.full_scan or cloud_changed else run_sync(user_mirror.mirrored_records, cloud_source),
+        )
+        plan = run.plan(local_users, cloud_users)
+        if plan:
+            result = await self.apply_user_sync_plan(plan, progress)
+            run.applied(result, await self.get_local_users())
+        return await run_sync(run.finish, cloud_etag)
+
+    async def apply_user_sync_plan(self, plan, progress=None):
+        await run_sync(self.sync_bridge.ensure_area_dept)
+        operations = user_sync_operations(plan, employees_url(self.site), self.create_user, self.update_user, self.delete_user)
+        if progress:
+            progress.update(phase="applying", total=len(operations))
+        bucket = TokenBucket(settings.USER_SYNC_RATE)
+        result = ExecutionResult(progress)
+
+        async def run_one(operation):
+            wait = bucket.reserve()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = bucket.reserve()
+            try:
+                await operation.func(*operation.args)
+            except Exception as e:
+                logger.debug("Operation raised: %s", operation.name, exc_info=True)
+                result.add_failure(operation, e)
+            else:
+                result.add_success()
+
+        # concurrency is bounded by the local semaphore inside request()
+        await asyncio.gather(*(run_one(operation) for operation in operations))
+        logger.info("User sync applied, %s", result)
+        return result
+
+    async def create_user(self, cloud_user):
+        logger.info("Creating new user: %s", cloud_user.get('id'))
+        response = await self.local_api_call(
+            url=employees_url(self.site),
+            method="post",
+            data=employee_payload(cloud_user, self.sync_bridge.area_id, self.sync_bridge.dept_id),
+        )
+        check_user_response(response, "Creation")
+        logger.info("User Created: %s", cloud_user['name'])
+
+    async def update_user(self, local_user_id, cloud_user):
+        logger.info("Updating user, local user id: %s, cloud user: %s", local_user_id, cloud_user.get('id'))
+        response = await self.local_api_call(
+            url=employees_url(self.site, local_user_id),
+            method="put",
+            data=employee_payload(cloud_user, self.sync_bridge.area_id, self.sync_bridge.dept_id),
+        )
+        check_user_response(response, "Update")
+        logger.info("User Updated: %s", cloud_user['name'])
+
+    async def delete_user(self, local_user_id):
+        logger.info("Deleting user, local user id: %s", local_user_id)
+        response = await self.local_api_call(url=employees_url(self.site, local_user_id), method="delete")
+        check_user_response(response, "Deletion")
+        logger.info("User Deleted: %s", local_user_id)
+
+
+class AsyncBridgeRunner:
+    # the scheduler's blocking bridge interface, every call runs on one event loop thread
+    def __init__(self, site=None):
+        self.bridge = AsyncWi3bitSyncBridge(site)
+        self.site = self.bridge.site
+        # one loop per site, a site with hung requests can't delay another site's coroutines
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name=f"bridge-event-loop-{self.site.key}", daemon=True)
+        self.thread.start()
+        self.upload_worker = None
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        try:
+            self.run(self.bridge.aclose())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5)
+
+    def update_local_attendance(self, start_time=None, start_page=1, progress=None):
+        result = self.run(self.bridge.update_local_attendance(start_time, start_page, progress))
+        if result:
+            self.notify_new_punches()
+        return result
+
+    def update_cloud_attendance(self, progress=None):
+        return self.run(self.bridge.update_cloud_attendance(progress))
+
+    def update_users(self, full_scan=None, progress=None):
+        return self.run(self.bridge.update_users(full_scan, progress))
+
+    def start_upload_worker(self, upload=None):
+        self.upload_worker = UploadWorker(
+            upload or self.update_cloud_attendance,
+            site_key=self.site.key,
+            debounce=settings.UPLOAD_DEBOUNCE_SECONDS,
+            max_delay=settings.UPLOAD_MAX_DELAY_SECONDS,
+        )
+        self.upload_worker.start()
+        return self.upload_worker
+
+    def notify_new_punches(self):
+        if self.upload_worker and self.upload_worker.is_alive():
+            self.upload_worker.notify()
+        else:
+            self.update_cloud_attendance()
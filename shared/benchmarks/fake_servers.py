@@ -0,0 +1,238 @@
+import base64
+import datetime
+import gzip
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PUNCH_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def fake_jwt(ttl=3600):
+    payload = json.dumps({"exp": int(time.time()) + ttl, "username": "bench"}).encode()
+    return "e30." + base64.urlsafe_b64encode(payload).decode().rstrip("=") + ".sig"
+
+
+class FakeServer:
+    def __init__(self, latency=0.0, error_rate=0.0, seed=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        self.outage = False
+        self.bytes_received = 0
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def handle_method(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, data, *headers = server.dispatch(method, self.path, self.headers, body)
+                payload = json.dumps(data).encode() if data is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                for name, value in (headers[0] if headers else {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self.handle_method("GET")
+
+            def do_POST(self):
+                self.handle_method("POST")
+
+            def do_PUT(self):
+                self.handle_method("PUT")
+
+            def do_DELETE(self):
+                self.handle_method("DELETE")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def dispatch(self, method, path, headers, body):
+        parsed = urlparse(path)
+        with self.lock:
+            self.requests[f"{method} {self.route_name(parsed.path)}"] += 1
+            self.bytes_received += len(body)
+            failing = self.outage or (self.error_rate and self.random.random() < self.error_rate)
+        if self.latency:
+            time.sleep(self.latency)
+        if failing:
+            return 503, {"detail": "Service unavailable"}
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        if headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        data = json.loads(body) if body else None
+        return self.handle(method, parsed.path, query, data, headers)
+
+    def route_name(self, path):
+        return "/".join("{id}" if part.isdigit() else part for part in path.split("/"))
+
+    def handle(self, method, path, query, data, headers):
+        return 404, {"detail": "Not found"}
+
+    def total_requests(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+
+class FakeZKBioTime(FakeServer):
+    def __init__(self, employees=0, punches=0, users=1, page_size=100, punch_interval=1, **kwargs):
+        super().__init__(**kwargs)
+        self.employees = {}
+        self.next_employee_id = 1
+        for i in range(employees):
+            self.add_employee(str(i + 1), f"U{i + 1} User {i + 1}")
+        self.areas = {}
+        self.departments = {}
+        self.punches = punches
+        self.users = max(users, 1)
+        self.page_size = page_size
+        self.punch_interval = punch_interval
+        self.punch_start = datetime.datetime.now() - datetime.timedelta(seconds=punches * punch_interval)
+
+    def add_employee(self, emp_code, first_name):
+        employee = {"id": self.next_employee_id, "emp_code": emp_code, "first_name": first_name}
+        self.employees[employee["id"]] = employee
+        self.next_employee_id += 1
+        return employee
+
+    def punch(self, index):
+        punch_time = (self.punch_start + datetime.timedelta(seconds=index * self.punch_interval)).strftime(PUNCH_TIME_FORMAT)
+        return {
+            "id": index + 1,
+            "emp_code": str(1 + index % self.users),
+            "punch_time": punch_time,
+            "upload_time": punch_time,
+        }
+
+    def page(self, items, query, path, count):
+        page = int(query.get("page", 1))
+        page_size = int(query.get("page_size", self.page_size))
+        start = (page - 1) * page_size
+        data = items(start, page_size)
+        has_next = start + page_size < count
+        return 200, {
+            "count": count,
+            "next": f"{path}?page={page + 1}" if has_next else None,
+            "data": data,
+        }
+
+    def first_punch_from(self, start_time):
+        # punches are evenly spaced, so start_time maps straight to the first matching index
+        if not start_time:
+            return 0
+        offset = (datetime.datetime.strptime(start_time, PUNCH_TIME_FORMAT) - self.punch_start).total_seconds()
+        return min(max(0, -int(-offset // self.punch_interval)), self.punches)
+
+    def handle(self, method, path, query, data, headers):
+        if path == "/jwt-api-token-auth/":
+            return 200, {"token": fake_jwt()}
+        if not headers.get("Authorization", "").startswith("JWT "):
+            return 401, {"detail": "Authentication credentials were not provided."}
+
+        if path == "/iclock/api/transactions/":
+            first = self.first_punch_from(query.get("start_time"))
+            return self.page(
+                lambda start, size: [self.punch(i) for i in range(first + start, min(first + start + size, self.punches))],
+                query, path, self.punches - first,
+            )
+
+        if path == "/personnel/api/employees/":
+            if method == "POST":
+                return 201, self.add_employee(str(data["emp_code"]), data["first_name"])
+            employees = list(self.employees.values())
+            return self.page(lambda start, size: employees[start:start + size], query, path, len(employees))
+
+        if path.startswith("/personnel/api/employees/"):
+            employee_id = int(path.rstrip("/").split("/")[-1])
+            if employee_id not in self.employees:
+                return 404, {"detail": "Not found"}
+            if method == "PUT":
+                self.employees[employee_id].update(emp_code=str(data["emp_code"]), first_name=data["first_name"])
+                return 200, self.employees[employee_id]
+            if method == "DELETE":
+                del self.employees[employee_id]
+                return 204, None
+
+        for prefix, store, code_field in (("/personnel/api/areas/", self.areas, "area_code"),
+                                          ("/personnel/api/departments/", self.departments, "dept_code")):
+            if path == prefix:
+                if method == "POST":
+                    item = dict(data, id=len(store) + 1)
+                    store[item["id"]] = item
+                    return 201, item
+                items = [item for item in store.values() if item[code_field] == query.get(code_field, item[code_field])]
+                return 200, {"count": len(items), "next": None, "data": items}
+
+        return 404, {"detail": "Not found"}
+
+
+class FakeCloud(FakeServer):
+    def __init__(self, users=0, accept_columnar=True, **kwargs):
+        super().__init__(**kwargs)
+        self.accept_columnar = accept_columnar
+        self.users = [{"id": i + 1, "unique_id": f"U{i + 1}", "name": f"User {i + 1}"} for i in range(users)]
+        self.users_version = 1
+        self.received = 0
+        self.seen_keys = set()
+
+    def handle(self, method, path, query, data, headers):
+        if path == "/zkteco/sync/bridge/users/":
+            # the ETag versions the whole roster, bump users_version after editing users
+            etag = f'"users-{self.users_version}"'
+            if headers.get("If-None-Match") == etag:
+                return 304, None, {"ETag": etag}
+            page = int(query.get("page", 1))
+            per_page = int(query.get("per_page", 100))
+            start = (page - 1) * per_page
+            return 200, {
+                "data": self.users[start:start + per_page],
+                "has_more": start + per_page < len(self.users),
+                "total": len(self.users),
+            }, {"ETag": etag}
+        if path == "/zkteco/sync/bridge/attendance_data/" and method == "POST":
+            if isinstance(data, dict):
+                if not self.accept_columnar or data.get("format") != "columnar-v1":
+                    return 415, {"detail": "Unsupported upload format"}
+                count = data["count"]
+            else:
+                count = len(data)
+            key = headers.get("Idempotency-Key")
+            with self.lock:
+                if key not in self.seen_keys:
+                    self.seen_keys.add(key)
+                    self.received += count
+            return 201, {"received": count}
+        return 404, {"detail": "Not found"}
@@ -0,0 +1,322 @@
+import datetime
+import math
+import threading
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+
+from shared.benchmarks.fake_servers import FakeCloud, FakeZKBioTime
+from shared.ingestion import parse_punch_time
+from shared.models import (
+    AttendanceData, BridgeJob, BridgeTokens, IngestionCheckpoint, LocalResource, UserMirror, UserSyncState,
+)
+from shared.outbox import outbox_stats
+from shared.scheduler import attn_catchup, attn_deep_catchup, attn_heartbeat, create_bridge
+from shared.sites import default_site
+from shared.storage import db_write
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class WriteCounter:
+    # counts write statements on every connection opened while installed, the db writer thread included
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        if sql.lstrip()[:7].upper().startswith(WRITE_STATEMENTS):
+            with self.lock:
+                self.statements += 1
+                self.rows += max(context["cursor"].rowcount, 0)
+        return result
+
+    def attach(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+            self.connections.append(connection)
+
+    def attach_current(self):
+        self.attach(connection=connection)
+
+    def install(self):
+        connection_created.connect(self.attach)
+        self.attach_current()
+        # the db writer keeps its connection open between runs, so it is attached from its own thread
+        db_write(self.attach_current)
+
+    def uninstall(self):
+        connection_created.disconnect(self.attach)
+        for conn in self.connections:
+            if self in conn.execute_wrappers:
+                conn.execute_wrappers.remove(self)
+
+
+class BenchmarkResult:
+    def __init__(self, name, params):
+        self.name = name
+        self.params = params
+        self.wall_time = None
+        self.requests = {}
+        self.peak_memory = None
+        self.max_rss = None
+        self.db_writes = None
+        self.db_rows = None
+        self.details = {}
+        self.error = None
+
+    @property
+    def total_requests(self):
+        return sum(self.requests.values())
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "params": self.params,
+            "wall_time": self.wall_time,
+            "requests": self.requests,
+            "total_requests": self.total_requests,
+            "peak_memory": self.peak_memory,
+            "max_rss": self.max_rss,
+            "db_writes": self.db_writes,
+            "db_rows": self.db_rows,
+            "details": self.details,
+            "error": self.error,
+        }
+
+
+class Scenario:
+    name = None
+
+    def __init__(self, latency=0.0, error_rate=0.0, page_size=100):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_size = page_size
+
+    def params(self):
+        return {key: value for key, value in self.__dict__.items() if not key.startswith("_")}
+
+    def servers(self):
+        raise NotImplementedError
+
+    def settings(self):
+        return {}
+
+    def prepare(self, local, cloud):
+        pass
+
+    def run(self, bridge, local, cloud):
+        raise NotImplementedError
+
+
+class UserReconciliation(Scenario):
+    name = "users"
+
+    def __init__(self, users=10000, churn=0.05, **kwargs):
+        super().__init__(**kwargs)
+        self.users = users
+        self.churn = churn
+
+    def servers(self):
+        changed = int(self.users * self.churn)
+        local = FakeZKBioTime(employees=self.users, page_size=self.page_size, latency=self.latency, error_rate=self.error_rate)
+        cloud = FakeCloud(users=self.users, latency=self.latency, error_rate=self.error_rate)
+        # the first slice is renamed in the cloud, the next is missing locally, extras only exist locally
+        for cloud_user in cloud.users[:changed]:
+            cloud_user["name"] += " (renamed)"
+        for employee_id in list(local.employees)[changed:changed * 2]:
+            del local.employees[employee_id]
+        for i in range(changed):
+            local.add_employee(str(self.users + i + 1), f"Left {i + 1}")
+        return local, cloud
+
+    def settings(self):
+        return {"CLOUD_USERS_MAX_PAGES": math.ceil(self.users / 100) + 1}
+
+    def run(self, bridge, local, cloud):
+        counts = bridge.update_users()
+        counts["local_employees"] = len(local.employees)
+        # a second run with nothing changed should stop at the probes
+        requests_before = local.total_requests() + cloud.total_requests()
+        counts["rerun_skipped"] = bridge.update_users()["skipped"]
+        counts["rerun_requests"] = local.total_requests() + cloud.total_requests() - requests_before
+        return counts
+
+
+class AttendanceBackfill(Scenario):
+    name = "backfill"
+
+    def __init__(self, punches=1000000, users=500, **kwargs):
+        super().__init__(**kwargs)
+        self.punches = punches
+        self.users = users
+
+    def servers(self):
+        local = FakeZKBioTime(punches=self.punches, users=self.users, page_size=self.page_size,
+                              latency=self.latency, error_rate=self.error_rate)
+        cloud = FakeCloud(latency=self.latency, error_rate=self.error_rate)
+        return local, cloud
+
+    def run(self, bridge, local, cloud):
+        # ingests every page, then uploads the whole backlog inline since no upload worker runs
+        result = bridge.update_local_attendance(start_time=local.punch_start - datetime.timedelta(seconds=1))
+        return {
+            "records_seen": result.records_seen,
+            "ingested": result.new_count,
+            "uploaded": cloud.received,
+            "upload_bytes": cloud.bytes_received,
+            "pending": outbox_stats()["pending"],
+        }
+
+
+class OutageRecovery(Scenario):
+    name = "outage"
+
+    def __init__(self, backlog=50000, outage_runs=5, max_runs=1000, **kwargs):
+        super().__init__(**kwargs)
+        self.backlog = backlog
+        self.outage_runs = outage_runs
+        self.max_runs = max_runs
+
+    def servers(self):
+        local = FakeZKBioTime(latency=self.latency, error_rate=self.error_rate)
+        cloud = FakeCloud(latency=self.latency, error_rate=self.error_rate)
+        return local, cloud
+
+    def settings(self):
+        # retry right away, the benchmark measures the drain itself rather than the backoff schedule
+        return {"OUTBOX_BASE_BACKOFF": 0, "OUTBOX_MAX_BACKOFF": 0}
+
+    def prepare(self, local, cloud):
+        started = datetime.datetime.now() - datetime.timedelta(seconds=self.backlog)
+        site = default_site()
+        AttendanceData.objects.bulk_create(
+            (AttendanceData(site=site, user_id=str(1 + i % 500), timestamp=started + datetime.timedelta(seconds=i), attn_id=i + 1)
+             for i in range(self.backlog)),
+            batch_size=1000,
+        )
+
+    def run(self, bridge, local, cloud):
+        cloud.outage = True
+        for _ in range(self.outage_runs):
+            bridge.update_cloud_attendance()
+        cloud.outage = False
+
+        runs = self.outage_runs
+        while outbox_stats()["pending"] and runs < self.max_runs:
+            bridge.update_cloud_attendance()
+            runs += 1
+        stats = outbox_stats()
+        return {
+            "runs": runs,
+            "uploaded": cloud.received,
+            "upload_bytes": cloud.bytes_received,
+            "pending": stats["pending"],
+            "dead_letter": stats["dead_letter"],
+        }
+
+
+class PollingSweep(Scenario):
+    name = "polling"
+
+    def __init__(self, history=20000, days=10, **kwargs):
+        super().__init__(**kwargs)
+        self.history = history
+        self.days = days
+
+    def servers(self):
+        local = FakeZKBioTime(punches=self.history, users=500, punch_interval=self.days * 24 * 60 * 60 / self.history,
+                              latency=self.latency, error_rate=self.error_rate)
+        cloud = FakeCloud(latency=self.latency, error_rate=self.error_rate)
+        return local, cloud
+
+    def prepare(self, local, cloud):
+        # the site is already caught up, every poll below only re-reads punches the bridge has stored
+        site = default_site()
+        AttendanceData.objects.bulk_create(
+            (AttendanceData(site=site, user_id=punch['emp_code'], timestamp=parse_punch_time(punch['punch_time']),
+                            attn_id=punch['id'], synced=True)
+             for punch in map(local.punch, range(self.history))),
+            batch_size=1000,
+        )
+
+    def run(self, bridge, local, cloud):
+        # one run of each attendance job, scaled up to the number of runs the scheduler makes in a day
+        runs_per_day = (
+            (attn_heartbeat, 24 * 60 * 60 / settings.ATTN_HEARTBEAT_SECONDS),
+            (attn_catchup, 24 * 60 / settings.ATTN_CATCHUP_INTERVAL_MINUTES),
+            (attn_deep_catchup, 1),
+        )
+        counts = {}
+        per_day = 0
+        for job, runs in runs_per_day:
+            before = local.requests["GET /iclock/api/transactions/"]
+            job(bridge)
+            requests = local.requests["GET /iclock/api/transactions/"] - before
+            counts[f"{job.__name__}_requests"] = requests
+            per_day += requests * runs
+        counts["requests_per_day"] = round(per_day)
+        counts["ingested"] = AttendanceData.objects.count() - self.history
+        return counts
+
+
+SCENARIOS = {scenario.name: scenario for scenario in (UserReconciliation, AttendanceBackfill, OutageRecovery, PollingSweep)}
+
+
+def reset_database():
+    # the user mirror and its sync state too, otherwise a later user scenario skips its sync as unchanged
+    for model in (AttendanceData, BridgeTokens, IngestionCheckpoint, LocalResource, BridgeJob, UserMirror, UserSyncState):
+        model.objects.all().delete()
+
+
+def run_scenario(scenario, overrides=None):
+    result = BenchmarkResult(scenario.name, scenario.params())
+    reset_database()
+    local, cloud = scenario.servers()
+    local.start()
+    cloud.start()
+    try:
+        scenario.prepare(local, cloud)
+        with override_settings(
+            LOCAL_SERVER=local.url, CLOUD_SERVER=cloud.url, CLOUD_API_TOKEN="benchmark",
+            LOCAL_SERVER_USER="benchmark", LOCAL_SERVER_PASS="benchmark",
+            **scenario.settings(), **(overrides or {}),
+        ):
+            bridge = create_bridge()
+            counter = WriteCounter()
+            counter.install()
+            tracemalloc.start()
+            started = time.perf_counter()
+            try:
+                result.details = scenario.run(bridge, local, cloud)
+            except Exception as e:
+                result.error = str(e)
+            finally:
+                result.wall_time = round(time.perf_counter() - started, 3)
+                result.peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                counter.uninstall()
+                bridge.close()
+            result.db_writes = counter.statements
+            result.db_rows = counter.rows
+    finally:
+        local.stop()
+        cloud.stop()
+
+    result.requests = {f"{upstream} {route}": count for upstream, server in (("local", local), ("cloud", cloud))
+                       for route, count in sorted(server.requests.items())}
+    if resource:
+        result.max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return result
@@ -0,0 +1,147 @@
+import datetime
+import threading
+import time
+from collections import defaultdict
+
+from django.db import close_old_connections
+
+from shared import metrics
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+ATTENDANCE_INGEST = "attendance_ingest"
+CLOUD_UPLOAD = "cloud_upload"
+USER_SYNC = "user_sync"
+PURGE = "purge"
+
+INTERACTIVE, HEARTBEAT, SWEEP = 0, 1, 2
+
+
+class JobStats:
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.merged = 0
+        self.overruns = 0
+        self.last_started_at = None
+        self.last_success_at = None
+        self.last_duration = None
+        self.last_error = None
+
+
+class Trigger:
+    def __init__(self, name, func, args, priority, interval):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.interval = interval
+        self.followers = []
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def finish(self):
+        for follower in self.followers:
+            follower.result = self.result
+            follower.error = self.error
+            follower.finish()
+        self.done.set()
+
+
+class JobCoordinator:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.queued = {}
+        self.stats = defaultdict(JobStats)
+
+    def submit(self, name, resource, func, *args, priority=SWEEP, interval=None, wait=False):
+        trigger = Trigger(name, func, args, priority, interval)
+        with self.lock:
+            run_now = resource not in self.running
+            if run_now:
+                self.running[resource] = trigger
+            else:
+                self._enqueue(resource, trigger)
+
+        if run_now:
+            self._drain(resource, trigger)
+        elif wait:
+            trigger.done.wait()
+        return trigger
+
+    def job(self, name, resource, func, priority=SWEEP, interval=None):
+        def run_job(*args):
+            self.submit(name, resource, func, *args, priority=priority, interval=interval)
+        run_job.__name__ = name
+        return run_job
+
+    def _enqueue(self, resource, trigger):
+        # one follow-up run is kept per job on a resource, a repeat trigger rides along with the queued one
+        pending = self.queued.setdefault(resource, {})
+        queued = pending.get(trigger.name)
+        if queued is None:
+            pending[trigger.name] = trigger
+            return
+        self.stats[trigger.name].merged += 1
+        metrics.job_merged.inc(job=trigger.name)
+        queued.priority = min(queued.priority, trigger.priority)
+        queued.followers.append(trigger)
+
+    def _next_queued(self, resource):
+        # the most urgent pending job runs next, ties keep trigger order
+        pending = self.queued.get(resource)
+        if not pending:
+            return None
+        trigger = min(pending.values(), key=lambda queued: queued.priority)
+        del pending[trigger.name]
+        if not pending:
+            del self.queued[resource]
+        return trigger
+
+    def _drain(self, resource, trigger):
+        while trigger:
+            self._execute(trigger)
+            with self.lock:
+                trigger = self._next_queued(resource)
+                if trigger:
+                    self.running[resource] = trigger
+                else:
+                    self.running.pop(resource, None)
+
+    def _execute(self, trigger):
+        stats = self.stats[trigger.name]
+        stats.last_started_at = datetime.datetime.now()
+        started = time.monotonic()
+        try:
+            trigger.result = trigger.func(*trigger.args)
+        except Exception as e:
+            trigger.error = e
+            logger.exception("Job %s failed: %s", trigger.name, e)
+        finally:
+            close_old_connections()
+
+        duration = time.monotonic() - started
+        with self.lock:
+            stats.runs += 1
+            stats.last_duration = duration
+            if trigger.error:
+                stats.failures += 1
+                stats.last_error = str(trigger.error)
+            else:
+                stats.last_success_at = datetime.datetime.now()
+            metrics.job_runs.inc(job=trigger.name, outcome="failure" if trigger.error else "success")
+            metrics.job_duration_seconds.observe(duration, job=trigger.name)
+            metrics.job_last_duration.set(round(duration, 3), job=trigger.name)
+            if not trigger.error:
+                metrics.job_last_success.set(round(time.time(), 3), job=trigger.name)
+            if trigger.interval and duration > trigger.interval:
+                stats.overruns += 1
+                metrics.job_overruns.inc(job=trigger.name)
+                logger.warning("Job %s overran its %ss interval, took %.1fs", trigger.name, trigger.interval, duration)
+        trigger.finish()
+
+
+coordinator = JobCoordinator()
@@ -0,0 +1,102 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # takes a token and returns 0, or returns how long to wait before trying again
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class Operation:
+    def __init__(self, name, url, func, *args):
+        self.name = name
+        self.host = urlparse(url).netloc
+        self.func = func
+        self.args = args
+
+
+class ExecutionResult:
+    def __init__(self, progress=None):
+        self.succeeded = 0
+        self.failures = []
+        self.progress = progress
+        self.lock = threading.Lock()
+
+    def add_success(self):
+        with self.lock:
+            self.succeeded += 1
+        if self.progress:
+            self.progress.add("applied")
+
+    # the one place a failed operation is logged as an error, callers only add debug detail
+    def add_failure(self, operation, error):
+        logger.error("Operation failed: %s, error: %s", operation.name, error)
+        with self.lock:
+            self.failures.append((operation.name, str(error)))
+        if self.progress:
+            self.progress.add("failed")
+
+    def __str__(self):
+        return f"succeeded: {self.succeeded}, failed: {len(self.failures)}"
+
+
+class BoundedExecutor:
+    def __init__(self, max_workers=4, per_host_limit=4, rate=10):
+        self.max_workers = max(1, max_workers)
+        self.per_host_limit = max(1, per_host_limit)
+        self.bucket = TokenBucket(rate)
+        self.host_slots = {}
+        self.lock = threading.Lock()
+
+    def _host_slot(self, host):
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self.host_slots[host]
+
+    def _run_one(self, operation, result):
+        with self._host_slot(operation.host):
+            self.bucket.acquire()
+            try:
+                operation.func(*operation.args)
+            except Exception as e:
+                logger.debug("Operation raised: %s", operation.name, exc_info=True)
+                result.add_failure(operation, e)
+            else:
+                result.add_success()
+
+    def run(self, operations, progress=None):
+        result = ExecutionResult(progress)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for operation in operations:
+                pool.submit(self._run_one, operation, result)
+        return result
@@ -0,0 +1,173 @@
+import datetime
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+
+from shared.models import AttendanceData, IngestionCheckpoint
+from shared.storage import serialized_write
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+TRANSACTIONS_SOURCE = "transactions"
+PUNCH_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+LATENESS_DECAY = 0.95
+
+
+def parse_punch_time(value):
+    # fromisoformat is far cheaper than strptime on every ingested record, the length and separator checks keep
+    # it to the exact PUNCH_TIME_FORMAT shape so no offset-aware or 'T' separated value slips through
+    if len(value) != 19 or value[10] != " ":
+        raise ValueError(f"time data {value!r} does not match format {PUNCH_TIME_FORMAT!r}")
+    return datetime.datetime.fromisoformat(value)
+
+
+def upload_lateness(data, punch_time):
+    if not data.get('upload_time'):
+        return None
+    try:
+        return (parse_punch_time(data['upload_time']) - punch_time).total_seconds()
+    except ValueError:
+        return None
+
+
+class IngestionResult:
+    # running totals only, each page is dropped once it is stored so a deep catch-up keeps memory flat
+    def __init__(self):
+        self.records_seen = 0
+        self.new_count = 0
+        self.max_attn_id = None
+        self.max_punch_time = None
+        self.max_upload_lateness = 0
+        # new punches the device did not stamp with an upload_time, only the earliest one decides their lateness
+        self.earliest_unstamped_punch = None
+
+    def add_page(self, records, new_records):
+        self.records_seen += len(records)
+        self.new_count += len(new_records)
+        new_ids = {data['id'] for data in new_records}
+        for data in records:
+            punch_time = parse_punch_time(data['punch_time'])
+            if self.max_attn_id is None or data['id'] > self.max_attn_id:
+                self.max_attn_id = data['id']
+            if self.max_punch_time is None or punch_time > self.max_punch_time:
+                self.max_punch_time = punch_time
+            if data['id'] not in new_ids:
+                continue
+            lateness = upload_lateness(data, punch_time)
+            if lateness is not None:
+                self.max_upload_lateness = max(self.max_upload_lateness, lateness)
+            elif self.earliest_unstamped_punch is None or punch_time < self.earliest_unstamped_punch:
+                self.earliest_unstamped_punch = punch_time
+
+    def max_lateness(self, checkpoint, now):
+        lateness = self.max_upload_lateness
+        earliest = self.earliest_unstamped_punch
+        # a new punch older than what we already had arrived late, at least by the time it took to show up
+        if earliest and checkpoint.last_punch_time and earliest < checkpoint.last_punch_time:
+            lateness = max(lateness, (now - earliest).total_seconds())
+        return lateness
+
+    def __bool__(self):
+        return bool(self.new_count)
+
+    def __str__(self):
+        return f"seen: {self.records_seen}, new: {self.new_count}"
+
+
+def adopt_pushed_rows(site_id, rows):
+    # punches pushed over ADMS have no transaction id yet, polling fills it in instead of storing them twice
+    timestamps = [row.timestamp for row in rows]
+    pushed = {
+        (user_id, timestamp): pk for pk, user_id, timestamp in AttendanceData.objects.filter(
+            site_id=site_id, attn_id__isnull=True, timestamp__range=(min(timestamps), max(timestamps)),
+        ).values_list('pk', 'user_id', 'timestamp')
+    }
+    remaining = []
+    for row in rows:
+        try:
+            pk = pushed.pop((int(row.user_id), row.timestamp), None)
+        except (TypeError, ValueError):
+            pk = None
+        if pk is None:
+            remaining.append(row)
+        elif not AttendanceData.objects.filter(site_id=site_id, attn_id=row.attn_id).exists():
+            AttendanceData.objects.filter(pk=pk).update(attn_id=row.attn_id)
+    return remaining
+
+
+# rows all belong to one site, the one whose bridge fetched them
+@serialized_write
+def insert_attendance_rows(rows):
+    if not rows:
+        return set()
+    site_id = rows[0].site_id
+    if settings.ADMS_ENABLED:
+        rows = adopt_pushed_rows(site_id, rows)
+    last_pk = AttendanceData.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+    AttendanceData.objects.bulk_create(rows, batch_size=500, ignore_conflicts=True)
+    return set(AttendanceData.objects.filter(site_id=site_id, pk__gt=last_pk).values_list('attn_id', flat=True))
+
+
+@serialized_write
+def get_checkpoint(source=TRANSACTIONS_SOURCE, site=None):
+    checkpoint, created = IngestionCheckpoint.objects.get_or_create(source=source)
+    if created:
+        logs = AttendanceData.objects.filter(site=site) if site else AttendanceData.objects.all()
+        latest_log = logs.order_by('-timestamp').first()
+        if latest_log:
+            checkpoint.last_attn_id = latest_log.attn_id
+            checkpoint.last_punch_time = latest_log.timestamp
+            checkpoint.save()
+    return checkpoint
+
+
+def incremental_start_time(checkpoint, now=None):
+    now = now or datetime.datetime.now()
+    if not checkpoint.last_punch_time:
+        return now - timedelta(hours=6)
+    return checkpoint.last_punch_time - timedelta(seconds=settings.ATTN_INCREMENTAL_OVERLAP)
+
+
+def catchup_start_time(checkpoint, deep=False, now=None):
+    now = now or datetime.datetime.now()
+    min_window = timedelta(minutes=settings.ATTN_MIN_CATCHUP_MINUTES)
+    max_window = timedelta(days=settings.ATTN_MAX_CATCHUP_DAYS)
+    if deep:
+        # lateness is only learned from punches that were fetched, the floor keeps a device that was offline
+        # over a long weekend covered even while nothing late has been seen yet
+        if not checkpoint.last_punch_time:
+            return now - max_window
+        behind = timedelta(seconds=checkpoint.late_arrival_seconds * settings.ATTN_LATENESS_SAFETY_FACTOR)
+        behind = max(behind, timedelta(hours=settings.ATTN_DEEP_CATCHUP_MIN_HOURS))
+        return max(checkpoint.last_punch_time - behind, now - max_window)
+
+    window = timedelta(seconds=checkpoint.late_arrival_seconds * settings.ATTN_LATENESS_SAFETY_FACTOR)
+    if checkpoint.last_catchup_at:
+        # the bridge was down or the last sweep failed, cover the whole gap
+        window += now - checkpoint.last_catchup_at
+
+    window = min(max(window, min_window), max_window)
+    return now - window
+
+
+@serialized_write
+def advance_checkpoint(checkpoint, result, catchup=False, deep=False, now=None):
+    now = now or datetime.datetime.now()
+    lateness = result.max_lateness(checkpoint, now)
+    checkpoint.late_arrival_seconds = max(lateness, checkpoint.late_arrival_seconds * LATENESS_DECAY)
+
+    if result.max_attn_id is not None and (checkpoint.last_attn_id or 0) < result.max_attn_id:
+        checkpoint.last_attn_id = result.max_attn_id
+    if result.max_punch_time and (not checkpoint.last_punch_time or checkpoint.last_punch_time < result.max_punch_time):
+        checkpoint.last_punch_time = result.max_punch_time
+    checkpoint.last_success_at = now
+    if catchup:
+        checkpoint.last_catchup_at = now
+    if deep:
+        checkpoint.last_deep_catchup_at = now
+    checkpoint.save()
+    if lateness:
+        logger.info("Late punches observed for %s, max lateness: %.0fs", checkpoint.source, lateness)
+    return checkpoint
@@ -0,0 +1,135 @@
+import datetime
+import threading
+
+from django.db import IntegrityError, close_old_connections, transaction
+
+from shared.coordinator import ATTENDANCE_INGEST, CLOUD_UPLOAD, INTERACTIVE, USER_SYNC, coordinator
+from shared.ingestion import IngestionResult
+from shared.log_pipeline import redact
+from shared.models import BridgeJob
+from shared.progress import Progress
+from shared.sites import default_site, scoped_key
+from shared.storage import db_write, serialized_write
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+UPDATE_USERS = "update_users"
+UPDATE_LOCAL_ATTN = "update_local_attn"
+UPDATE_CLOUD_ATTN = "update_cloud_attn"
+
+PROGRESS_SAVE_SECONDS = 1
+
+JOB_KINDS = {
+    UPDATE_USERS: (USER_SYNC, lambda bridge_inst, progress: bridge_inst.update_users(full_scan=True, progress=progress)),
+    UPDATE_LOCAL_ATTN: (ATTENDANCE_INGEST, lambda bridge_inst, progress: bridge_inst.update_local_attendance(progress=progress)),
+    UPDATE_CLOUD_ATTN: (CLOUD_UPLOAD, lambda bridge_inst, progress: bridge_inst.update_cloud_attendance(progress=progress)),
+}
+
+
+def submit_job(kind, site=None):
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    return create_or_attach_job(kind, site or default_site())
+
+
+# the lookup and the insert run as one serialized write, the partial unique constraint covers other processes
+@serialized_write
+def create_or_attach_job(kind, site):
+    in_flight = BridgeJob.objects.filter(site=site, kind=kind, status__in=[BridgeJob.QUEUED, BridgeJob.RUNNING])
+    while True:
+        job = in_flight.first()
+        if job:
+            return job, False
+        try:
+            with transaction.atomic():
+                return BridgeJob.objects.create(site=site, kind=kind), True
+        except IntegrityError:
+            logger.info("Bridge job %s was created concurrently, attaching to it", kind)
+
+
+def job_as_dict(job):
+    end = job.finished_at or (datetime.datetime.now() if job.started_at else None)
+    return {
+        "id": str(job.id),
+        "kind": job.kind,
+        "site": job.site.key,
+        "status": job.status,
+        "result": job.result,
+        "progress": job.progress,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "duration": (end - job.started_at).total_seconds() if end and job.started_at else None,
+    }
+
+
+def job_result(value):
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, IngestionResult):
+        return {"seen": value.records_seen, "new": value.new_count}
+    return {"count": value} if value is not None else None
+
+
+def save_progress(job, progress, done):
+    saved_version = 0
+    while not done.wait(PROGRESS_SAVE_SECONDS):
+        version, values = progress.snapshot()
+        if version != saved_version:
+            db_write(BridgeJob.objects.filter(pk=job.pk).update, progress=values)
+            saved_version = version
+    close_old_connections()
+
+
+def run_job(bridge_inst, job):
+    resource, func = JOB_KINDS[job.kind]
+    site = bridge_inst.site
+    progress = Progress()
+    done = threading.Event()
+    watcher = threading.Thread(target=save_progress, args=(job, progress, done), name=f"bridge-job-progress-{job.kind}", daemon=True)
+    watcher.start()
+    try:
+        trigger = coordinator.submit(
+            scoped_key(site, job.kind), scoped_key(site, resource), func, bridge_inst, progress,
+            priority=INTERACTIVE, wait=True,
+        )
+        job.result = job_result(trigger.result)
+        # errors are served by the unauthenticated status endpoint, exception texts carry urls with tokens
+        job.error = redact(str(trigger.error)) if trigger.error else None
+        job.status = BridgeJob.FAILED if trigger.error else BridgeJob.DONE
+    except Exception as e:
+        logger.exception("Bridge job %s failed: %s", job.id, e)
+        job.error = redact(str(e))
+        job.status = BridgeJob.FAILED
+    finally:
+        done.set()
+        watcher.join()
+        job.progress = progress.snapshot()[1] or None
+        job.finished_at = datetime.datetime.now()
+        db_write(job.save, update_fields=["status", "result", "progress", "error", "finished_at"])
+        close_old_connections()
+
+
+# bridges maps site pk to that site's bridge, jobs for a disabled site wait until it is enabled again
+def process_jobs(bridges):
+    for job in BridgeJob.objects.filter(status=BridgeJob.QUEUED).order_by('created_at'):
+        bridge_inst = bridges.get(job.site_id)
+        if bridge_inst is None:
+            continue
+        claimed = db_write(
+            BridgeJob.objects.filter(pk=job.pk, status=BridgeJob.QUEUED).update,
+            status=BridgeJob.RUNNING, started_at=datetime.datetime.now(),
+        )
+        if not claimed:
+            continue
+        job.refresh_from_db()
+        threading.Thread(target=run_job, args=(bridge_inst, job), name=f"bridge-job-{job.kind}", daemon=True).start()
+
+
+def fail_interrupted_jobs():
+    return db_write(
+        BridgeJob.objects.filter(status=BridgeJob.RUNNING).update,
+        status=BridgeJob.FAILED, error="Interrupted by bridge restart", finished_at=datetime.datetime.now(),
+    )
@@ -0,0 +1,93 @@
+import datetime
+import os
+import socket
+import threading
+import uuid
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from shared import scheduler
+from shared.models import BridgeLease
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+
+class LeaderLease:
+    def __init__(self, name="bridge", ttl=60):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+
+    def acquire(self):
+        now = datetime.datetime.now()
+        updated = BridgeLease.objects.filter(name=self.name).filter(
+            Q(holder=self.holder) | Q(holder__isnull=True) | Q(expires_at__isnull=True) | Q(expires_at__lt=now)
+        ).update(holder=self.holder, expires_at=now + timedelta(seconds=self.ttl), renewed_at=now)
+        if not updated:
+            try:
+                # a savepoint keeps a caller's transaction usable when another process created the row first
+                with transaction.atomic():
+                    BridgeLease.objects.create(
+                        name=self.name, holder=self.holder, expires_at=now + timedelta(seconds=self.ttl), renewed_at=now,
+                    )
+                updated = 1
+            except IntegrityError:
+                updated = 0
+
+        if updated and not self.held:
+            logger.info("Acquired bridge lease %s as %s", self.name, self.holder)
+        elif not updated and self.held:
+            logger.warning("Lost bridge lease %s", self.name)
+        self.held = bool(updated)
+        return self.held
+
+    def release(self):
+        BridgeLease.objects.filter(name=self.name, holder=self.holder).update(holder=None, expires_at=None)
+        if self.held:
+            logger.info("Released bridge lease %s", self.name)
+        self.held = False
+
+
+def run_under_lease(lease, stopping, initial_wait=0):
+    # runs the scheduler only while holding the lease, a standby takes over once the holder stops renewing it
+    renew_every = max(1, lease.ttl // 3)
+    running = None
+    stopping.wait(initial_wait)
+    try:
+        while not stopping.is_set():
+            try:
+                leader = lease.acquire()
+            except Exception as e:
+                logger.exception("Lease renewal failed: %s", e)
+                leader = False
+
+            if leader and not running:
+                try:
+                    running = scheduler.start()
+                except Exception as e:
+                    logger.exception("Bridge scheduler failed to start: %s", e)
+            elif not leader and running:
+                scheduler.stop(*running)
+                running = None
+            stopping.wait(renew_every)
+    finally:
+        if running:
+            scheduler.stop(*running)
+        lease.release()
+
+
+def start_web_standby(ttl):
+    # installs that only launch the web server keep syncing, a run_bridge worker started alongside it gets one
+    # lease period to take the lease first
+    lease = LeaderLease(ttl=ttl)
+    thread = threading.Thread(
+        target=run_under_lease, args=(lease, threading.Event()), kwargs={"initial_wait": ttl},
+        name="bridge-web-standby", daemon=True,
+    )
+    thread.start()
+    logger.info("Web process standing by for the bridge lease as %s", lease.holder)
+    return thread
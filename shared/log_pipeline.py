@@ -0,0 +1,108 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import re
+from urllib.parse import urlparse
+
+from shared import metrics
+
+STRUCTURED_FIELDS = ("endpoint", "method", "status", "latency", "page", "count", "bytes", "job")
+
+REDACTIONS = (
+    (re.compile(r"(JWT|Bearer|Token)\s+[A-Za-z0-9\-_\.=]+"), r"\1 ***"),
+    (re.compile(r"([?&](?:token|password)=)[^&\s'\"]+", re.IGNORECASE), r"\1***"),
+    (re.compile(r"(['\"](?:token|password|access|refresh)['\"]\s*:\s*['\"])[^'\"]+", re.IGNORECASE), r"\1***"),
+    (re.compile(r"eyJ[A-Za-z0-9\-_]+\.[A-Za-z0-9\-_]+\.[A-Za-z0-9\-_]+"), "***"),
+)
+
+
+def redact(text):
+    for pattern, replacement in REDACTIONS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def truncate(value, limit=200):
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... ({len(text)} chars)"
+
+
+def endpoint_of(url):
+    return urlparse(url).path
+
+
+def structured_fields(record):
+    return {field: getattr(record, field) for field in STRUCTURED_FIELDS if hasattr(record, field)}
+
+
+class RedactingFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        fields = structured_fields(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return redact(text)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+            "thread": record.threadName,
+        }
+        data.update(structured_fields(record))
+        if record.exc_info:
+            data["exception"] = redact(self.formatException(record.exc_info))
+        return json.dumps(data, default=str)
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    # formatting and file I/O happen on the listener thread, not on the caller's
+    def __init__(self, target, queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.target = target
+        self.listener = logging.handlers.QueueListener(self.queue, target, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.stop_listener)
+
+    def stop_listener(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def setFormatter(self, fmt):
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.log_records_dropped.inc(handler=self.name or type(self.target).__name__)
+
+    def close(self):
+        self.stop_listener()
+        self.target.close()
+        super().close()
+
+
+class BackgroundRotatingFileHandler(BackgroundHandler):
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding=None, queue_size=10000):
+        super().__init__(
+            logging.handlers.RotatingFileHandler(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding),
+            queue_size=queue_size,
+        )
+
+
+class BackgroundStreamHandler(BackgroundHandler):
+    def __init__(self, queue_size=10000):
+        super().__init__(logging.StreamHandler(), queue_size=queue_size)
@@ -0,0 +1,130 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+LOG_HEADER = re.compile(r"^\[[^\]]+\] (?P<level>[A-Z]+) ")
+
+
+def decode_line(raw):
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("latin-1")
+
+
+def parse_cursor(value):
+    if not value:
+        return None
+    try:
+        inode, offset = value.split(":")
+        return int(inode), int(offset)
+    except ValueError:
+        return None
+
+
+def format_cursor(cursor):
+    return f"{cursor[0]}:{cursor[1]}" if cursor else None
+
+
+class LogReader:
+    def __init__(self, path, backup_count=5, block_size=64 * 1024, max_indexes=16):
+        self.path = str(path)
+        self.backup_count = backup_count
+        self.block_size = block_size
+        self.max_indexes = max_indexes
+        self.page_indexes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def files(self):
+        # newest first: django.log, django.log.1 ... django.log.N
+        paths = [self.path] + [f"{self.path}.{i}" for i in range(1, self.backup_count + 1)]
+        files = []
+        for path in paths:
+            try:
+                files.append((path, os.stat(path)))
+            except OSError:
+                continue
+        return files
+
+    def lines_backward(self, cursor=None):
+        # yields (line, cursor) where cursor points at the start of that line
+        files = self.files()
+        start = 0
+        if cursor:
+            inodes = [stat.st_ino for _, stat in files]
+            if cursor[0] not in inodes:
+                return
+            start = inodes.index(cursor[0])
+
+        for index, (path, stat) in enumerate(files[start:], start):
+            end = cursor[1] if cursor and index == start else stat.st_size
+            with open(path, "rb") as f:
+                yield from self._file_lines_backward(f, stat.st_ino, end)
+
+    def _file_lines_backward(self, f, inode, end):
+        position = end
+        remainder = b""
+        while position > 0:
+            read_size = min(self.block_size, position)
+            position -= read_size
+            f.seek(position)
+            block = f.read(read_size) + remainder
+            lines = block.split(b"\n")
+            remainder = lines.pop(0)
+            line_end = position + len(block)
+            for raw in reversed(lines):
+                line_end -= len(raw) + 1
+                if raw.strip(b"\r"):
+                    yield decode_line(raw.rstrip(b"\r")), (inode, line_end + 1)
+        if remainder.strip(b"\r"):
+            yield decode_line(remainder.rstrip(b"\r")), (inode, 0)
+
+    def read_page(self, cursor=None, page_size=60, level=None, query=None):
+        level = level.upper() if level else None
+        query = query.lower() if query else None
+        filtered = bool(level or query)
+
+        logs, group = [], []
+        next_cursor = None
+        for line, line_cursor in self.lines_backward(cursor):
+            if len(logs) >= page_size:
+                break
+            next_cursor = line_cursor
+            if not filtered:
+                logs.append(line)
+                continue
+            # reading backwards, traceback lines arrive before the record header they belong to
+            group.append(line)
+            header = LOG_HEADER.match(line)
+            if not header:
+                continue
+            if (not level or header.group("level") == level) and \
+                    (not query or any(query in item.lower() for item in group)):
+                logs.extend(group)
+            group = []
+
+        has_more = next_cursor is not None and any(True for _ in self.lines_backward(next_cursor))
+        return logs, next_cursor if has_more else None
+
+    def page(self, number, page_size=60, level=None, query=None):
+        key = (page_size, level, query)
+        with self.lock:
+            if number <= 1 or key not in self.page_indexes:
+                self.page_indexes[key] = {1: None}
+            index = self.page_indexes[key]
+            self.page_indexes.move_to_end(key)
+            while len(self.page_indexes) > self.max_indexes:
+                self.page_indexes.popitem(last=False)
+            known = max(page for page in index if page <= number)
+            cursor = index[known]
+
+        logs = []
+        for current in range(known, number + 1):
+            if current > 1 and cursor is None:
+                break
+            logs, next_cursor = self.read_page(cursor, page_size, level, query)
+            with self.lock:
+                index[current + 1] = next_cursor
+            cursor = next_cursor
+        return logs, cursor
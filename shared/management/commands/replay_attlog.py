@@ -0,0 +1,78 @@
+import datetime
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from shared.ingestion import PUNCH_TIME_FORMAT
+
+
+def recorded_lines(paths):
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield line.rstrip("\r\n")
+
+
+def generated_lines(count, users):
+    started = datetime.datetime.now() - datetime.timedelta(seconds=count)
+    for i in range(count):
+        punch_time = (started + datetime.timedelta(seconds=i)).strftime(PUNCH_TIME_FORMAT)
+        yield f"{1 + i % users}\t{punch_time}\t0\t1\t0\t0\t0"
+
+
+def batches(lines, size):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    help = "Act as a ZKTeco terminal and push recorded or generated ATTLOG batches to the ADMS receiver"
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="base url of the bridge web app, e.g. http://127.0.0.1:8000")
+        parser.add_argument("files", nargs="*", help="recorded ATTLOG payloads, one punch per line")
+        parser.add_argument("--sn", default="SIMULATED0001")
+        parser.add_argument("--generate", type=int, default=0, help="push this many synthetic punches instead")
+        parser.add_argument("--users", type=int, default=50)
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--interval", type=float, default=0, help="seconds to wait between batches")
+
+    def handle(self, *args, **options):
+        if not options["files"] and not options["generate"]:
+            raise CommandError("Pass recorded ATTLOG files or --generate")
+        cdata_url = f"{options['url'].rstrip('/')}/iclock/cdata"
+        getrequest_url = f"{options['url'].rstrip('/')}/iclock/getrequest"
+        sn = options["sn"]
+
+        session = requests.Session()
+        response = session.get(cdata_url, params={"SN": sn, "options": "all", "pushver": "2.4.1"}, timeout=10)
+        if response.status_code != 200:
+            raise CommandError(f"Handshake failed: {response.status_code} {response.text[:200]}")
+        self.stdout.write(response.text)
+
+        lines = recorded_lines(options["files"]) if options["files"] else generated_lines(options["generate"], options["users"])
+        pushed, failed_batches, started = 0, 0, time.monotonic()
+        for stamp, batch in enumerate(batches(lines, options["batch_size"]), 1):
+            response = session.post(
+                cdata_url, params={"SN": sn, "table": "ATTLOG", "Stamp": stamp},
+                data="\n".join(batch).encode(), headers={"Content-Type": "text/plain"}, timeout=30,
+            )
+            if response.status_code == 200 and response.text.startswith("OK"):
+                pushed += len(batch)
+            else:
+                failed_batches += 1
+                self.stderr.write(f"Batch {stamp} rejected: {response.status_code} {response.text[:200]}")
+            session.get(getrequest_url, params={"SN": sn}, timeout=10)
+            if options["interval"]:
+                time.sleep(options["interval"])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"Pushed {pushed} punches in {elapsed:.2f}s, failed batches: {failed_batches}")
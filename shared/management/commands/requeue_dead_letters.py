@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shared.models import Site
+from shared.outbox import outbox_stats, requeue_dead_letters
+
+
+class Command(BaseCommand):
+    help = "Give dead-lettered attendance rows a fresh set of upload attempts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--site", help="only requeue rows of this site key")
+
+    def handle(self, *args, **options):
+        site = None
+        if options["site"]:
+            site = Site.objects.filter(key=options["site"]).first()
+            if site is None:
+                raise CommandError(f"Unknown site: {options['site']}")
+        requeued = requeue_dead_letters(site)
+        self.stdout.write(f"Requeued {requeued} rows, dead letter left: {outbox_stats(site=site)['dead_letter']}")
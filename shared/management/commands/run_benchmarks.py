@@ -0,0 +1,100 @@
+import ast
+import json
+import logging
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from shared.benchmarks.scenarios import (
+    SCENARIOS, AttendanceBackfill, OutageRecovery, PollingSweep, UserReconciliation, run_scenario,
+)
+
+
+def parse_override(value):
+    key, _, raw = value.partition("=")
+    if not key or not raw:
+        raise CommandError(f"Invalid setting override: {value}, expected KEY=VALUE")
+    try:
+        return key, ast.literal_eval(raw)
+    except (ValueError, SyntaxError):
+        return key, raw
+
+
+def megabytes(value):
+    return f"{value / 1024 / 1024:.1f}MB" if value is not None else "-"
+
+
+class Command(BaseCommand):
+    help = "Benchmark the sync bridge against in-process fake ZKBioTime and cloud servers, on a throwaway database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenarios", nargs="*", help=f"any of {', '.join(SCENARIOS)}, all by default")
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--churn", type=float, default=0.05)
+        parser.add_argument("--punches", type=int, default=1000000)
+        parser.add_argument("--backlog", type=int, default=50000)
+        parser.add_argument("--outage-runs", type=int, default=5)
+        parser.add_argument("--history", type=int, default=20000, help="punches already stored when polling")
+        parser.add_argument("--history-days", type=int, default=10)
+        parser.add_argument("--page-size", type=int, default=100)
+        parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every fake server response")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake server responses that are 503s")
+        parser.add_argument("--engine", choices=["sync", "async"], help="shortcut for --set BRIDGE_ENGINE=...")
+        parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="override a setting")
+        parser.add_argument("--json", help="write the results to this file")
+        parser.add_argument("--log-level", default="WARNING")
+
+    def build_scenarios(self, options):
+        common = {"latency": options["latency"], "error_rate": options["error_rate"], "page_size": options["page_size"]}
+        scenarios = {
+            "users": lambda: UserReconciliation(users=options["users"], churn=options["churn"], **common),
+            "backfill": lambda: AttendanceBackfill(punches=options["punches"], **common),
+            "outage": lambda: OutageRecovery(backlog=options["backlog"], outage_runs=options["outage_runs"], **common),
+            "polling": lambda: PollingSweep(history=options["history"], days=options["history_days"], **common),
+        }
+        unknown = set(options["scenarios"]) - set(scenarios)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        return [scenarios[name]() for name in (options["scenarios"] or list(SCENARIOS))]
+
+    def handle(self, *args, **options):
+        overrides = dict(parse_override(value) for value in options["set"])
+        if options["engine"]:
+            overrides["BRIDGE_ENGINE"] = options["engine"]
+        scenarios = self.build_scenarios(options)
+        logging.getLogger("debug_logger").setLevel(options["log_level"].upper())
+
+        # never run against the bridge database, a file-backed test database keeps WAL behaviour realistic
+        db_file = os.path.join(tempfile.mkdtemp(prefix="wi3bit-bench-"), "benchmark.sqlite3")
+        connection.settings_dict["TEST"]["NAME"] = db_file
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        results = []
+        try:
+            for scenario in scenarios:
+                self.stdout.write(f"Running {scenario.name}: {scenario.params()}")
+                result = run_scenario(scenario, overrides)
+                results.append(result)
+                self.report(result)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options["json"]:
+            with open(options["json"], "w", encoding="utf-8") as f:
+                json.dump([result.as_dict() for result in results], f, indent=2, default=str)
+            self.stdout.write(f"Results written to {options['json']}")
+
+    def report(self, result):
+        write = self.stdout.write if not result.error else self.stderr.write
+        write(
+            f"  {result.name}: {result.wall_time}s, {result.total_requests} requests, "
+            f"peak memory {megabytes(result.peak_memory)} (max rss {megabytes(result.max_rss)}), "
+            f"{result.db_writes} db writes ({result.db_rows} rows)"
+        )
+        for route, count in result.requests.items():
+            self.stdout.write(f"    {route}: {count}")
+        for key, value in result.details.items():
+            self.stdout.write(f"    {key}: {value}")
+        if result.error:
+            self.stderr.write(f"  {result.name} failed: {result.error}")
@@ -0,0 +1,24 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shared.leader import LeaderLease, run_under_lease
+
+
+class Command(BaseCommand):
+    help = "Run the Wi3bit sync bridge scheduler, polling only while holding the leader lease"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lease-ttl", type=int, default=settings.BRIDGE_LEASE_TTL)
+
+    def handle(self, *args, **options):
+        stopping = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stopping.set())
+
+        lease = LeaderLease(ttl=options["lease_ttl"])
+        self.stdout.write(f"Bridge worker {lease.holder} started")
+        run_under_lease(lease, stopping)
+        self.stdout.write("Bridge worker stopped")
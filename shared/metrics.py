@@ -0,0 +1,201 @@
+import os
+import re
+import threading
+import time
+
+# Each thread updates its own shard without locking; shards are only summed when scraped.
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 60)
+NUMERIC_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def normalize_endpoint(path):
+    return NUMERIC_SEGMENT.sub("/{id}", path or "/")
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.local = threading.local()
+        self.shards = []
+        self.shards_lock = threading.Lock()
+        self.retired = {}
+
+    def shard(self):
+        values = getattr(self.local, "values", None)
+        if values is None:
+            values = self.local.values = {}
+            with self.shards_lock:
+                self.shards.append((threading.current_thread(), values))
+        return values
+
+    def merge(self, into, key, value):
+        into[key] = into.get(key, 0) + value
+
+    def collect(self):
+        # shards of finished threads are folded into one retired shard so pool threads don't pile up
+        with self.shards_lock:
+            live = []
+            for thread, values in self.shards:
+                if thread.is_alive():
+                    live.append((thread, values))
+                else:
+                    for key, value in list(values.items()):
+                        self.merge(self.retired, key, value)
+            self.shards = live
+            shards = [values for _, values in live] + [self.retired]
+        totals = {}
+        for values in shards:
+            for key, value in list(values.items()):
+                self.merge(totals, key, value)
+        return totals
+
+    def key(self, labels):
+        return tuple((name, labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        values = self.shard()
+        key = self.key(labels)
+        values[key] = values.get(key, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{label_text(key)} {value}")
+        return lines
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.values = {}
+
+    def set(self, value, **labels):
+        # last write wins, a single dict assignment is atomic under the GIL
+        self.values[self.key(labels)] = value
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(list(self.values.items())):
+            if value is not None:
+                lines.append(f"{self.name}{label_text(key)} {value}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        values = self.shard()
+        key = self.key(labels)
+        series = values.get(key)
+        if series is None:
+            series = values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def merge(self, into, key, value):
+        merged = into.setdefault(key, [0] * (len(self.buckets) + 2))
+        for i, item in enumerate(list(value)):
+            merged[i] += item
+
+    def render(self):
+        lines = self.header()
+        totals = self.collect()
+        for key, series in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{label_text(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{label_text(key)} {series[-1]}")
+            lines.append(f"{self.name}_count{label_text(key)} {cumulative}")
+        return lines
+
+
+upstream_request_seconds = Histogram(
+    "bridge_upstream_request_seconds", "Latency of upstream HTTP requests", ("upstream", "endpoint", "method", "status"),
+)
+pages_fetched = Counter("bridge_pages_fetched_total", "Pages fetched from paginated upstream APIs", ("stream",))
+records_fetched = Counter("bridge_records_fetched_total", "Records fetched from paginated upstream APIs", ("stream",))
+punches_ingested = Counter("bridge_punches_ingested_total", "New punches stored in AttendanceData", ("site",))
+punches_uploaded = Counter("bridge_punches_uploaded_total", "Punches acknowledged by the cloud", ("site",))
+upload_bytes = Counter(
+    "bridge_upload_bytes_total", "Attendance upload body bytes, as sent and as the plain JSON equivalent",
+    ("site", "format", "kind"),
+)
+job_runs = Counter("bridge_job_runs_total", "Scheduler job runs", ("job", "outcome"))
+job_duration_seconds = Histogram(
+    "bridge_job_duration_seconds", "Scheduler job run durations", ("job",), buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 300, 900),
+)
+job_last_success = Gauge("bridge_job_last_success_timestamp_seconds", "Unix time of the last successful run", ("job",))
+job_last_duration = Gauge("bridge_job_last_duration_seconds", "Duration of the last run", ("job",))
+job_merged = Counter("bridge_job_merged_total", "Triggers folded into a run of the same job that was already queued", ("job",))
+job_overruns = Counter("bridge_job_overruns_total", "Runs that took longer than their schedule interval", ("job",))
+upload_worker_runs = Counter("bridge_upload_worker_runs_total", "Uploads started by the event driven upload worker", ("site",))
+upload_signals_coalesced = Counter(
+    "bridge_upload_signals_coalesced_total", "New punch signals folded into an upload the worker was already waiting to start",
+    ("site",),
+)
+log_records_dropped = Counter(
+    "bridge_log_records_dropped_total", "Log records dropped because a background log queue was full", ("handler",),
+)
+
+BRIDGE_METRICS = [
+    upstream_request_seconds, pages_fetched, records_fetched, punches_ingested, punches_uploaded, upload_bytes,
+    job_runs, job_duration_seconds, job_last_success, job_last_duration, job_merged, job_overruns,
+    upload_worker_runs, upload_signals_coalesced, log_records_dropped,
+]
+
+
+def render(metrics):
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def export_bridge_metrics(path):
+    # the bridge runs in its own process, the web /metrics view serves this file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(f"# exported_at {time.time()}\n")
+        f.write(render(BRIDGE_METRICS))
+    os.replace(tmp_path, path)
+
+
+def read_bridge_metrics(path, max_age):
+    try:
+        if time.time() - os.path.getmtime(path) > max_age:
+            return ""
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return ""
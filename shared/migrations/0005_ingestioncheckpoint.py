@@ -0,0 +1,27 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0004_bridgetokens_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=100, unique=True)),
+                ('last_attn_id', models.IntegerField(blank=True, null=True)),
+                ('last_punch_time', models.DateTimeField(blank=True, null=True)),
+                ('late_arrival_seconds', models.FloatField(default=0)),
+                ('last_success_at', models.DateTimeField(blank=True, null=True)),
+                ('last_catchup_at', models.DateTimeField(blank=True, null=True)),
+                ('last_deep_catchup_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+            ],
+        ),
+    ]
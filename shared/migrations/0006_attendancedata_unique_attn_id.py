@@ -0,0 +1,40 @@
+# Generated by Django 4.2.23 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+def remove_duplicate_attn_ids(apps, schema_editor):
+    AttendanceData = apps.get_model('shared', 'AttendanceData')
+    seen = set()
+    duplicate_ids = []
+    rows = AttendanceData.objects.exclude(attn_id=None).order_by('attn_id', '-synced', 'id')
+    for pk, attn_id in rows.values_list('id', 'attn_id').iterator():
+        if attn_id in seen:
+            duplicate_ids.append(pk)
+        seen.add(attn_id)
+    for i in range(0, len(duplicate_ids), 500):
+        AttendanceData.objects.filter(id__in=duplicate_ids[i:i + 500]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0005_ingestioncheckpoint'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_attn_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='attendancedata',
+            name='attn_id',
+            field=models.IntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='attendancedata',
+            index=models.Index(fields=['synced', 'timestamp'], name='attn_synced_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancedata',
+            index=models.Index(fields=['timestamp'], name='attn_timestamp_idx'),
+        ),
+    ]
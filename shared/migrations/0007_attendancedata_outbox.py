@@ -0,0 +1,33 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0006_attendancedata_unique_attn_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendancedata',
+            name='dead_letter',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='attendancedata',
+            name='last_error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='attendancedata',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='attendancedata',
+            name='upload_attempts',
+            field=models.IntegerField(default=0),
+        ),
+    ]
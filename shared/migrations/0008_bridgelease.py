@@ -0,0 +1,23 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0007_attendancedata_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BridgeLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('holder', models.CharField(blank=True, max_length=200, null=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('renewed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
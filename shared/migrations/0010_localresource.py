@@ -0,0 +1,22 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0009_bridgejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocalResource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('resource_id', models.IntegerField()),
+                ('resolved_at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0010_localresource'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserMirror',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50)),
+                ('record_id', models.CharField(max_length=100)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('data', models.JSONField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50, unique=True)),
+                ('fingerprint', models.CharField(blank=True, max_length=64, null=True)),
+                ('record_count', models.IntegerField(blank=True, null=True)),
+                ('etag', models.CharField(blank=True, max_length=200, null=True)),
+                ('last_checked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_full_scan_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='usermirror',
+            constraint=models.UniqueConstraint(fields=('source', 'record_id'), name='user_mirror_source_record_uniq'),
+        ),
+    ]
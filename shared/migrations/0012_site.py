@@ -0,0 +1,77 @@
+# Generated by Django 4.2.23 on 2026-10-18 15:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def assign_default_site(apps, schema_editor):
+    Site = apps.get_model('shared', 'Site')
+    site, created = Site.objects.get_or_create(key='default', defaults={'name': 'Default'})
+    for model_name in ('AttendanceData', 'BridgeTokens', 'BridgeJob'):
+        apps.get_model('shared', model_name).objects.filter(site__isnull=True).update(site=site)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0011_user_mirror'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Site',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.SlugField(max_length=30, unique=True)),
+                ('name', models.CharField(blank=True, max_length=200)),
+                ('local_server', models.CharField(blank=True, max_length=300)),
+                ('local_server_user', models.CharField(blank=True, max_length=200)),
+                ('local_server_pass', models.CharField(blank=True, max_length=200)),
+                ('cloud_server', models.CharField(blank=True, max_length=300)),
+                ('cloud_api_token', models.CharField(blank=True, max_length=300)),
+                ('device_serials', models.TextField(blank=True)),
+                ('enabled', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='attendancedata',
+            name='site',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='shared.site'),
+        ),
+        migrations.AddField(
+            model_name='bridgetokens',
+            name='site',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='shared.site'),
+        ),
+        migrations.AddField(
+            model_name='bridgejob',
+            name='site',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='shared.site'),
+        ),
+        migrations.RunPython(assign_default_site, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='attendancedata',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shared.site'),
+        ),
+        migrations.AlterField(
+            model_name='bridgetokens',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shared.site'),
+        ),
+        migrations.AlterField(
+            model_name='bridgejob',
+            name='site',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shared.site'),
+        ),
+        migrations.AlterField(
+            model_name='attendancedata',
+            name='attn_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='attendancedata',
+            constraint=models.UniqueConstraint(fields=('site', 'attn_id'), name='attn_site_attn_id_uniq'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0012_site'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdmsDevice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('serial_number', models.CharField(max_length=100, unique=True)),
+                ('attlog_stamp', models.CharField(blank=True, max_length=50, null=True)),
+                ('last_seen_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.23 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+def fail_duplicate_jobs(apps, schema_editor):
+    BridgeJob = apps.get_model('shared', 'BridgeJob')
+    seen = set()
+    for job in BridgeJob.objects.filter(status__in=['queued', 'running']).order_by('created_at'):
+        if (job.site_id, job.kind) in seen:
+            BridgeJob.objects.filter(pk=job.pk).update(status='failed', error='Duplicate of an in-flight job')
+        seen.add((job.site_id, job.kind))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shared', '0013_adms_device'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bridgejob',
+            name='progress',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(fail_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='bridgejob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('site', 'kind'), name='job_one_in_flight_per_kind'),
+        ),
+    ]
@@ -1,14 +1,147 @@
+import uuid
+
+from django.conf import settings
 from django.db import models
 
 
+class Site(models.Model):
+    # blank connection fields fall back to the single-site values in settings.py
+    key = models.SlugField(max_length=30, unique=True)
+    name = models.CharField(max_length=200, blank=True)
+    local_server = models.CharField(max_length=300, blank=True)
+    local_server_user = models.CharField(max_length=200, blank=True)
+    local_server_pass = models.CharField(max_length=200, blank=True)
+    cloud_server = models.CharField(max_length=300, blank=True)
+    cloud_api_token = models.CharField(max_length=300, blank=True)
+    device_serials = models.TextField(blank=True)
+    enabled = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def local_url(self):
+        return (self.local_server or settings.LOCAL_SERVER).rstrip('/')
+
+    @property
+    def local_user(self):
+        return self.local_server_user or settings.LOCAL_SERVER_USER
+
+    @property
+    def local_password(self):
+        return self.local_server_pass or settings.LOCAL_SERVER_PASS
+
+    @property
+    def cloud_url(self):
+        return (self.cloud_server or settings.CLOUD_SERVER).rstrip('/')
+
+    @property
+    def cloud_token(self):
+        return self.cloud_api_token or settings.CLOUD_API_TOKEN
+
+    def serials(self):
+        return [serial.strip() for serial in self.device_serials.split(",") if serial.strip()]
+
+    def __str__(self):
+        return self.name or self.key
+
+
 class AttendanceData(models.Model):
+    site = models.ForeignKey(Site, on_delete=models.CASCADE)
     user_id = models.IntegerField(null=True, blank=True)
     timestamp = models.DateTimeField(null=True, blank=True)
     attn_id = models.IntegerField(null=True, blank=True)
     synced = models.BooleanField(null=True, default=False)
+    upload_attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(null=True, blank=True)
+    dead_letter = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['synced', 'timestamp'], name='attn_synced_timestamp_idx'),
+            models.Index(fields=['timestamp'], name='attn_timestamp_idx'),
+        ]
+        # transaction ids are only unique within one ZKBioTime server
+        constraints = [models.UniqueConstraint(fields=['site', 'attn_id'], name='attn_site_attn_id_uniq')]
 
 
 class BridgeTokens(models.Model):
+    site = models.ForeignKey(Site, on_delete=models.CASCADE)
     token = models.TextField(null=True, blank=True)
     expired = models.BooleanField(null=True, default=False)
     created_at = models.DateTimeField(auto_now_add=True, null=True)
+
+
+class IngestionCheckpoint(models.Model):
+    source = models.CharField(max_length=100, unique=True)
+    last_attn_id = models.IntegerField(null=True, blank=True)
+    last_punch_time = models.DateTimeField(null=True, blank=True)
+    late_arrival_seconds = models.FloatField(default=0)
+    last_success_at = models.DateTimeField(null=True, blank=True)
+    last_catchup_at = models.DateTimeField(null=True, blank=True)
+    last_deep_catchup_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+
+class BridgeLease(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    holder = models.CharField(max_length=200, null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    renewed_at = models.DateTimeField(null=True, blank=True)
+
+
+class BridgeJob(models.Model):
+    QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    site = models.ForeignKey(Site, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=50)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    result = models.JSONField(null=True, blank=True)
+    progress = models.JSONField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'], name='job_status_created_idx')]
+        # at most one queued or running job per site and kind, duplicate triggers attach to it
+        constraints = [
+            models.UniqueConstraint(
+                fields=['site', 'kind'], condition=models.Q(status__in=['queued', 'running']),
+                name='job_one_in_flight_per_kind',
+            ),
+        ]
+
+
+class LocalResource(models.Model):
+    key = models.CharField(max_length=100, unique=True)
+    resource_id = models.IntegerField()
+    resolved_at = models.DateTimeField()
+
+
+class UserMirror(models.Model):
+    source = models.CharField(max_length=50)
+    record_id = models.CharField(max_length=100)
+    content_hash = models.CharField(max_length=64)
+    data = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['source', 'record_id'], name='user_mirror_source_record_uniq')]
+
+
+class UserSyncState(models.Model):
+    source = models.CharField(max_length=50, unique=True)
+    fingerprint = models.CharField(max_length=64, null=True, blank=True)
+    record_count = models.IntegerField(null=True, blank=True)
+    etag = models.CharField(max_length=200, null=True, blank=True)
+    last_checked_at = models.DateTimeField(null=True, blank=True)
+    last_full_scan_at = models.DateTimeField(null=True, blank=True)
+
+
+class AdmsDevice(models.Model):
+    serial_number = models.CharField(max_length=100, unique=True)
+    attlog_stamp = models.CharField(max_length=50, null=True, blank=True)
+    last_seen_at = models.DateTimeField(null=True, blank=True)
@@ -0,0 +1,161 @@
+import datetime
+import random
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F, Min, Q
+
+from shared import metrics
+from shared.models import AttendanceData
+from shared.storage import serialized_write
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+# the cloud blames individual rows, the chunk is bisected until they are isolated and only those count toward
+# OUTBOX_MAX_ATTEMPTS
+ROW_REJECTION_STATUSES = (400, 413, 422)
+# the cloud refuses the upload itself (token, url, format), every row would fail the same way
+RUN_FAILURE_STATUSES = (401, 403, 404, 405, 415)
+
+DELIVERED = "delivered"
+BISECT = "bisect"
+ROW_REJECTED = "row_rejected"
+RUN_FAILED = "run_failed"
+RETRY_LATER = "retry_later"
+
+
+def pending_attendance(now=None, site=None):
+    now = now or datetime.datetime.now()
+    rows = AttendanceData.objects.filter(site=site) if site else AttendanceData.objects.all()
+    return rows.filter(synced=False, dead_letter=False).filter(
+        Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+    )
+
+
+def backoff_delay(attempts):
+    delay = min(settings.OUTBOX_MAX_BACKOFF, settings.OUTBOX_BASE_BACKOFF * (2 ** max(attempts - 1, 0)))
+    return random.uniform(delay / 2, delay)
+
+
+@serialized_write
+def mark_delivered(pks):
+    AttendanceData.objects.filter(pk__in=pks).update(
+        synced=True, next_attempt_at=None, last_error=None,
+    )
+
+
+@serialized_write
+def record_failure(pks, error, now=None):
+    now = now or datetime.datetime.now()
+    rows = AttendanceData.objects.filter(pk__in=pks)
+    rows.update(upload_attempts=F('upload_attempts') + 1, last_error=str(error)[:1000])
+    rows.filter(upload_attempts__gte=settings.OUTBOX_MAX_ATTEMPTS).update(dead_letter=True)
+    for attempts in set(rows.filter(dead_letter=False).values_list('upload_attempts', flat=True)):
+        rows.filter(dead_letter=False, upload_attempts=attempts).update(
+            next_attempt_at=now + timedelta(seconds=backoff_delay(attempts))
+        )
+    dead = rows.filter(dead_letter=True).count()
+    if dead:
+        logger.error("%s attendance rows moved to dead letter, error: %s", dead, error)
+
+
+@serialized_write
+def requeue_dead_letters(site=None):
+    rows = AttendanceData.objects.filter(site=site) if site else AttendanceData.objects.all()
+    return rows.filter(dead_letter=True, synced=False).update(
+        dead_letter=False, upload_attempts=0, next_attempt_at=None,
+    )
+
+
+# 5xx, 429 and anything else unexpected is an outage, retried on the run backoff like a connection error
+def upload_outcome(status_code, chunk_size):
+    if status_code == 201:
+        return DELIVERED
+    if status_code in RUN_FAILURE_STATUSES:
+        return RUN_FAILED
+    if status_code in ROW_REJECTION_STATUSES:
+        return BISECT if chunk_size > 1 else ROW_REJECTED
+    return RETRY_LATER
+
+
+# outbox bookkeeping for an answered chunk, returns (uploaded rows, whether the upload run can continue)
+def settle_chunk(site, outcome, chunk, status_code, text, backoff):
+    pks = [row['pk'] for row in chunk]
+    if outcome == DELIVERED:
+        mark_delivered(pks)
+        metrics.punches_uploaded.inc(len(chunk), site=site.key)
+        backoff.succeeded()
+        return len(chunk), True
+    if outcome == ROW_REJECTED:
+        record_failure(pks, f"{status_code}: {text[:500]}")
+        return 0, True
+    # per-row attempts are left alone, an outage or a revoked token must not dead-letter the backlog
+    backoff.failed(f"{status_code}: {text[:500]}")
+    return 0, False
+
+
+class UploadBackoff:
+    # run level backoff for outages and responses that fail every row alike
+    def __init__(self):
+        self.failures = 0
+        self.retry_at = None
+        self.lock = threading.Lock()
+
+    def ready(self, now=None):
+        now = now or datetime.datetime.now()
+        with self.lock:
+            return self.retry_at is None or now >= self.retry_at
+
+    def failed(self, error, now=None):
+        now = now or datetime.datetime.now()
+        with self.lock:
+            if self.retry_at and now < self.retry_at:
+                # another chunk of the same run already failed
+                return
+            self.failures += 1
+            delay = backoff_delay(self.failures)
+            self.retry_at = now + timedelta(seconds=delay)
+        logger.error("Cloud attendance upload failed, next run in %.0fs: %s", delay, error)
+
+    def succeeded(self):
+        with self.lock:
+            self.failures = 0
+            self.retry_at = None
+
+
+# the aliases must not shadow the dead_letter field the filters refer to
+def outbox_stat_fields(now):
+    live = Q(dead_letter=False)
+    return {
+        "pending_rows": Count('pk', filter=live),
+        "ready_rows": Count('pk', filter=live & (Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now))),
+        "backing_off_rows": Count('pk', filter=live & Q(next_attempt_at__gt=now)),
+        "dead_letter_rows": Count('pk', filter=Q(dead_letter=True)),
+        "oldest_pending": Min('timestamp', filter=live),
+    }
+
+
+def finish_stats(totals, now):
+    oldest = totals["oldest_pending"]
+    return {
+        "pending": totals["pending_rows"],
+        "ready": totals["ready_rows"],
+        "backing_off": totals["backing_off_rows"],
+        "dead_letter": totals["dead_letter_rows"],
+        "oldest_pending_age": (now - oldest).total_seconds() if oldest else None,
+    }
+
+
+def outbox_stats(now=None, site=None):
+    now = now or datetime.datetime.now()
+    rows = AttendanceData.objects.filter(site=site) if site else AttendanceData.objects.all()
+    return finish_stats(rows.filter(synced=False).aggregate(**outbox_stat_fields(now)), now)
+
+
+# one grouped query, sites without unsynced rows are left out
+def outbox_stats_by_site(now=None):
+    now = now or datetime.datetime.now()
+    rows = AttendanceData.objects.filter(synced=False).values('site__key').annotate(**outbox_stat_fields(now))
+    return {totals['site__key']: finish_stats(totals, now) for totals in rows}
@@ -0,0 +1,136 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from shared import metrics
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+
+def log_page(name, page_number, records, elapsed):
+    metrics.pages_fetched.inc(stream=name)
+    metrics.records_fetched.inc(len(records), stream=name)
+    logger.info(
+        "Fetched %s page %s: %s records in %.2fs", name, page_number, len(records), elapsed,
+        extra={"page": page_number, "count": len(records), "latency": round(elapsed, 3)},
+    )
+
+
+class Page:
+    def __init__(self, number, records, elapsed):
+        self.number = number
+        self.records = records
+        self.elapsed = elapsed
+
+
+class PageStream:
+    def __init__(self, name, fetch_page, has_next, start_page=1, max_pages=None):
+        self.name = name
+        self.fetch_page = fetch_page
+        self.has_next = has_next
+        self.start_page = start_page
+        self.max_pages = max_pages
+        self.last_page = start_page - 1
+        self.timings = []
+
+    def pages(self):
+        page_number = self.start_page
+        fetched = 0
+        while True:
+            started = time.monotonic()
+            response_json = self.fetch_page(page_number)
+            elapsed = time.monotonic() - started
+            records = response_json['data']
+            self.timings.append((page_number, elapsed))
+            fetched += 1
+            log_page(self.name, page_number, records, elapsed)
+            yield Page(page_number, records, elapsed)
+            # only a page the consumer got through counts, one it failed on is fetched again on resume
+            self.last_page = page_number
+            if not self.has_next(response_json):
+                break
+            if self.max_pages and fetched >= self.max_pages:
+                break
+            page_number += 1
+
+    def resume_page(self):
+        return self.last_page + 1
+
+    def __iter__(self):
+        for page in self.pages():
+            yield from page.records
+
+
+class PrefetchingPageStream(PageStream):
+    def __init__(self, name, fetch_page, has_next, total_pages=None, workers=4, start_page=1, max_pages=None):
+        super().__init__(name, fetch_page, has_next, start_page=start_page, max_pages=max_pages)
+        self.total_pages = total_pages
+        self.workers = max(1, workers)
+
+    def _timed_fetch(self, page_number):
+        started = time.monotonic()
+        response_json = self.fetch_page(page_number)
+        return response_json, time.monotonic() - started
+
+    def pages(self):
+        last_allowed = self.start_page + self.max_pages - 1 if self.max_pages else None
+        next_to_schedule = self.start_page + 1
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {self.start_page: pool.submit(self._timed_fetch, self.start_page)}
+            try:
+                while futures:
+                    page_number = min(futures)
+                    response_json, elapsed = futures.pop(page_number).result()
+                    records = response_json['data']
+                    self.timings.append((page_number, elapsed))
+                    log_page(self.name, page_number, records, elapsed)
+
+                    if self.has_next(response_json):
+                        total = self.total_pages(response_json) if self.total_pages else None
+                        window, upper = (self.workers, total) if total else (1, page_number + 1)
+                        if last_allowed:
+                            upper = min(upper, last_allowed)
+                        while len(futures) < window and next_to_schedule <= upper:
+                            futures[next_to_schedule] = pool.submit(self._timed_fetch, next_to_schedule)
+                            next_to_schedule += 1
+                    else:
+                        for future in futures.values():
+                            future.cancel()
+                        futures = {}
+                    yield Page(page_number, records, elapsed)
+                    self.last_page = page_number
+            finally:
+                for future in futures.values():
+                    future.cancel()
+
+
+async def async_page_stream(name, fetch_page, has_next, total_pages, start_page=1, max_pages=None, window=8):
+    # fetch_page is a coroutine returning (response_json, elapsed); once the first page tells the total,
+    # the rest are fetched a window at a time and still yielded in page order
+    last_allowed = start_page + max_pages - 1 if max_pages else None
+    page_number = start_page
+    response_json, elapsed = await fetch_page(page_number)
+    while True:
+        records = response_json['data']
+        log_page(name, page_number, records, elapsed)
+        yield Page(page_number, records, elapsed)
+        if not has_next(response_json) or (last_allowed and page_number >= last_allowed):
+            return
+
+        total = total_pages(response_json)
+        if total:
+            upper = min(total, page_number + max(1, window))
+            if last_allowed:
+                upper = min(upper, last_allowed)
+            numbers = list(range(page_number + 1, upper + 1))
+        else:
+            numbers = [page_number + 1]
+        if not numbers:
+            return
+        results = await asyncio.gather(*(fetch_page(number) for number in numbers))
+        for number, (page_json, page_elapsed) in zip(numbers[:-1], results[:-1]):
+            log_page(name, number, page_json['data'], page_elapsed)
+            yield Page(number, page_json['data'], page_elapsed)
+        page_number = numbers[-1]
+        response_json, elapsed = results[-1]
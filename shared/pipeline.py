@@ -0,0 +1,57 @@
+import queue
+import threading
+import time
+
+from django.db import close_old_connections
+
+from shared import metrics
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+
+class UploadWorker(threading.Thread):
+    def __init__(self, upload, site_key="", debounce=2, max_delay=10):
+        super().__init__(name=f"cloud-upload-worker-{site_key}" if site_key else "cloud-upload-worker", daemon=True)
+        self.upload = upload
+        self.site_key = site_key
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.signals = queue.Queue()
+        self.stopping = threading.Event()
+
+    def notify(self, reason="new punches"):
+        self.signals.put(reason)
+
+    def stop(self):
+        self.stopping.set()
+        self.signals.put(None)
+
+    def wait_for_quiet(self):
+        # keep absorbing signals until the producer goes quiet or max_delay passes
+        deadline = time.monotonic() + self.max_delay
+        while not self.stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                signal = self.signals.get(timeout=min(self.debounce, remaining))
+            except queue.Empty:
+                return
+            if signal is None:
+                return
+            metrics.upload_signals_coalesced.inc(site=self.site_key)
+
+    def run(self):
+        while not self.stopping.is_set():
+            signal = self.signals.get()
+            if signal is None:
+                break
+            self.wait_for_quiet()
+            metrics.upload_worker_runs.inc(site=self.site_key)
+            try:
+                self.upload()
+            except Exception as e:
+                logger.exception("Cloud upload worker failed: %s", e)
+            finally:
+                close_old_connections()
@@ -0,0 +1,23 @@
+import threading
+
+
+class Progress:
+    # counters a running job publishes, the job runner copies them to BridgeJob.progress from its own thread
+    def __init__(self):
+        self.values = {}
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def update(self, **values):
+        with self.lock:
+            self.values.update(values)
+            self.version += 1
+
+    def add(self, key, count=1):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + count
+            self.version += 1
+
+    def snapshot(self):
+        with self.lock:
+            return self.version, dict(self.values)
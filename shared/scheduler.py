@@ -3,59 +3,114 @@ import subprocess
 from datetime import timedelta
 from pathlib import Path
 
+from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
 from django.conf import settings
 
+from shared.coordinator import ATTENDANCE_INGEST, CLOUD_UPLOAD, HEARTBEAT, PURGE, SWEEP, USER_SYNC, coordinator
+from shared.ingestion import TRANSACTIONS_SOURCE, advance_checkpoint, catchup_start_time, get_checkpoint, incremental_start_time
+from shared.jobs import fail_interrupted_jobs, process_jobs
+from shared.metrics import export_bridge_metrics
 from shared.models import AttendanceData
+from shared.sites import enabled_sites, scoped_key
+from shared.storage import db_write
 from shared.wi3bit_sync_bridge import Wi3bitSyncBridge
 
 
-def start():
-    scheduler = BackgroundScheduler()
-    bridge_inst = Wi3bitSyncBridge()
+def create_bridge(site=None):
+    if settings.BRIDGE_ENGINE == "async":
+        from shared.async_bridge import AsyncBridgeRunner
+        return AsyncBridgeRunner(site)
+    return Wi3bitSyncBridge(site)
 
-    scheduler.add_job(attn_heartbeat, 'interval', seconds=15, args=[bridge_inst])
-    scheduler.add_job(attn_heartbeat_1, 'interval', minutes=30, args=[bridge_inst])
-    scheduler.add_job(attn_heartbeat_2, 'interval', hours=6, args=[bridge_inst])
-    scheduler.add_job(attn_heartbeat_3, 'interval', hours=12, args=[bridge_inst])
-    scheduler.add_job(attn_heartbeat_4, 'interval', days=1, args=[bridge_inst])
 
-    scheduler.add_job(update_cloud_attendance, 'interval', minutes=1, args=[bridge_inst])
+# bridges are keyed by site pk, every site gets its own bridge, connection pools and scheduler threads
+def start():
+    scheduler = BackgroundScheduler(job_defaults={"max_instances": 1, "coalesce": True})
+    bridges = {site.pk: create_bridge(site) for site in enabled_sites()}
+    fail_interrupted_jobs()
+    for bridge_inst in bridges.values():
+        schedule_site(scheduler, bridge_inst)
 
-    scheduler.add_job(users_updator, 'interval', minutes=10, args=[bridge_inst])
+    scheduler.add_job(process_jobs, 'interval', seconds=settings.BRIDGE_JOB_POLL_SECONDS, args=[bridges])
+    scheduler.add_job(export_metrics, 'interval', seconds=settings.BRIDGE_METRICS_EXPORT_SECONDS)
 
-    scheduler.add_job(delete_old_data, 'interval', hours=6, args=[bridge_inst])
+    scheduler.add_job(
+        coordinator.job(delete_old_data.__name__, PURGE, delete_old_data, priority=SWEEP, interval=6 * 60 * 60),
+        'interval', hours=6, id=delete_old_data.__name__,
+    )
 
     if not settings.DEV_SERVER:
         scheduler.add_job(update_project, 'interval', hours=2)
 
     scheduler.start()
+    return scheduler, bridges
 
 
-def attn_heartbeat(bridge_inst):
-    latest_log = AttendanceData.objects.order_by('-timestamp').first()
-    start_time = latest_log.timestamp if latest_log else datetime.datetime.now() - timedelta(hours=6)
-    bridge_inst.update_local_attendance(start_time)
+def schedule_site(scheduler, bridge_inst):
+    site = bridge_inst.site
+    # a site whose servers hang only ties up its own executor threads
+    executor = f"site:{site.key}"
+    scheduler.add_executor(ThreadPoolExecutor(settings.SITE_SCHEDULER_WORKERS), alias=executor)
+    bridge_inst.start_upload_worker(upload=lambda: coordinator.submit(
+        scoped_key(site, "cloud_upload"), scoped_key(site, CLOUD_UPLOAD), bridge_inst.update_cloud_attendance,
+        priority=HEARTBEAT, wait=True,
+    ))
+
+    catchup_interval = settings.ATTN_CATCHUP_INTERVAL_MINUTES * 60
+    add_job(scheduler, attn_heartbeat, ATTENDANCE_INGEST, HEARTBEAT, settings.ATTN_HEARTBEAT_SECONDS, bridge_inst, executor)
+    add_job(scheduler, attn_catchup, ATTENDANCE_INGEST, SWEEP, catchup_interval, bridge_inst, executor)
+    add_job(scheduler, attn_deep_catchup, ATTENDANCE_INGEST, SWEEP, 24 * 60 * 60, bridge_inst, executor)
+
+    scheduler.add_job(
+        update_cloud_attendance, 'interval', minutes=1, args=[bridge_inst],
+        id=scoped_key(site, update_cloud_attendance.__name__), executor=executor,
+    )
+    add_job(scheduler, users_updator, USER_SYNC, SWEEP, 10 * 60, bridge_inst, executor)
+
 
+def stop(scheduler, bridges):
+    scheduler.shutdown(wait=True)
+    for bridge_inst in bridges.values():
+        if bridge_inst.upload_worker:
+            bridge_inst.upload_worker.stop()
+            bridge_inst.upload_worker.join(timeout=30)
+        bridge_inst.close()
 
-def attn_heartbeat_1(bridge_inst):
-    start_time = datetime.datetime.now() - timedelta(minutes=35)
-    bridge_inst.update_local_attendance(start_time)
+
+def add_job(scheduler, func, resource, priority, interval, bridge_inst, executor):
+    site = bridge_inst.site
+    name = scoped_key(site, func.__name__)
+    scheduler.add_job(
+        coordinator.job(name, scoped_key(site, resource), func, priority=priority, interval=interval),
+        'interval', seconds=interval, args=[bridge_inst], id=name, executor=executor,
+    )
+
+
+def site_checkpoint(bridge_inst):
+    return get_checkpoint(scoped_key(bridge_inst.site, TRANSACTIONS_SOURCE), site=bridge_inst.site)
+
+
+def attn_heartbeat(bridge_inst):
+    checkpoint = site_checkpoint(bridge_inst)
+    result = bridge_inst.update_local_attendance(incremental_start_time(checkpoint))
+    advance_checkpoint(checkpoint, result)
 
 
-def attn_heartbeat_2(bridge_inst):
-    start_time = datetime.datetime.now() - timedelta(hours=7)
-    bridge_inst.update_local_attendance(start_time)
+def attn_catchup(bridge_inst):
+    checkpoint = site_checkpoint(bridge_inst)
+    result = bridge_inst.update_local_attendance(catchup_start_time(checkpoint))
+    advance_checkpoint(checkpoint, result, catchup=True)
 
 
-def attn_heartbeat_3(bridge_inst):
-    start_time = datetime.datetime.now() - timedelta(hours=13)
-    bridge_inst.update_local_attendance(start_time)
+def attn_deep_catchup(bridge_inst):
+    checkpoint = site_checkpoint(bridge_inst)
+    result = bridge_inst.update_local_attendance(catchup_start_time(checkpoint, deep=True))
+    advance_checkpoint(checkpoint, result, deep=True)
 
 
-def attn_heartbeat_4(bridge_inst):
-    start_time = datetime.datetime.now() - timedelta(days=10)
-    bridge_inst.update_local_attendance(start_time)
+def export_metrics():
+    export_bridge_metrics(settings.BRIDGE_METRICS_FILE)
 
 
 def users_updator(bridge_inst):
@@ -63,16 +118,16 @@ def users_updator(bridge_inst):
 
 
 def update_cloud_attendance(bridge_inst):
-    bridge_inst.update_cloud_attendance()
+    bridge_inst.notify_new_punches()
 
 
-def delete_old_data(bridge_inst):
+def delete_old_data():
     attn_data = AttendanceData.objects.filter(timestamp__lte=datetime.datetime.now() - timedelta(days=10),
                                               synced=True)
     # for data in attn_data:
     #     bridge_inst.delete_attn_data(data.attn_id)
     #     data.delete()
-    attn_data.delete()
+    db_write(attn_data.delete)
 
 
 
@@ -0,0 +1,50 @@
+from shared.models import Site
+from shared.storage import serialized_write
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+DEFAULT_SITE = "default"
+
+
+@serialized_write
+def ensure_default_site():
+    site, created = Site.objects.get_or_create(key=DEFAULT_SITE, defaults={"name": "Default"})
+    return site
+
+
+def default_site():
+    return Site.objects.filter(key=DEFAULT_SITE).first() or ensure_default_site()
+
+
+def enabled_sites():
+    sites = list(Site.objects.filter(enabled=True).order_by('pk'))
+    return sites or [default_site()]
+
+
+def get_site(key=None):
+    if not key:
+        return default_site()
+    site = Site.objects.filter(key=key).first()
+    if site is None:
+        raise Exception(f'Unknown site: {key}')
+    return site
+
+
+def site_for_serial(serial_number):
+    for site in Site.objects.filter(enabled=True).exclude(device_serials=""):
+        if serial_number in site.serials():
+            return site
+    return default_site()
+
+
+# checkpoints, mirror sources, cached resources and coordinator resources keep their single-site names on the
+# default site so an upgraded install picks up where it left off
+def scoped_key(site, name):
+    if site is None or site.key == DEFAULT_SITE:
+        return name
+    return f"{site.key}:{name}"
+
+
+def base_key(name):
+    return name.rsplit(":", 1)[-1]
@@ -0,0 +1,116 @@
+import asyncio
+import functools
+import queue
+import threading
+from concurrent.futures import Future
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA synchronous=NORMAL;",
+    "PRAGMA temp_store=MEMORY;",
+)
+
+
+def begin_immediate(connection):
+    connection.cursor().execute("BEGIN IMMEDIATE")
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT * 1000)};")
+        cursor.execute(f"PRAGMA cache_size=-{settings.SQLITE_CACHE_KB};")
+    # Django 4.2 opens deferred transactions, under WAL one that reads before writing fails with
+    # SQLITE_BUSY_SNAPSHOT when another process wrote in between, and busy_timeout doesn't retry that.
+    # Taking the write lock at BEGIN makes the wait go through busy_timeout instead
+    connection._start_transaction_under_autocommit = functools.partial(begin_immediate, connection)
+
+
+class DbWriter(threading.Thread):
+    def __init__(self, batch_size=50):
+        super().__init__(name="db-writer", daemon=True)
+        self.batch_size = batch_size
+        self.writes = queue.Queue()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self.writes.put((future, func, args, kwargs))
+        return future
+
+    # batches whatever queued up while the last batch ran, a lone write never waits for company
+    def next_batch(self):
+        batch = [self.writes.get()]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.writes.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            results = []
+            try:
+                with transaction.atomic():
+                    for future, func, args, kwargs in batch:
+                        try:
+                            # a savepoint per write so one failure doesn't roll back the batch
+                            with transaction.atomic():
+                                results.append((future, func(*args, **kwargs), None))
+                        except Exception as e:
+                            results.append((future, None, e))
+            except Exception as e:
+                logger.exception("DB writer batch of %s failed: %s", len(batch), e)
+                results = [(future, None, e) for future, *_ in batch]
+                # the connection is kept open between batches, only a failed batch gets a fresh one
+                connection.close()
+
+            for future, result, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = DbWriter(batch_size=settings.DB_WRITER_BATCH_SIZE)
+            _writer.start()
+        return _writer
+
+
+def db_write(func, *args, **kwargs):
+    if not settings.DB_WRITER_ENABLED or threading.current_thread() is _writer:
+        return func(*args, **kwargs)
+    return get_writer().submit(func, *args, **kwargs).result()
+
+
+async def async_db_write(func, *args, **kwargs):
+    # awaits the writer's future, the event loop never parks a thread on a write
+    if not settings.DB_WRITER_ENABLED:
+        return await sync_to_async(func, thread_sensitive=False)(*args, **kwargs)
+    return await asyncio.wrap_future(get_writer().submit(func, *args, **kwargs))
+
+
+def serialized_write(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return db_write(func, *args, **kwargs)
+    return wrapper
@@ -1,3 +1,824 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+import requests
+from django.test import TestCase, override_settings
+
+from shared import metrics
+from shared.adms import device_allowed, parse_attlog
+from shared.async_bridge import AsyncWi3bitSyncBridge
+from shared.benchmarks.fake_servers import fake_jwt
+from shared.coordinator import HEARTBEAT, INTERACTIVE, SWEEP, JobCoordinator
+from shared.executor import BoundedExecutor
+from shared.ingestion import IngestionResult, advance_checkpoint, catchup_start_time, parse_punch_time
+from shared.jobs import UPDATE_USERS, submit_job
+from shared.leader import LeaderLease, run_under_lease
+from shared.log_pipeline import JsonFormatter, RedactingFormatter
+from shared.log_reader import LogReader
+from shared.models import AttendanceData, BridgeJob, BridgeLease, IngestionCheckpoint, LocalResource, Site
+from shared.outbox import outbox_stats, outbox_stats_by_site, pending_attendance, requeue_dead_letters
+from shared.pagination import PageStream, PrefetchingPageStream
+from shared.sites import default_site
+from shared.token_manager import TokenManager, jwt_expiry
+from shared.transport import AdaptiveThrottle, HttpTransport
+from shared.upload_format import COLUMNAR_FORMAT, JSON_FORMAT, UploadFormatNegotiator, encode_chunk
+from shared.user_sync import build_user_sync_plan
+from shared.wi3bit_sync_bridge import (
+    Wi3bitSyncBridge, attendance_idempotency_key, check_user_response, user_sync_operations,
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code, text="", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+def local_user(user_id, emp_code, first_name):
+    return {"id": user_id, "emp_code": emp_code, "first_name": first_name}
+
+
+def cloud_user(user_id, unique_id, name):
+    return {"id": user_id, "unique_id": unique_id, "name": name}
+
+
+class UserSyncPlanTests(TestCase):
+    def test_create_update_delete_and_unchanged(self):
+        local_users = [
+            local_user(11, "1", "U1 Alice"),
+            local_user(12, "2", "U2 Bob"),
+            local_user(13, "3", "U3 Carol"),
+        ]
+        cloud_users = [
+            cloud_user(1, "U1", "Alice"),
+            cloud_user(2, "U2", "Robert"),
+            cloud_user(4, "U4", "Dave"),
+        ]
+        plan = build_user_sync_plan(local_users, cloud_users)
+
+        self.assertEqual([user["id"] for user in plan.to_create], [4])
+        self.assertEqual([(local_id, user["id"]) for local_id, user in plan.to_update], [(12, 2)])
+        self.assertEqual(plan.to_delete, [13])
+        self.assertEqual(plan.unchanged, 1)
+
+    def test_emp_codes_match_cloud_ids_numerically(self):
+        plan = build_user_sync_plan([local_user(11, " 007", "U7 Bond")], [cloud_user(7, "U7", "Bond")])
+        self.assertTrue(plan.is_empty())
+        self.assertEqual(plan.unchanged, 1)
+
+    def test_duplicate_emp_codes_are_reported_and_removed_with_the_user(self):
+        local_users = [local_user(11, "1", "U1 Alice"), local_user(21, "1", "U1 Alice"), local_user(31, "1", "U1 Alice")]
+
+        plan = build_user_sync_plan(local_users, [cloud_user(1, "U1", "Alice")])
+        self.assertEqual(plan.duplicates, {1: [11, 21, 31]})
+        self.assertEqual(plan.to_delete, [])
+
+        plan = build_user_sync_plan(local_users, [])
+        self.assertEqual(plan.to_delete, [11, 21, 31])
+
+    def test_duplicate_cloud_users_are_created_once(self):
+        plan = build_user_sync_plan([], [cloud_user(5, "U5", "Eve"), cloud_user(5, "U5", "Eve")])
+        self.assertEqual(len(plan.to_create), 1)
+
+    def test_a_failed_operation_is_logged_once(self):
+        plan = build_user_sync_plan([], [cloud_user(5, "U5", "Eve")])
+
+        def create_user(cloud_user):
+            check_user_response(FakeResponse(400, '{"emp_code": ["already exists"]}'), "Creation")
+        operations = user_sync_operations(plan, "http://local/personnel/api/employees/", create_user, None, None)
+
+        with self.assertLogs("debug_logger", level="ERROR") as logs:
+            result = BoundedExecutor().run(operations)
+        self.assertEqual(result.failures, [("create 5", 'User Creation Failed, 400: {"emp_code": ["already exists"]}')])
+        self.assertEqual(len(logs.records), 1)
+
+
+class LogRedactionTests(TestCase):
+    def record(self, msg, *args, **extra):
+        record = logging.makeLogRecord({"name": "debug_logger", "levelname": "INFO", "msg": msg, "args": args})
+        record.__dict__.update(extra)
+        return record
+
+    def test_text_formatter_masks_tokens_and_appends_fields(self):
+        jwt = "eyJhbGciOiJIUzI1NiJ9.eyJleHAiOjF9.c2lnbmF0dXJl"
+        text = RedactingFormatter("{message}", style="{").format(self.record(
+            "GET %s with JWT %s, body %s", "https://cloud/api/?token=s3cret&page=2", jwt, '{"password": "hunter2"}',
+            endpoint="/api/", status=200,
+        ))
+
+        for secret in ("s3cret", "hunter2", jwt):
+            self.assertNotIn(secret, text)
+        self.assertIn("?token=***&page=2", text)
+        self.assertTrue(text.endswith("endpoint=/api/ status=200"))
+
+    def test_json_formatter_masks_the_message_and_keeps_fields(self):
+        line = json.loads(JsonFormatter().format(self.record("Authorization: Bearer abc.def", latency=0.25)))
+        self.assertEqual(line["message"], "Authorization: Bearer ***")
+        self.assertEqual(line["latency"], 0.25)
+
+
+def add_attendance(site, count, timestamp=None):
+    timestamp = timestamp or datetime.datetime(2026, 1, 1, 9, 0)
+    first = AttendanceData.objects.count()
+    AttendanceData.objects.bulk_create(
+        AttendanceData(site=site, user_id=i, timestamp=timestamp, attn_id=first + i + 1) for i in range(count)
+    )
+    return list(AttendanceData.objects.filter(site=site).order_by('pk').values_list('pk', flat=True))[-count:]
+
+
+# zero backoff so consecutive runs retry right away
+@override_settings(DB_WRITER_ENABLED=False, CLOUD_UPLOAD_CHUNK_SIZE=8, OUTBOX_MAX_ATTEMPTS=3,
+                   OUTBOX_BASE_BACKOFF=0, OUTBOX_MAX_BACKOFF=0)
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.site = default_site()
+
+    def bridge_answering(self, respond):
+        bridge = Wi3bitSyncBridge(self.site)
+        bridge.posted = []
+
+        def post_attendance_chunk(chunk):
+            bridge.posted.append([row['pk'] for row in chunk])
+            return respond(chunk)
+        bridge.post_attendance_chunk = post_attendance_chunk
+        self.addCleanup(bridge.close)
+        return bridge
+
+    def test_long_outage_dead_letters_nothing(self):
+        add_attendance(self.site, 20)
+        cloud = {"status": 503}
+        bridge = self.bridge_answering(lambda chunk: FakeResponse(cloud["status"], "maintenance"))
+
+        for run in range(20):
+            self.assertEqual(bridge.update_cloud_attendance(), 0)
+        self.assertEqual(len(bridge.posted), 20)
+        self.assertFalse(AttendanceData.objects.filter(upload_attempts__gt=0).exists())
+        self.assertFalse(AttendanceData.objects.filter(dead_letter=True).exists())
+
+        cloud["status"] = 201
+        self.assertEqual(bridge.update_cloud_attendance(), 20)
+
+    def test_connection_errors_back_off_the_run(self):
+        add_attendance(self.site, 4)
+
+        def refuse(chunk):
+            raise requests.ConnectionError("connection refused")
+        bridge = self.bridge_answering(refuse)
+
+        with override_settings(OUTBOX_BASE_BACKOFF=60, OUTBOX_MAX_BACKOFF=60):
+            self.assertEqual(bridge.update_cloud_attendance(), 0)
+            self.assertFalse(bridge.upload_backoff.ready())
+            self.assertEqual(bridge.update_cloud_attendance(), 0)
+        self.assertEqual(len(bridge.posted), 1)
+        self.assertFalse(AttendanceData.objects.filter(upload_attempts__gt=0).exists())
+
+    def test_422_bisects_down_to_the_rejected_row(self):
+        pks = add_attendance(self.site, 8)
+        bad_pk = pks[5]
+        bridge = self.bridge_answering(
+            lambda chunk: FakeResponse(422, "bad row") if any(row['pk'] == bad_pk for row in chunk) else FakeResponse(201)
+        )
+
+        self.assertEqual(bridge.update_cloud_attendance(), 7)
+        self.assertEqual(AttendanceData.objects.filter(synced=True).count(), 7)
+        bad_row = AttendanceData.objects.get(pk=bad_pk)
+        self.assertEqual(bad_row.upload_attempts, 1)
+        self.assertEqual(bad_row.last_error, "422: bad row")
+        self.assertIn([bad_pk], bridge.posted)
+
+    def test_rejected_row_is_dead_lettered_after_max_attempts_and_can_be_requeued(self):
+        bad_pk, = add_attendance(self.site, 1)
+        bridge = self.bridge_answering(lambda chunk: FakeResponse(422, "bad row"))
+
+        for run in range(3):
+            bridge.update_cloud_attendance()
+        bad_row = AttendanceData.objects.get(pk=bad_pk)
+        self.assertEqual((bad_row.upload_attempts, bad_row.dead_letter), (3, True))
+        self.assertEqual(pending_attendance(site=self.site).count(), 0)
+
+        self.assertEqual(requeue_dead_letters(site=self.site), 1)
+        bad_row.refresh_from_db()
+        self.assertEqual((bad_row.dead_letter, bad_row.upload_attempts, bad_row.next_attempt_at), (False, 0, None))
+
+    def test_401_stops_the_run_without_touching_rows(self):
+        add_attendance(self.site, 8)
+        bridge = self.bridge_answering(lambda chunk: FakeResponse(401, "token revoked"))
+
+        with override_settings(OUTBOX_BASE_BACKOFF=60, OUTBOX_MAX_BACKOFF=60):
+            self.assertEqual(bridge.update_cloud_attendance(), 0)
+            self.assertFalse(bridge.upload_backoff.ready())
+            # the next run waits for the run backoff instead of posting again
+            self.assertEqual(bridge.update_cloud_attendance(), 0)
+        self.assertEqual(len(bridge.posted), 1)
+        self.assertFalse(AttendanceData.objects.filter(upload_attempts__gt=0).exists())
+
+
+def transaction(attn_id, punch_time, upload_time=None):
+    return {"id": attn_id, "emp_code": "7", "punch_time": punch_time, "upload_time": upload_time}
+
+
+@override_settings(DB_WRITER_ENABLED=False)
+class IngestionResultTests(TestCase):
+    now = datetime.datetime(2026, 1, 10, 12, 0)
+
+    def test_pages_are_folded_into_running_totals(self):
+        result = IngestionResult()
+        first = [transaction(1, "2026-01-10 09:00:00"), transaction(2, "2026-01-10 11:00:00")]
+        second = [transaction(3, "2026-01-10 10:00:00")]
+        result.add_page(first, first[1:])
+        result.add_page(second, second)
+
+        self.assertEqual((result.records_seen, result.new_count, result.max_attn_id), (3, 2, 3))
+        self.assertEqual(result.max_punch_time, datetime.datetime(2026, 1, 10, 11, 0))
+        self.assertFalse(hasattr(result, "new_records"))
+
+    def test_lateness_comes_from_upload_times_and_punches_behind_the_checkpoint(self):
+        checkpoint = IngestionCheckpoint(source="test", last_punch_time=datetime.datetime(2026, 1, 10, 11, 0))
+        result = IngestionResult()
+        page = [
+            transaction(1, "2026-01-10 08:00:00", upload_time="2026-01-10 08:30:00"),
+            transaction(2, "2026-01-10 10:00:00"),
+            transaction(3, "2026-01-10 11:30:00"),
+        ]
+        result.add_page(page, page)
+        # the unstamped 10:00 punch showed up after the 11:00 checkpoint, two hours before now
+        self.assertEqual(result.max_lateness(checkpoint, self.now), 2 * 3600)
+
+        checkpoint.save()
+        advance_checkpoint(checkpoint, result, now=self.now)
+        self.assertEqual(checkpoint.late_arrival_seconds, 2 * 3600)
+        self.assertEqual(checkpoint.last_punch_time, datetime.datetime(2026, 1, 10, 11, 30))
+        self.assertEqual(checkpoint.last_attn_id, 3)
+
+    def test_punch_times_must_match_the_zkbiotime_format(self):
+        self.assertEqual(parse_punch_time("2026-01-10 09:05:00"), datetime.datetime(2026, 1, 10, 9, 5))
+        for value in ("2026-01-10T09:05:00", "2026-01-10 09:05:00+05:00", "10/01/2026 09:05", ""):
+            with self.assertRaises(ValueError):
+                parse_punch_time(value)
+
+
+class CatchupWindowTests(TestCase):
+    now = datetime.datetime(2026, 1, 10, 12, 0)
+
+    def window(self, deep=False, **fields):
+        return self.now - catchup_start_time(IngestionCheckpoint(source="test", **fields), deep=deep, now=self.now)
+
+    def test_without_lateness_the_minimum_window_is_used(self):
+        self.assertEqual(self.window(), timedelta(minutes=35))
+
+    def test_learned_lateness_is_padded_by_the_safety_factor(self):
+        self.assertEqual(self.window(late_arrival_seconds=3600), timedelta(minutes=90))
+
+    def test_gap_since_the_last_catchup_is_covered(self):
+        window = self.window(late_arrival_seconds=3600, last_catchup_at=self.now - timedelta(hours=5))
+        self.assertEqual(window, timedelta(hours=6, minutes=30))
+
+    def test_window_is_capped_at_max_days(self):
+        self.assertEqual(self.window(last_catchup_at=self.now - timedelta(days=30)), timedelta(days=10))
+
+    def test_deep_sweep_starts_behind_the_checkpoint(self):
+        checkpoint_time = self.now - timedelta(hours=1)
+        self.assertEqual(self.window(deep=True, last_punch_time=checkpoint_time), timedelta(hours=73))
+        # four days of lateness padded by the safety factor
+        self.assertEqual(self.window(deep=True, last_punch_time=checkpoint_time, late_arrival_seconds=4 * 86400),
+                         timedelta(days=6, hours=1))
+
+    def test_deep_sweep_is_capped_at_max_days(self):
+        self.assertEqual(self.window(deep=True), timedelta(days=10))
+        self.assertEqual(self.window(deep=True, last_punch_time=self.now, late_arrival_seconds=30 * 86400),
+                         timedelta(days=10))
+
+
+class OneRound:
+    # a stopping event that lets run_under_lease go through its loop once
+    def __init__(self):
+        self.checks = 0
+
+    def wait(self, timeout=None):
+        pass
+
+    def is_set(self):
+        self.checks += 1
+        return self.checks > 1
+
+
+class WebStandbyTests(TestCase):
+    def run_standby(self):
+        with mock.patch("shared.leader.scheduler") as scheduler:
+            scheduler.start.return_value = ("scheduler", {})
+            run_under_lease(LeaderLease(ttl=60), OneRound())
+        return scheduler
+
+    def test_standby_stays_idle_while_run_bridge_holds_the_lease(self):
+        BridgeLease.objects.create(name="bridge", holder="run_bridge",
+                                   expires_at=datetime.datetime.now() + timedelta(seconds=60))
+        scheduler = self.run_standby()
+        scheduler.start.assert_not_called()
+        self.assertEqual(BridgeLease.objects.get(name="bridge").holder, "run_bridge")
+
+    def test_standby_runs_the_scheduler_once_the_lease_is_free(self):
+        BridgeLease.objects.create(name="bridge", holder="run_bridge",
+                                   expires_at=datetime.datetime.now() - timedelta(seconds=1))
+        scheduler = self.run_standby()
+        scheduler.start.assert_called_once_with()
+        scheduler.stop.assert_called_once_with("scheduler", {})
+        self.assertIsNone(BridgeLease.objects.get(name="bridge").holder)
+
+
+@override_settings(DB_WRITER_ENABLED=False, CLOUD_UPLOAD_CHUNK_SIZE=8)
+class SiteScopingTests(TestCase):
+    def setUp(self):
+        self.default = default_site()
+        self.branch = Site.objects.create(key="branch", local_server="http://branch-zk", cloud_server="http://branch-cloud")
+
+    def bridge(self, site):
+        bridge = Wi3bitSyncBridge(site)
+        self.addCleanup(bridge.close)
+        return bridge
+
+    def test_cached_area_and_department_are_kept_per_site(self):
+        now = datetime.datetime.now()
+        for key, resource_id in (("area", 1), ("department", 2), ("branch:area", 7), ("branch:department", 8)):
+            LocalResource.objects.create(key=key, resource_id=resource_id, resolved_at=now)
+
+        for site, ids in ((self.default, (1, 2)), (self.branch, (7, 8))):
+            bridge = self.bridge(site)
+            bridge.ensure_area_dept()
+            self.assertEqual((bridge.area_id, bridge.dept_id), ids)
+
+    def test_a_site_uploads_and_reports_only_its_own_rows(self):
+        add_attendance(self.default, 3)
+        branch_pks = add_attendance(self.branch, 5)
+        bridge = self.bridge(self.branch)
+        posted = []
+
+        def post_attendance_chunk(chunk):
+            posted.extend(row['pk'] for row in chunk)
+            return FakeResponse(201)
+        bridge.post_attendance_chunk = post_attendance_chunk
+        uploaded_before = metrics.punches_uploaded.collect().get((("site", "branch"),), 0)
+
+        self.assertEqual(bridge.update_cloud_attendance(), 5)
+        self.assertEqual(posted, branch_pks)
+        self.assertEqual(metrics.punches_uploaded.collect()[(("site", "branch"),)] - uploaded_before, 5)
+
+        stats = outbox_stats_by_site()
+        self.assertEqual(list(stats), ["default"])
+        self.assertEqual((stats["default"]["pending"], stats["default"]["dead_letter"]), (3, 0))
+        self.assertEqual(outbox_stats(site=self.branch)["pending"], 0)
+        self.assertEqual(outbox_stats()["pending"], 3)
+
+
+class FakeTokenResponse(FakeResponse):
+    def __init__(self, token):
+        super().__init__(200, json.dumps({"token": token}))
+
+    def json(self):
+        return json.loads(self.text)
+
+
+@override_settings(DB_WRITER_ENABLED=False)
+class AsyncTokenSharingTests(TestCase):
+    def setUp(self):
+        self.bridge = AsyncWi3bitSyncBridge(default_site())
+        self.addCleanup(self.bridge.sync_bridge.close)
+
+    def test_async_engine_uses_the_token_of_the_blocking_bridge(self):
+        token = fake_jwt()
+        self.bridge.sync_bridge.tokens.fetched(token)
+        self.assertEqual(asyncio.run(self.bridge.tokens.get()), token)
+
+    def test_a_token_refreshed_by_the_async_engine_is_seen_by_the_blocking_bridge(self):
+        token = fake_jwt()
+        requested = []
+
+        async def request(method, url, **kwargs):
+            requested.append(url)
+            return FakeTokenResponse(token)
+        self.bridge.request = request
+
+        with mock.patch("shared.async_bridge.stored_token", return_value=None), \
+                mock.patch("shared.async_bridge.async_db_write", new=mock.AsyncMock()) as write:
+            self.assertEqual(asyncio.run(self.bridge.tokens.get()), token)
+        self.assertEqual(len(requested), 1)
+        self.assertEqual(self.bridge.sync_bridge.tokens.get(), token)
+        write.assert_awaited_once()
+
+
+class LogReaderTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "django.log")
+
+    def write(self, path, *lines):
+        with open(path, "a") as f:
+            f.write("".join(f"{line}\n" for line in lines))
+
+    def test_cursor_survives_rotation(self):
+        self.write(self.path, "[t] INFO line 1", "[t] INFO line 2", "[t] INFO line 3", "[t] INFO line 4")
+        reader = LogReader(self.path, block_size=16)
+
+        logs, cursor = reader.read_page(page_size=2)
+        self.assertEqual(logs, ["[t] INFO line 4", "[t] INFO line 3"])
+
+        # the handler renames django.log to django.log.1 and starts a new file
+        os.rename(self.path, f"{self.path}.1")
+        self.write(self.path, "[t] INFO line 5")
+
+        logs, cursor = reader.read_page(cursor, page_size=2)
+        self.assertEqual(logs, ["[t] INFO line 2", "[t] INFO line 1"])
+        self.assertIsNone(cursor)
+
+    def test_level_filter_keeps_tracebacks_with_their_record(self):
+        self.write(self.path, "[t] INFO fine", "[t] ERROR broke", "Traceback (most recent call last):", "[t] INFO fine again")
+        logs, cursor = LogReader(self.path).read_page(level="error")
+        self.assertEqual(logs, ["Traceback (most recent call last):", "[t] ERROR broke"])
+
+
+@override_settings(DB_WRITER_ENABLED=False, ADMS_ALLOWED_SERIALS=["ALLOWED1"])
+class AdmsTests(TestCase):
+    def test_parse_attlog_accepts_tabs_and_spaces(self):
+        body = "7\t2026-01-01 08:00:00\t0\t1\t0\n\n8 2026-01-01 08:05:00 1 15\nnot a punch\n"
+        punches, rejected = parse_attlog(body)
+
+        self.assertEqual(rejected, 1)
+        self.assertEqual([punch.key for punch in punches], [
+            (7, datetime.datetime(2026, 1, 1, 8, 0)),
+            (8, datetime.datetime(2026, 1, 1, 8, 5)),
+        ])
+        self.assertEqual((punches[0].status, punches[0].verify), ("0", "1"))
+        self.assertEqual((punches[1].status, punches[1].verify), ("1", "15"))
+
+    def test_only_known_devices_are_allowed(self):
+        Site.objects.create(key="branch", device_serials="BRANCH1, BRANCH2")
+
+        self.assertTrue(device_allowed("ALLOWED1"))
+        self.assertTrue(device_allowed("BRANCH2"))
+        self.assertFalse(device_allowed("STRANGER"))
+        self.assertFalse(device_allowed(""))
+        self.assertFalse(device_allowed(None))
+
+
+@override_settings(DB_WRITER_ENABLED=False)
+class SubmitJobTests(TestCase):
+    def test_in_flight_job_is_reused(self):
+        job, created = submit_job(UPDATE_USERS)
+        self.assertTrue(created)
+
+        again, created = submit_job(UPDATE_USERS)
+        self.assertFalse(created)
+        self.assertEqual(again.pk, job.pk)
+
+        BridgeJob.objects.filter(pk=job.pk).update(status=BridgeJob.DONE)
+        fresh, created = submit_job(UPDATE_USERS)
+        self.assertTrue(created)
+        self.assertNotEqual(fresh.pk, job.pk)
+
+    def test_jobs_are_per_site(self):
+        branch = Site.objects.create(key="branch")
+        job, created = submit_job(UPDATE_USERS)
+        branch_job, branch_created = submit_job(UPDATE_USERS, site=branch)
+        self.assertTrue(branch_created)
+        self.assertNotEqual(branch_job.pk, job.pk)
+
+    def test_unknown_kind_is_rejected(self):
+        with self.assertRaises(ValueError):
+            submit_job("reboot_everything")
+
+
+class FakeTokenTransport:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.posts = 0
+        self.lock = threading.Lock()
+
+    def post(self, url, **kwargs):
+        with self.lock:
+            self.posts += 1
+            posts = self.posts
+        time.sleep(self.delay)
+        # a distinct token per fetch
+        return FakeTokenResponse(fake_jwt(ttl=3600 + posts))
+
+
+class TokenManagerTests(TestCase):
+    def setUp(self):
+        self.site = default_site()
+        for name, value in (("stored_token", None), ("db_write", None)):
+            patcher = mock.patch(f"shared.token_manager.{name}", return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_jwt_expiry_reads_the_exp_claim(self):
+        token = fake_jwt(ttl=600)
+        self.assertAlmostEqual(jwt_expiry(token).timestamp(), time.time() + 600, delta=5)
+        for token in ("not-a-jwt", "a.!!!.c", "e30.e30.sig", None):
+            self.assertIsNone(jwt_expiry(token))
+
+    def test_token_is_refreshed_inside_the_margin(self):
+        transport = FakeTokenTransport()
+        tokens = TokenManager(transport, self.site, refresh_margin=300)
+        tokens.fetched(fake_jwt(ttl=3600))
+        tokens.get()
+        self.assertEqual(transport.posts, 0)
+
+        tokens.fetched(fake_jwt(ttl=120))
+        tokens.fetched_at -= 60
+        tokens.get()
+        self.assertEqual(transport.posts, 1)
+
+    def test_concurrent_callers_share_one_fetch(self):
+        transport = FakeTokenTransport(delay=0.1)
+        tokens = TokenManager(transport, self.site)
+        threads = [threading.Thread(target=tokens.get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(transport.posts, 1)
+
+    def test_a_rejected_token_already_replaced_is_not_fetched_again(self):
+        transport = FakeTokenTransport()
+        tokens = TokenManager(transport, self.site)
+        rejected = tokens.get()
+        tokens.fetched_at -= 60
+        fresh = tokens.refresh(stale_token=rejected)
+        self.assertEqual(transport.posts, 2)
+        self.assertNotEqual(fresh, rejected)
+
+        # a second caller that was rejected with the same old token gets the new one
+        self.assertEqual(tokens.refresh(stale_token=rejected), fresh)
+        self.assertEqual(transport.posts, 2)
+
+
+class JobCoordinatorTests(TestCase):
+    def setUp(self):
+        self.coordinator = JobCoordinator()
+        self.ran = []
+        self.release = threading.Event()
+
+    def job(self, name):
+        def run():
+            self.ran.append(name)
+            return name
+        return run
+
+    def blocking_job(self):
+        self.ran.append("blocking")
+        self.release.wait(5)
+
+    def hold_resource(self, resource):
+        started = threading.Thread(target=self.coordinator.submit, args=("blocking", resource, self.blocking_job))
+        started.start()
+        self.addCleanup(started.join)
+        while resource not in self.coordinator.running:
+            time.sleep(0.01)
+        return started
+
+    def test_repeat_triggers_are_merged_and_the_most_urgent_job_runs_first(self):
+        holder = self.hold_resource("site")
+        self.coordinator.submit("sweep", "site", self.job("sweep"), priority=SWEEP)
+        self.coordinator.submit("heartbeat", "site", self.job("heartbeat"), priority=HEARTBEAT)
+        self.coordinator.submit("heartbeat", "site", self.job("heartbeat"), priority=HEARTBEAT)
+        self.coordinator.submit("sweep", "site", self.job("sweep"), priority=INTERACTIVE)
+
+        self.release.set()
+        holder.join()
+        # the repeated sweep was raised to interactive, each job runs once
+        self.assertEqual(self.ran, ["blocking", "sweep", "heartbeat"])
+        self.assertEqual((self.coordinator.stats["heartbeat"].merged, self.coordinator.stats["sweep"].merged), (1, 1))
+
+    def test_waiting_follower_gets_the_result_of_the_run_it_joined(self):
+        holder = self.hold_resource("site")
+        self.coordinator.submit("users", "site", self.job("users"))
+        follower = []
+        waiter = threading.Thread(
+            target=lambda: follower.append(self.coordinator.submit("users", "site", self.job("users"), wait=True)),
+        )
+        waiter.start()
+        while not self.coordinator.queued["site"]["users"].followers:
+            time.sleep(0.01)
+        self.release.set()
+        holder.join()
+        waiter.join(5)
+        self.assertEqual(follower[0].result, "users")
+        self.assertEqual(self.ran.count("users"), 1)
+
+    def test_other_resources_are_not_blocked(self):
+        self.hold_resource("site")
+        trigger = self.coordinator.submit("other", "branch", self.job("other"))
+        self.assertTrue(trigger.done.is_set())
+        self.release.set()
+
+
+class FakeSession:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@mock.patch("shared.transport.time.sleep")
+class TransportRetryTests(TestCase):
+    url = "http://local/iclock/api/transactions/"
+
+    def transport(self, session):
+        transport = HttpTransport(retries=2, backoff=0.5)
+        transport.session_for = lambda url: session
+        return transport
+
+    def test_idempotent_requests_retry_transport_errors_then_give_up(self, sleep):
+        session = FakeSession(requests.ConnectionError("reset"))
+        with self.assertRaises(requests.ConnectionError):
+            self.transport(session).get(self.url)
+        self.assertEqual((session.calls, sleep.call_count), (3, 2))
+
+        session = FakeSession(requests.ReadTimeout("slow"), FakeResponse(200))
+        self.assertEqual(self.transport(session).get(self.url).status_code, 200)
+        self.assertEqual(session.calls, 2)
+
+    def test_a_post_is_only_retried_when_it_never_reached_the_server(self, sleep):
+        session = FakeSession(requests.ReadTimeout("slow"))
+        with self.assertRaises(requests.ReadTimeout):
+            self.transport(session).post(self.url)
+        self.assertEqual(session.calls, 1)
+
+        session = FakeSession(requests.ConnectTimeout("unreachable"), FakeResponse(201))
+        self.assertEqual(self.transport(session).post(self.url).status_code, 201)
+        self.assertEqual(session.calls, 2)
+
+    def test_http_error_statuses_are_returned_not_retried(self, sleep):
+        session = FakeSession(FakeResponse(503))
+        self.assertEqual(self.transport(session).get(self.url).status_code, 503)
+        self.assertEqual(session.calls, 1)
+
+    def test_throttle_honours_retry_after_and_recovers(self, sleep):
+        session = FakeSession(FakeResponse(429, headers={"Retry-After": "3"}), FakeResponse(200))
+        throttle = AdaptiveThrottle(base_delay=0.5)
+        response = throttle.request(self.transport(session), "get", self.url)
+
+        self.assertEqual(response.status_code, 200)
+        sleep.assert_called_once_with(3.0)
+        # one good response halves the delay instead of dropping it at once
+        self.assertEqual(throttle.current_delay(), 1.5)
+
+
+class FakePages:
+    def __init__(self, total, page_size=10, fail_on=None):
+        self.total = total
+        self.page_size = page_size
+        self.fail_on = fail_on
+        self.fetched = []
+        self.lock = threading.Lock()
+        self.random = random.Random(1)
+
+    def fetch(self, number):
+        with self.lock:
+            self.fetched.append(number)
+            delay = self.random.uniform(0, 0.02)
+        # later pages often answer first
+        time.sleep(delay)
+        if number == self.fail_on:
+            raise requests.ConnectionError(f"page {number} failed")
+        first = (number - 1) * self.page_size
+        return {"count": self.total * self.page_size, "next": number < self.total or None,
+                "data": list(range(first, first + self.page_size))}
+
+    def stream(self, start_page=1, max_pages=None):
+        return PrefetchingPageStream(
+            "test", self.fetch, lambda response_json: response_json["next"],
+            total_pages=lambda response_json: self.total, workers=4, start_page=start_page, max_pages=max_pages,
+        )
+
+
+class PageStreamTests(TestCase):
+    def test_prefetched_pages_are_yielded_in_order_and_fetched_once(self):
+        pages = FakePages(12)
+        self.assertEqual([page.number for page in pages.stream().pages()], list(range(1, 13)))
+        self.assertEqual(sorted(pages.fetched), list(range(1, 13)))
+        self.assertEqual(list(pages.stream(max_pages=3)), list(range(30)))
+
+    def test_resume_starts_at_the_page_the_consumer_failed_on(self):
+        for stream_class in (PageStream, PrefetchingPageStream):
+            pages = FakePages(6)
+            if stream_class is PageStream:
+                stream = PageStream("test", pages.fetch, lambda response_json: response_json["next"])
+            else:
+                stream = pages.stream()
+            seen = []
+            with self.assertRaises(ValueError):
+                for page in stream.pages():
+                    if page.number == 3:
+                        raise ValueError("storing page 3 failed")
+                    seen.append(page.number)
+            self.assertEqual((seen, stream.resume_page()), ([1, 2], 3))
+            self.assertEqual([page.number for page in pages.stream(start_page=3).pages()], [3, 4, 5, 6])
+
+    def test_resume_starts_at_the_page_that_failed_to_fetch(self):
+        stream = FakePages(6, fail_on=4).stream()
+        with self.assertRaises(requests.ConnectionError):
+            for page in stream.pages():
+                pass
+        self.assertEqual(stream.resume_page(), 4)
+
+
+# zero backoff so the rejected row is sent again on the next run
+@override_settings(DB_WRITER_ENABLED=False, CLOUD_UPLOAD_CHUNK_SIZE=8, CLOUD_UPLOAD_FORMAT="json",
+                   OUTBOX_BASE_BACKOFF=0, OUTBOX_MAX_BACKOFF=0)
+class ChunkUploadTests(TestCase):
+    def test_idempotency_key_depends_only_on_the_rows(self):
+        rows = [{"pk": 1, "attn_id": 10}, {"pk": 2, "attn_id": 11}]
+        self.assertEqual(attendance_idempotency_key(rows), attendance_idempotency_key([dict(row) for row in rows]))
+        self.assertNotEqual(attendance_idempotency_key(rows), attendance_idempotency_key(rows[:1]))
+        # pushed punches have no transaction id yet, their pk keeps them apart
+        self.assertNotEqual(attendance_idempotency_key([{"pk": 1, "attn_id": None}]),
+                            attendance_idempotency_key([{"pk": 2, "attn_id": None}]))
+
+    def test_bisection_sends_each_half_under_its_own_key(self):
+        site = default_site()
+        pks = add_attendance(site, 8)
+        bad_user = AttendanceData.objects.get(pk=pks[5]).user_id
+        bridge = Wi3bitSyncBridge(site)
+        self.addCleanup(bridge.close)
+        sent = []
+
+        # add_attendance gives every row its own user, so user ids identify the rows in a body
+        def post(url, data=None, headers=None, timeout=None):
+            users = tuple(row["user_id"] for row in json.loads(data))
+            sent.append((users, headers["Idempotency-Key"]))
+            return FakeResponse(422, "bad row") if bad_user in users else FakeResponse(201)
+        bridge.transport.post = post
+
+        self.assertEqual(bridge.update_cloud_attendance(), 7)
+        # depth first into the failing half: 8, the good 4, the bad 4, its bad 2 split into 1 + 1, then the last 2
+        self.assertEqual([len(users) for users, key in sent], [8, 4, 4, 2, 1, 1, 2])
+        self.assertEqual(len({key for users, key in sent}), 7)
+
+        # the rejected row goes out again under the key it had
+        first_key = dict(sent)[(bad_user,)]
+        bridge.update_cloud_attendance()
+        self.assertEqual(sent[-1], ((bad_user,), first_key))
+
+
+def decode_columnar(body):
+    payload = json.loads(gzip.decompress(body))
+    zone = ZoneInfo(payload["tz"])
+    epoch = 0
+    rows = []
+    for user_id, delta in zip(payload["user_ids"], payload["timestamp_deltas"]):
+        epoch += delta
+        rows.append({"user_id": user_id, "timestamp": datetime.datetime.fromtimestamp(epoch, zone).replace(tzinfo=None)})
+    return payload["count"], rows
+
+
+class UploadFormatTests(TestCase):
+    def test_columnar_body_decodes_to_the_json_rows(self):
+        start = datetime.datetime(2026, 3, 1, 8, 0)
+        # out of order punches make negative deltas
+        offsets = [0, 5, 5, 3600, 60, 86400 * 40]
+        chunk = [{"pk": i, "attn_id": i, "user_id": str(100 + i), "timestamp": start + timedelta(seconds=offset)}
+                 for i, offset in enumerate(offsets)]
+        columnar = encode_chunk(chunk, COLUMNAR_FORMAT)
+        plain = encode_chunk(chunk, JSON_FORMAT)
+
+        self.assertEqual(columnar.headers["Content-Encoding"], "gzip")
+        self.assertEqual(columnar.json_size, plain.size)
+        count, rows = decode_columnar(columnar.body)
+        self.assertEqual(count, len(chunk))
+        self.assertEqual(
+            [{"user_id": row["user_id"], "timestamp": row["timestamp"].strftime("%Y-%m-%d %H:%M:%S")} for row in rows],
+            json.loads(plain.body),
+        )
+
+    def test_a_cloud_that_rejects_the_format_gets_json(self):
+        negotiator = UploadFormatNegotiator(preferred=COLUMNAR_FORMAT)
+        self.assertEqual(negotiator.choose(), COLUMNAR_FORMAT)
+        # an outage says nothing about the format
+        self.assertFalse(negotiator.observe(COLUMNAR_FORMAT, 503))
+        self.assertTrue(negotiator.observe(COLUMNAR_FORMAT, 415))
+        self.assertEqual(negotiator.choose(), JSON_FORMAT)
+
+    def test_once_accepted_a_row_rejection_keeps_the_format(self):
+        negotiator = UploadFormatNegotiator(preferred=COLUMNAR_FORMAT)
+        self.assertFalse(negotiator.observe(COLUMNAR_FORMAT, 201))
+        self.assertFalse(negotiator.observe(COLUMNAR_FORMAT, 422))
+        self.assertEqual(negotiator.choose(), COLUMNAR_FORMAT)
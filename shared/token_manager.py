@@ -0,0 +1,115 @@
+import base64
+import datetime
+import json
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+
+from shared.models import BridgeTokens
+from shared.storage import db_write
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+REFETCH_GRACE_SECONDS = 5
+
+
+def jwt_expiry(token):
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+    except (IndexError, ValueError, AttributeError):
+        return None
+    return datetime.datetime.fromtimestamp(exp) if exp else None
+
+
+def stored_token(site):
+    token_inst = BridgeTokens.objects.filter(site=site, expired=False).last()
+    return token_inst.token if token_inst else None
+
+
+def store_token(token, site):
+    BridgeTokens.objects.filter(site=site).delete()
+    BridgeTokens.objects.create(site=site, token=token)
+
+
+class TokenCache:
+    # token state and refresh decisions, the async engine drives the site's TokenManager through AsyncTokenManager
+    def __init__(self, site, refresh_margin=None):
+        self.site = site
+        self.refresh_margin = timedelta(seconds=settings.TOKEN_REFRESH_MARGIN if refresh_margin is None else refresh_margin)
+        self.token = None
+        self.expires_at = None
+        self.fetched_at = None
+
+    def is_fresh(self):
+        if not self.token:
+            return False
+        return not self.expires_at or datetime.datetime.now() < self.expires_at - self.refresh_margin
+
+    def set_token(self, token):
+        self.token = token
+        self.expires_at = jwt_expiry(token)
+
+    def replaced(self, stale_token):
+        # another caller already replaced the token we were unhappy with
+        just_fetched = self.fetched_at and time.monotonic() - self.fetched_at < REFETCH_GRACE_SECONDS
+        return (self.token != stale_token or just_fetched) and self.is_fresh()
+
+    def should_check_store(self, stale_token):
+        return stale_token is None or self.token is None
+
+    def adopt_stored(self, token, stale_token):
+        if not token or token == stale_token:
+            return False
+        self.set_token(token)
+        if self.is_fresh():
+            logger.info("Using token from DB:")
+            return True
+        return False
+
+    def fetched(self, token):
+        self.set_token(token)
+        self.fetched_at = time.monotonic()
+        return self.token
+
+    # returns (url, body, headers)
+    def token_request(self):
+        logger.info("Getting new token from Local Server: %s", self.site.key)
+        data = {"username": self.site.local_user, "password": self.site.local_password}
+        return f"{self.site.local_url}/jwt-api-token-auth/", json.dumps(data), {"Content-Type": "application/json"}
+
+    def token_from_response(self, response):
+        if response.status_code == 400:
+            logger.info("Token api failed, Status: %s, Response: %s", response.status_code, response.text)
+            raise Exception('Invalid credentials or Local server not running')
+        return response.json()['token']
+
+
+class TokenManager(TokenCache):
+    def __init__(self, transport, site, refresh_margin=None):
+        super().__init__(site, refresh_margin)
+        self.transport = transport
+        self.lock = threading.Lock()
+
+    def get(self):
+        if self.is_fresh():
+            return self.token
+        return self.refresh(stale_token=self.token)
+
+    def refresh(self, stale_token=None):
+        with self.lock:
+            if self.replaced(stale_token):
+                return self.token
+            if self.should_check_store(stale_token) and self.adopt_stored(stored_token(self.site), stale_token):
+                return self.token
+            return self.fetched(self.fetch_token())
+
+    def fetch_token(self):
+        url, body, headers = self.token_request()
+        token = self.token_from_response(self.transport.post(url, data=body, headers=headers, timeout=5))
+        db_write(store_token, token, self.site)
+        return token
@@ -0,0 +1,143 @@
+import asyncio
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from shared import metrics
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+IDEMPOTENT_METHODS = {"get", "put", "delete", "head", "options"}
+UPSTREAM_NAMES = {settings.LOCAL_SERVER: "local", settings.CLOUD_SERVER: "cloud"}
+
+
+def observe_request(method, url, status, started):
+    parsed = urlparse(url)
+    upstream = UPSTREAM_NAMES.get(f"{parsed.scheme}://{parsed.netloc}") or parsed.netloc
+    metrics.upstream_request_seconds.observe(
+        time.monotonic() - started,
+        upstream=upstream, endpoint=metrics.normalize_endpoint(parsed.path), method=method.upper(), status=status,
+    )
+
+
+class HttpTransport:
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None, retries=None, backoff=None):
+        self.pool_size = pool_size or settings.HTTP_POOL_SIZE
+        self.connect_timeout = connect_timeout or settings.HTTP_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.HTTP_READ_TIMEOUT
+        self.retries = settings.HTTP_RETRIES if retries is None else retries
+        self.backoff = backoff or settings.HTTP_BACKOFF
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def session_for(self, url):
+        parsed = urlparse(url)
+        upstream = f"{parsed.scheme}://{parsed.netloc}"
+        with self.lock:
+            session = self.sessions.get(upstream)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount(f"{upstream}/", adapter)
+                self.sessions[upstream] = session
+            return session
+
+    def request(self, method, url, timeout=None, **kwargs):
+        method = method.lower()
+        session = self.session_for(url)
+        timeout = (self.connect_timeout, timeout or self.read_timeout)
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                response = session.request(method, url, timeout=timeout, **kwargs)
+                self.observe(method, url, response.status_code, started)
+                return response
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.observe(method, url, "error", started)
+                retryable = method in IDEMPOTENT_METHODS or isinstance(e, requests.ConnectTimeout)
+                if not retryable or attempt >= self.retries:
+                    raise
+                delay = random.uniform(0, self.backoff * (2 ** attempt))
+                attempt += 1
+                logger.warning("Transient error on %s %s: %s, retry %s in %.2fs", method.upper(), urlparse(url).path, e, attempt, delay)
+                time.sleep(delay)
+
+    def observe(self, method, url, status, started):
+        observe_request(method, url, status, started)
+
+    def get(self, url, **kwargs):
+        return self.request("get", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("post", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("put", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("delete", url, **kwargs)
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+
+class AdaptiveThrottle:
+    THROTTLE_STATUSES = {429, 503}
+
+    def __init__(self, base_delay=0.5, max_delay=30, max_attempts=5):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.delay = 0
+        self.lock = threading.Lock()
+
+    def current_delay(self):
+        with self.lock:
+            return self.delay
+
+    def wait(self):
+        delay = self.current_delay()
+        if delay:
+            time.sleep(delay)
+
+    def on_response(self, response):
+        with self.lock:
+            if response.status_code not in self.THROTTLE_STATUSES:
+                self.delay = self.delay / 2 if self.delay > self.base_delay else 0
+                return False
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                self.delay = min(self.max_delay, float(retry_after))
+            else:
+                self.delay = min(self.max_delay, max(self.base_delay, self.delay * 2))
+            logger.warning("Upstream throttled with %s, backing off %.2fs", response.status_code, self.delay)
+            return True
+
+    def request(self, transport, method, url, **kwargs):
+        for attempt in range(self.max_attempts):
+            self.wait()
+            response = transport.request(method, url, **kwargs)
+            if not self.on_response(response):
+                return response
+        return response
+
+    # same loop for the async engine, send is the bridge's request coroutine
+    async def async_request(self, send, method, url, **kwargs):
+        for attempt in range(self.max_attempts):
+            delay = self.current_delay()
+            if delay:
+                await asyncio.sleep(delay)
+            response = await send(method, url, **kwargs)
+            if not self.on_response(response):
+                return response
+        return response
@@ -0,0 +1,93 @@
+import gzip
+import json
+import threading
+import time
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
+
+from shared.ingestion import PUNCH_TIME_FORMAT
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+JSON_FORMAT = "json"
+COLUMNAR_FORMAT = "columnar-v1"
+FORMAT_HEADER = "X-Upload-Format"
+
+
+def json_body(chunk):
+    return json.dumps([{
+        "user_id": row['user_id'],
+        "timestamp": row['timestamp'].strftime(PUNCH_TIME_FORMAT),
+    } for row in chunk]).encode()
+
+
+def columnar_body(chunk):
+    # timestamps are epoch seconds, the first absolute and the rest as deltas from the previous row
+    zone = ZoneInfo(settings.TIME_ZONE)
+    epochs = [int(row['timestamp'].replace(tzinfo=zone).timestamp()) for row in chunk]
+    deltas = epochs[:1] + [current - previous for previous, current in zip(epochs, epochs[1:])]
+    payload = {
+        "format": COLUMNAR_FORMAT,
+        "tz": settings.TIME_ZONE,
+        "count": len(chunk),
+        "user_ids": [row['user_id'] for row in chunk],
+        "timestamp_deltas": deltas,
+    }
+    return gzip.compress(json.dumps(payload, separators=(",", ":")).encode(), compresslevel=6)
+
+
+class EncodedChunk:
+    def __init__(self, upload_format, body, headers, json_size):
+        self.format = upload_format
+        self.body = body
+        self.headers = headers
+        self.json_size = json_size
+
+    @property
+    def size(self):
+        return len(self.body)
+
+
+def encode_chunk(chunk, upload_format):
+    plain = json_body(chunk)
+    if upload_format == COLUMNAR_FORMAT:
+        headers = {"Content-Type": "application/json", "Content-Encoding": "gzip", FORMAT_HEADER: COLUMNAR_FORMAT}
+        return EncodedChunk(COLUMNAR_FORMAT, columnar_body(chunk), headers, len(plain))
+    return EncodedChunk(JSON_FORMAT, plain, {"Content-Type": "application/json"}, len(plain))
+
+
+class UploadFormatNegotiator:
+    # the first columnar upload doubles as the probe; a 4xx on it means the cloud doesn't speak it yet
+    def __init__(self, preferred=None, recheck_seconds=None):
+        self.preferred = preferred or settings.CLOUD_UPLOAD_FORMAT
+        self.recheck_seconds = settings.CLOUD_UPLOAD_FORMAT_RECHECK if recheck_seconds is None else recheck_seconds
+        self.supported = None
+        self.rejected_at = None
+        self.lock = threading.Lock()
+
+    def choose(self):
+        if self.preferred != COLUMNAR_FORMAT:
+            return JSON_FORMAT
+        with self.lock:
+            if self.supported is False and time.monotonic() - self.rejected_at < self.recheck_seconds:
+                return JSON_FORMAT
+            return COLUMNAR_FORMAT
+
+    # returns True when the response rejected the format rather than the rows
+    def observe(self, upload_format, status_code):
+        if upload_format != COLUMNAR_FORMAT:
+            return False
+        with self.lock:
+            if 200 <= status_code <= 299:
+                if self.supported is not True:
+                    logger.info("Cloud accepts %s attendance uploads", COLUMNAR_FORMAT)
+                self.supported = True
+                return False
+            if status_code == 415 or (400 <= status_code <= 499 and status_code != 429 and self.supported is not True):
+                logger.info("Cloud rejected %s uploads with %s, falling back to JSON", COLUMNAR_FORMAT, status_code)
+                self.supported = False
+                self.rejected_at = time.monotonic()
+                return True
+            return False
@@ -6,4 +6,9 @@ urlpatterns = [
     path("update/users/", views.updateUsers, name="updateUsers"),
     path("update/local/attn/", views.updateLocalAttn, name="updateLocalAttn"),
     path("update/cloud/attn/", views.updateCloudAttn, name="updateCloudAttn"),
+    path("jobs/<uuid:job_id>/", views.jobStatus, name="jobStatus"),
+    path("metrics", views.metrics_view, name="metrics"),
+    path("iclock/cdata", views.iclock_cdata, name="iclock_cdata"),
+    path("iclock/getrequest", views.iclock_getrequest, name="iclock_getrequest"),
+    path("iclock/devicecmd", views.iclock_devicecmd, name="iclock_devicecmd"),
 ]
\ No newline at end of file
@@ -0,0 +1,152 @@
+import datetime
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+
+from shared.models import UserMirror, UserSyncState
+from shared.sites import base_key
+from shared.storage import serialized_write
+from shared.user_sync import build_user_sync_plan
+
+import logging
+logger = logging.getLogger("debug_logger")
+
+LOCAL_EMPLOYEES = "local_employees"
+CLOUD_USERS = "cloud_users"
+
+# only the fields the sync plan reads are mirrored and hashed
+MIRRORED_FIELDS = {
+    LOCAL_EMPLOYEES: ("id", "emp_code", "first_name"),
+    CLOUD_USERS: ("id", "unique_id", "name"),
+}
+
+
+def mirrored_data(source, record):
+    return {field: record.get(field) for field in MIRRORED_FIELDS[base_key(source)]}
+
+
+def content_hash(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def record_hashes(source, records):
+    hashes = {}
+    for record in records:
+        data = mirrored_data(source, record)
+        hashes[str(data["id"])] = (content_hash(data), data)
+    return hashes
+
+
+def set_fingerprint(hashes):
+    digest = hashlib.sha256()
+    for record_id in sorted(hashes):
+        digest.update(f"{record_id}:{hashes[record_id][0]};".encode())
+    return digest.hexdigest()
+
+
+def get_sync_state(source):
+    return UserSyncState.objects.filter(source=source).first() or UserSyncState(source=source)
+
+
+def mirrored_records(source):
+    return list(UserMirror.objects.filter(source=source).order_by('pk').values_list('data', flat=True))
+
+
+def full_scan_due(sources=tuple(MIRRORED_FIELDS), now=None):
+    now = now or datetime.datetime.now()
+    interval = timedelta(minutes=settings.USER_SYNC_FULL_SCAN_MINUTES)
+    states = list(UserSyncState.objects.filter(source__in=sources))
+    if len(states) < len(sources):
+        return True
+    return any(not state.last_full_scan_at or now - state.last_full_scan_at > interval for state in states)
+
+
+@serialized_write
+def update_mirror(source, hashes, full_scan=False, synced=True, etag=None, now=None):
+    now = now or datetime.datetime.now()
+    existing = dict(UserMirror.objects.filter(source=source).values_list('record_id', 'content_hash'))
+
+    stale = [record_id for record_id in existing if record_id not in hashes]
+    changed = {record_id: value for record_id, value in hashes.items() if existing.get(record_id) != value[0]}
+    UserMirror.objects.filter(source=source, record_id__in=stale).delete()
+    UserMirror.objects.filter(source=source, record_id__in=[key for key in changed if key in existing]).delete()
+    UserMirror.objects.bulk_create(
+        [UserMirror(source=source, record_id=record_id, content_hash=record_hash, data=data)
+         for record_id, (record_hash, data) in changed.items()],
+        batch_size=500,
+    )
+
+    state = get_sync_state(source)
+    # an unsynced state never matches a probe, so the next run re-plans instead of skipping
+    state.fingerprint = set_fingerprint(hashes) if synced else None
+    state.record_count = len(hashes) if synced else None
+    state.etag = etag if synced else None
+    state.last_checked_at = now
+    if full_scan:
+        state.last_full_scan_at = now
+    state.save()
+    if stale or changed:
+        logger.info("User mirror %s updated, changed: %s, removed: %s", source, len(changed), len(stale))
+    return state
+
+
+@serialized_write
+def mark_checked(source, now=None):
+    UserSyncState.objects.filter(source=source).update(last_checked_at=now or datetime.datetime.now())
+
+
+# the bookkeeping of one user sync, shared by both bridge engines which only probe, fetch and apply
+class UserSyncRun:
+    def __init__(self, local_source, cloud_source, full_scan=None, progress=None):
+        self.local_source = local_source
+        self.cloud_source = cloud_source
+        self.full_scan = full_scan_due((local_source, cloud_source)) if full_scan is None else full_scan
+        self.progress = progress
+        self.local_state = get_sync_state(local_source)
+        self.cloud_state = get_sync_state(cloud_source)
+        self.local_hashes = None
+        self.cloud_hashes = None
+        self.synced = True
+        self.counts = {"skipped": False, "full_scan": self.full_scan}
+        self.report(phase="probing", full_scan=self.full_scan)
+
+    def report(self, **values):
+        if self.progress:
+            self.progress.update(**values)
+
+    def skip(self):
+        logger.info("Users unchanged since the last sync, skipping")
+        mark_checked(self.local_source)
+        mark_checked(self.cloud_source)
+        return {"skipped": True, "full_scan": False}
+
+    # returns the plan to apply, None when there is nothing to do
+    def plan(self, local_users, cloud_users):
+        self.local_hashes = record_hashes(self.local_source, local_users)
+        self.cloud_hashes = record_hashes(self.cloud_source, cloud_users)
+        if set_fingerprint(self.local_hashes) == self.local_state.fingerprint and \
+                set_fingerprint(self.cloud_hashes) == self.cloud_state.fingerprint:
+            logger.info("User fingerprints match the last sync, nothing to apply")
+            return None
+        plan = build_user_sync_plan(local_users, cloud_users)
+        logger.info("User sync plan: %s", plan)
+        self.counts.update(plan.counts())
+        return None if plan.is_empty() else plan
+
+    def applied(self, result, local_users):
+        self.counts["failed"] = len(result.failures)
+        self.synced = not result.failures
+        # the mirror must hold the ids ZKBioTime assigned to the new employees
+        self.local_hashes = record_hashes(self.local_source, local_users)
+
+    def finish(self, cloud_etag):
+        update_mirror(self.local_source, self.local_hashes, full_scan=self.full_scan, synced=self.synced)
+        update_mirror(self.cloud_source, self.cloud_hashes, full_scan=self.full_scan, synced=self.synced, etag=cloud_etag)
+        summary = ", ".join(f"{key}: {value}" for key, value in self.counts.items() if key not in ("skipped", "full_scan"))
+        if self.counts.get("failed"):
+            logger.warning("User sync finished with %s failed operations, %s", self.counts['failed'], summary)
+        else:
+            logger.info("Users Synced Successfully! %s", summary)
+        return self.counts
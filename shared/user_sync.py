@@ -0,0 +1,73 @@
+import logging
+
+logger = logging.getLogger("debug_logger")
+
+
+def user_key(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return str(value).strip()
+
+
+def local_display_name(cloud_user):
+    return f"{cloud_user['unique_id']} {cloud_user['name']}"
+
+
+class UserSyncPlan:
+    def __init__(self):
+        self.to_create = []
+        self.to_update = []
+        self.to_delete = []
+        self.duplicates = {}
+        self.unchanged = 0
+
+    def counts(self):
+        return {
+            "create": len(self.to_create),
+            "update": len(self.to_update),
+            "delete": len(self.to_delete),
+            "unchanged": self.unchanged,
+            "duplicates": len(self.duplicates),
+        }
+
+    def is_empty(self):
+        return not (self.to_create or self.to_update or self.to_delete)
+
+    def __str__(self):
+        return ", ".join(f"{key}: {value}" for key, value in self.counts().items())
+
+
+def build_user_sync_plan(local_users, cloud_users):
+    plan = UserSyncPlan()
+
+    local_index = {}
+    for local_user in local_users:
+        key = user_key(local_user['emp_code'])
+        if key in local_index:
+            plan.duplicates.setdefault(key, [local_index[key]['id']]).append(local_user['id'])
+            continue
+        local_index[key] = local_user
+
+    cloud_keys = set()
+    for cloud_user in cloud_users:
+        key = user_key(cloud_user['id'])
+        if key in cloud_keys:
+            continue
+        cloud_keys.add(key)
+        local_user = local_index.get(key)
+        if local_user is None:
+            plan.to_create.append(cloud_user)
+        elif local_user['first_name'] != local_display_name(cloud_user):
+            plan.to_update.append((local_user['id'], cloud_user))
+        else:
+            plan.unchanged += 1
+
+    for key, local_user in local_index.items():
+        if key not in cloud_keys:
+            plan.to_delete.append(local_user['id'])
+            plan.to_delete.extend(plan.duplicates.get(key, [])[1:])
+
+    for key, local_ids in plan.duplicates.items():
+        logger.warning("Duplicate emp_code %s on local server, local user ids: %s", key, local_ids)
+    return plan
@@ -1,29 +1,65 @@
+import functools
 import os
 
 from django.conf import settings
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
-from django.http import JsonResponse, HttpResponse
-from django.shortcuts import render
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
 
-from shared.wi3bit_sync_bridge import Wi3bitSyncBridge
+from shared import metrics
+from shared.adms import ATTLOG, device_allowed, device_options, parse_attlog, record_attlog_stamp, store_pushed_punches
+from shared.jobs import UPDATE_CLOUD_ATTN, UPDATE_LOCAL_ATTN, UPDATE_USERS, job_as_dict, submit_job
+from shared.log_reader import LogReader, format_cursor, parse_cursor
+from shared.models import BridgeJob, Site
+from shared.outbox import outbox_stats_by_site
+from shared.sites import default_site, site_for_serial
+import logging
+logger = logging.getLogger("debug_logger")
+
+LOG_PAGE_SIZE = 60
+_log_reader = None
+
+
+def submit_bridge_job(request, kind):
+    site_key = request.GET.get("site")
+    site = get_object_or_404(Site, key=site_key) if site_key else default_site()
+    job, created = submit_job(kind, site)
+    data = job_as_dict(job)
+    data["attached"] = not created
+    data["status_url"] = reverse("jobStatus", args=[job.id])
+    return JsonResponse(data, status=202)
 
 
 def updateUsers(request):
-    bridge_inst = Wi3bitSyncBridge()
-    bridge_inst.update_users()
-    return HttpResponse("Users Updated")
+    return submit_bridge_job(request, UPDATE_USERS)
 
 
 def updateLocalAttn(request):
-    bridge_inst = Wi3bitSyncBridge()
-    bridge_inst.update_local_attendance()
-    return HttpResponse("Local Attendance Updated")
+    return submit_bridge_job(request, UPDATE_LOCAL_ATTN)
 
 
 def updateCloudAttn(request):
-    bridge_inst = Wi3bitSyncBridge()
-    bridge_inst.update_cloud_attendance()
-    return HttpResponse("Cloud Attendance Updated")
+    return submit_bridge_job(request, UPDATE_CLOUD_ATTN)
+
+
+def jobStatus(request, job_id):
+    job = get_object_or_404(BridgeJob, pk=job_id)
+    return JsonResponse(job_as_dict(job))
+
+
+def metrics_view(request):
+    backlog = metrics.Gauge("bridge_attendance_pending", "Unsynced AttendanceData rows", ("site", "state"))
+    oldest = metrics.Gauge("bridge_attendance_oldest_pending_age_seconds", "Age of the oldest unsynced punch", ("site",))
+    for site_key, stats in outbox_stats_by_site().items():
+        for state in ("pending", "backing_off", "dead_letter"):
+            backlog.set(stats[state], site=site_key, state=state)
+        age = stats["oldest_pending_age"]
+        oldest.set(round(age, 3) if age is not None else None, site=site_key)
+
+    body = metrics.render([backlog, oldest])
+    body += metrics.read_bridge_metrics(settings.BRIDGE_METRICS_FILE, settings.BRIDGE_METRICS_EXPORT_SECONDS * 4)
+    return HttpResponse(body, content_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 def server_error_logs(request):
@@ -32,27 +68,77 @@ def server_error_logs(request):
         log_path = getattr(settings, "ERROR_LOG_FILE_PATH", None)
         if not log_path or not os.path.exists(log_path):
             return JsonResponse({"message": "Error Log File Not Found"}, status=404)
+        reader = get_log_reader(log_path)
+        level = request.GET.get("level") or None
+        query = request.GET.get("q") or None
+        cursor = parse_cursor(request.GET.get("cursor"))
         try:
-            with open(log_path, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-        except UnicodeDecodeError:
-            with open(log_path, "r", encoding="latin-1") as f:
-                lines = f.readlines()
-        lines = [line.rstrip("\n") for line in lines]
-        lines.reverse()
-        paginator = Paginator(lines, 60)
-        page = request.GET.get("page", 1)
-        try:
-            page_obj = paginator.page(page)
-        except PageNotAnInteger:
-            page_obj = paginator.page(1)
-        except EmptyPage:
-            page_obj = paginator.page(paginator.num_pages)
+            page = max(1, int(request.GET.get("page", 1)))
+        except ValueError:
+            page = 1
+        if cursor:
+            logs, next_cursor = reader.read_page(cursor, LOG_PAGE_SIZE, level, query)
+        else:
+            logs, next_cursor = reader.page(page, LOG_PAGE_SIZE, level, query)
         return JsonResponse({
-            "total_lines": paginator.count,
-            "num_pages": paginator.num_pages,
-            "current_page": page_obj.number,
-            "has_more": page_obj.has_next(),
-            "logs": page_obj.object_list,
+            "current_page": page,
+            "has_more": next_cursor is not None,
+            "next_cursor": format_cursor(next_cursor),
+            "logs": logs,
         })
     return render(request, 'shared/server_error_logs.html')
+
+
+def get_log_reader(log_path):
+    global _log_reader
+    if _log_reader is None or _log_reader.path != str(log_path):
+        _log_reader = LogReader(log_path, backup_count=settings.LOGGING["handlers"]["file"]["backupCount"])
+    return _log_reader
+
+
+def adms_device(view):
+    @csrf_exempt
+    @functools.wraps(view)
+    def wrapper(request):
+        if not settings.ADMS_ENABLED:
+            raise Http404
+        serial_number = request.GET.get("SN")
+        if not device_allowed(serial_number):
+            logger.warning("ADMS request from unknown device: %s", serial_number)
+            return HttpResponse("Unknown device", status=403, content_type="text/plain")
+        return view(request, serial_number)
+    return wrapper
+
+
+@adms_device
+def iclock_cdata(request, serial_number):
+    if request.method == "GET":
+        return HttpResponse(device_options(serial_number), content_type="text/plain")
+    if request.GET.get("table") != ATTLOG:
+        # OPERLOG, ATTPHOTO and the like are acknowledged so the device moves on, the bridge only needs punches
+        return HttpResponse("OK", content_type="text/plain")
+
+    punches, rejected = parse_attlog(request.body.decode("utf-8", errors="replace"))
+    site = site_for_serial(serial_number)
+    try:
+        created = store_pushed_punches(punches, site)
+    except Exception as e:
+        # anything but OK makes the device resend the batch later
+        logger.exception("ADMS %s punches could not be stored: %s", serial_number, e)
+        return HttpResponse("ERROR", status=500, content_type="text/plain")
+    if request.GET.get("Stamp"):
+        record_attlog_stamp(serial_number, request.GET["Stamp"])
+    logger.info("ADMS %s pushed %s punches, new: %s, rejected: %s", serial_number, len(punches), created, rejected)
+    if created:
+        submit_job(UPDATE_CLOUD_ATTN, site)
+    return HttpResponse(f"OK: {len(punches) + rejected}", content_type="text/plain")
+
+
+@adms_device
+def iclock_getrequest(request, serial_number):
+    return HttpResponse("OK", content_type="text/plain")
+
+
+@adms_device
+def iclock_devicecmd(request, serial_number):
+    return HttpResponse("OK", content_type="text/plain")
@@ -1,266 +1,479 @@
 import datetime
+import hashlib
 import json
+import math
+import threading
 import time
+from datetime import timedelta
+
 import requests
 from django.conf import settings
-
-from shared.models import AttendanceData, BridgeTokens
+from django.db import close_old_connections
+from django.db.models import Min
+
+from shared import metrics, user_mirror
+from shared.executor import BoundedExecutor, Operation
+from shared.ingestion import PUNCH_TIME_FORMAT, IngestionResult, insert_attendance_rows, parse_punch_time
+from shared.log_pipeline import endpoint_of, truncate
+from shared.models import AttendanceData, LocalResource
+from shared.outbox import BISECT, UploadBackoff, pending_attendance, settle_chunk, upload_outcome
+from shared.pagination import PageStream, PrefetchingPageStream
+from shared.pipeline import UploadWorker
+from shared.sites import default_site, scoped_key
+from shared.storage import db_write
+from shared.token_manager import TokenManager
+from shared.transport import AdaptiveThrottle, HttpTransport
+from shared.upload_format import JSON_FORMAT, UploadFormatNegotiator, encode_chunk
+from shared.user_sync import local_display_name
 import logging
 logger = logging.getLogger("debug_logger")
 
+CLOUD_USERS_PER_PAGE = 100
+WI3BIT_CODE = "wi3bit"
+LOCAL_RESOURCES = {
+    "area": ("/personnel/api/areas/", "area_code", {"area_code": WI3BIT_CODE, "area_name": "Wi3bit (Don't Delete)"}),
+    "department": ("/personnel/api/departments/", "dept_code", {"dept_code": WI3BIT_CODE, "dept_name": "Wi3bit (Don't Delete)"}),
+}
+
+
+def log_upload_response(site, url, response, chunk, encoded, started):
+    metrics.upload_bytes.inc(encoded.size, site=site.key, format=encoded.format, kind="sent")
+    metrics.upload_bytes.inc(encoded.json_size, site=site.key, format=encoded.format, kind="json_equivalent")
+    logger.info(
+        "Cloud attn update api responded: %s, %s bytes as %s (%s as JSON)",
+        response.status_code, encoded.size, encoded.format, encoded.json_size,
+        extra={"endpoint": endpoint_of(url), "status": response.status_code,
+               "latency": round(time.monotonic() - started, 3), "count": len(chunk), "bytes": encoded.size},
+    )
+    logger.debug("Cloud attn update response: %s", truncate(response.text, settings.LOG_PAYLOAD_LIMIT))
+
+
+def cloud_total_pages(response_json):
+    if response_json.get('last_page'):
+        return int(response_json['last_page'])
+    if response_json.get('total'):
+        return math.ceil(int(response_json['total']) / CLOUD_USERS_PER_PAGE)
+    return None
+
+
+def employee_payload(cloud_user, area_id, dept_id):
+    return {
+        "emp_code": cloud_user["id"],
+        "department": dept_id,
+        "area": [area_id],
+        "first_name": local_display_name(cloud_user),
+        # "card_no": cloud_user['rfid_number'],
+    }
+
+
+def attendance_idempotency_key(chunk):
+    return hashlib.sha256(",".join(str(row['attn_id'] or f"pk{row['pk']}") for row in chunk).encode()).hexdigest()
+
+
+def employees_url(site, local_user_id=None):
+    url = f"{site.local_url}/personnel/api/employees/"
+    return f"{url}{local_user_id}/" if local_user_id is not None else url
+
+
+def transactions_url(site, start_time=None):
+    if start_time and not isinstance(start_time, str):
+        start_time = start_time.strftime(PUNCH_TIME_FORMAT)
+    return f"{site.local_url}/iclock/api/transactions/?start_time={start_time or ''}&page_size={settings.ATTN_PAGE_SIZE}"
+
+
+def cloud_users_url(site, page, per_page=CLOUD_USERS_PER_PAGE):
+    return f"{site.cloud_url}/zkteco/sync/bridge/users/?token={site.cloud_token}&per_page={per_page}&page={page}"
+
+
+def log_cloud_response(url, response, started, **extra):
+    logger.info(
+        "Cloud API responded: %s", response.status_code,
+        extra={"endpoint": endpoint_of(url), "status": response.status_code,
+               "latency": round(time.monotonic() - started, 3), **extra},
+    )
+    logger.debug("Cloud API response: %s", truncate(response.text, settings.LOG_PAYLOAD_LIMIT))
+
+
+def cloud_users_page(response):
+    if not response.status_code == 200:
+        raise Exception(f"Invalid response from cloud API:\n {response.text}")
+    return response.json()
+
+
+# ZKBioTime has no change feed for employees, the count catches adds and deletes between full scans
+def local_users_changed(response, state):
+    if response.status_code != 200:
+        return True
+    return response.json().get('count') != state.record_count
+
+
+# returns (changed, etag)
+def cloud_users_changed(response, state):
+    if response.status_code == 304:
+        return False, state.etag
+    if response.status_code != 200:
+        return True, None
+    etag = response.headers.get("ETag")
+    total = response.json().get('total')
+    changed = total is None or int(total) != state.record_count or (etag is not None and etag != state.etag)
+    return changed, etag
+
+
+def check_user_response(response, action):
+    if not (200 <= response.status_code <= 299):
+        logger.debug("User %s Failed \n%s\n%s", action, response.status_code, response.text)
+        raise Exception(f"User {action} Failed, {response.status_code}: {truncate(response.text, settings.LOG_PAYLOAD_LIMIT)}")
+
+
+def user_sync_operations(plan, url, create_user, update_user, delete_user):
+    operations = []
+    for cloud_user in plan.to_create:
+        operations.append(Operation(f"create {cloud_user['id']}", url, create_user, cloud_user))
+    for local_user_id, cloud_user in plan.to_update:
+        operations.append(Operation(f"update {local_user_id}", url, update_user, local_user_id, cloud_user))
+    for local_user_id in plan.to_delete:
+        operations.append(Operation(f"delete {local_user_id}", url, delete_user, local_user_id))
+    return operations
+
 
 class Wi3bitSyncBridge:
-    def __init__(self):
-        self.username = settings.LOCAL_SERVER_USER
-        self.password = settings.LOCAL_SERVER_PASS
+    def __init__(self, site=None):
+        self.site = site or default_site()
+        self.local_source = scoped_key(self.site, user_mirror.LOCAL_EMPLOYEES)
+        self.cloud_source = scoped_key(self.site, user_mirror.CLOUD_USERS)
+        self.resource_keys = {scoped_key(self.site, key): key for key in LOCAL_RESOURCES}
         self.area_id = None
         self.dept_id = None
+        self.area_dept_checked_at = None
+        self.area_dept_revalidating = False
+        self.area_dept_lock = threading.Lock()
+        self.transport = HttpTransport()
+        self.upload_worker = None
+        self.upload_format = UploadFormatNegotiator()
+        self.upload_backoff = UploadBackoff()
+
+        self.tokens = TokenManager(self.transport, self.site)
 
-        self.token = self.get_token()
-        self.area_dept_verification()
+    def close(self):
+        self.transport.close()
 
     def get_token(self, renew=False):
         if renew:
-            BridgeTokens.objects.all().delete()
-        token_inst = BridgeTokens.objects.filter(expired=False).last()
-        if token_inst:
-            logger.info("Using token from DB:")
-            return token_inst.token
-        logger.info("Getting new token from Local Server:")
-        url = f"{settings.LOCAL_SERVER}/jwt-api-token-auth/"
-        headers = {"Content-Type": "application/json"}
-        data = {"username": self.username, "password": self.password}
-        response = requests.post(url, data=json.dumps(data), headers=headers, timeout=5)
-        if response.status_code == 400:
-            logger.info(f"Token api failed, Status: {response.status_code}, Response: {response.text}")
-            raise Exception('Invalid credentials or Local server not running')
+            return self.tokens.refresh(stale_token=self.tokens.token)
+        return self.tokens.get()
+
+    def local_page_stream(self, name, url, start_page=1):
+        def fetch_page(page_number):
+            return self.local_api_call(url=f"{url}&page={page_number}").json()
+        return PageStream(name, fetch_page, lambda response_json: response_json['next'], start_page=start_page)
 
-        token = response.json()['token']
-        BridgeTokens.objects.create(token=token)
-        return token
+    def cloud_user_stream(self, start_page=1):
+        headers = {"Content-Type": "application/json"}
+        throttle = AdaptiveThrottle()
+
+        def fetch_page(page_number):
+            url = cloud_users_url(self.site, page_number)
+            started = time.monotonic()
+            response = throttle.request(self.transport, "get", url, headers=headers, timeout=20)
+            log_cloud_response(url, response, started, page=page_number)
+            return cloud_users_page(response)
+
+        return PrefetchingPageStream(
+            "cloud users", fetch_page, lambda response_json: response_json['has_more'],
+            total_pages=cloud_total_pages, workers=settings.CLOUD_PREFETCH_WORKERS, start_page=start_page, max_pages=settings.CLOUD_USERS_MAX_PAGES,
+        )
 
     def get_local_users(self):
         logger.info("Getting local users")
-        page_number = 1
-        local_users = []
-        while page_number:
-            response = self.local_api_call(
-                url= f"{settings.LOCAL_SERVER}/personnel/api/employees/?page_size=100&page={page_number}"
-            )
-            response_json = response.json()
-            local_users.extend(response_json['data'])
-            if not response_json['next']:
-                break
-            page_number += 1
-            # time.sleep(0.5)
-        return local_users
+        return list(self.local_page_stream("local users", f"{employees_url(self.site)}?page_size=100"))
 
     def get_cloud_users(self):
         logger.info("Getting cloud users")
-        headers = {"Content-Type": "application/json"}
-        page_number = 1
-        cloud_users = []
-
-        current_loop, max_loops = 1, 15
-        while current_loop <= max_loops:
-            url = f"{settings.CLOUD_SERVER}/zkteco/sync/bridge/users/?token={settings.CLOUD_API_TOKEN}&per_page=100&page={page_number}"
-            logger.info(f"Cloud users url: {url}")
-            response = requests.get(url, headers=headers, timeout=20)
-            logger.info(f"Got response from cloud API, Status: {response.status_code}, Response: {response.text}")
-            if not response.status_code == 200:
-                raise Exception(f"Invalid response from cloud API:\n {response.text}")
-            response_json = response.json()
-            cloud_users.extend(response_json['data'])
-            if not response_json['has_more']:
-                break
-            page_number += 1
-            time.sleep(1)
-        return cloud_users
-
-    def update_local_attendance(self, start_time=None):
-        logger.info(f"Updating local attendance, {start_time}")
-        if start_time and isinstance(start_time, str):
-            start_time = start_time.strftime('%Y-%m-%d %H:%M:%S')
-        url = f"{settings.LOCAL_SERVER}/iclock/api/transactions/?start_time={start_time or ''}"
-
-        page_number = 1
-        attendance_data = []
-        while page_number:
-            response = self.local_api_call(url=f"{url}&page={page_number}")
-            response_json = response.json()
-            attendance_data.extend(response_json['data'])
-            if not response_json['next']:
-                break
-            page_number += 1
-            # time.sleep(0.5)
-
-        new_attn = False
-        attn_data_ids = [item['id'] for item in attendance_data]
-        existing_ids = set(
-            AttendanceData.objects.filter(attn_id__in=attn_data_ids).values_list('attn_id', flat=True)
+        return list(self.cloud_user_stream())
+
+    def update_local_attendance(self, start_time=None, start_page=1, progress=None):
+        logger.info("Updating local attendance, %s", start_time)
+        url = transactions_url(self.site, start_time)
+
+        result = IngestionResult()
+        stream = self.local_page_stream("transactions", url, start_page=start_page)
+        try:
+            for page in stream.pages():
+                result.add_page(page.records, self.store_attendance_page(page.records))
+                if progress:
+                    progress.update(page=page.number, seen=result.records_seen, new=result.new_count)
+        except Exception:
+            logger.error("Attendance ingestion failed, resume from page %s", stream.resume_page())
+            raise
+
+        logger.info("Local attendance updated, %s", result)
+        if result:
+            self.notify_new_punches()
+        return result
+
+    def store_attendance_page(self, records):
+        rows = [
+            AttendanceData(site=self.site, user_id=data['emp_code'], timestamp=parse_punch_time(data['punch_time']), attn_id=data['id'])
+            for data in records
+        ]
+        new_ids = insert_attendance_rows(rows)
+        new_records = [data for data in records if data['id'] in new_ids]
+        metrics.punches_ingested.inc(len(new_records), site=self.site.key)
+        if new_records:
+            logger.info("Attendance data created: %s new of %s fetched", len(new_records), len(records))
+        return new_records
+
+    def pending_attendance_chunks(self, chunk_size):
+        last_pk = 0
+        while True:
+            chunk = list(
+                pending_attendance(site=self.site).filter(pk__gt=last_pk)
+                .order_by('pk')
+                .values('pk', 'user_id', 'timestamp', 'attn_id')[:chunk_size]
+            )
+            if not chunk:
+                return
+            yield chunk
+            last_pk = chunk[-1]['pk']
+
+    def send_attendance_chunk(self, chunk, upload_format):
+        encoded = encode_chunk(chunk, upload_format)
+        url = f"{self.site.cloud_url}/zkteco/sync/bridge/attendance_data/?token={self.site.cloud_token}"
+        started = time.monotonic()
+        response = self.transport.post(
+            url,
+            data=encoded.body,
+            headers={**encoded.headers, "Idempotency-Key": attendance_idempotency_key(chunk)},
+            timeout=settings.CLOUD_UPLOAD_TIMEOUT,
         )
-        for data in attendance_data:
-            if data['id'] in existing_ids:
-                continue
-            new_attn = True
-            timestamp = datetime.datetime.strptime(data['punch_time'], "%Y-%m-%d %H:%M:%S")
-            AttendanceData.objects.create(user_id=data['emp_code'], timestamp=timestamp, attn_id=data['id'])
-            logger.info(f"Attendance data created: user: {data['emp_code']}, timestamp: {timestamp}")
-
-        if new_attn:
+        log_upload_response(self.site, url, response, chunk, encoded, started)
+        return response
+
+    def post_attendance_chunk(self, chunk):
+        upload_format = self.upload_format.choose()
+        response = self.send_attendance_chunk(chunk, upload_format)
+        if self.upload_format.observe(upload_format, response.status_code):
+            response = self.send_attendance_chunk(chunk, JSON_FORMAT)
+        return response
+
+    # returns (uploaded rows, whether the upload run can continue)
+    def upload_attendance_chunk(self, chunk):
+        try:
+            response = self.post_attendance_chunk(chunk)
+        except requests.RequestException as e:
+            self.upload_backoff.failed(e)
+            return 0, False
+
+        outcome = upload_outcome(response.status_code, len(chunk))
+        if outcome == BISECT:
+            # isolate the rows the cloud rejects so the rest of the chunk still goes through
+            middle = len(chunk) // 2
+            uploaded, can_continue = self.upload_attendance_chunk(chunk[:middle])
+            if not can_continue:
+                return uploaded, False
+            more, can_continue = self.upload_attendance_chunk(chunk[middle:])
+            return uploaded + more, can_continue
+        return settle_chunk(self.site, outcome, chunk, response.status_code, response.text, self.upload_backoff)
+
+    def start_upload_worker(self, upload=None):
+        self.upload_worker = UploadWorker(
+            upload or self.update_cloud_attendance,
+            site_key=self.site.key,
+            debounce=settings.UPLOAD_DEBOUNCE_SECONDS,
+            max_delay=settings.UPLOAD_MAX_DELAY_SECONDS,
+        )
+        self.upload_worker.start()
+        return self.upload_worker
+
+    def notify_new_punches(self):
+        if self.upload_worker and self.upload_worker.is_alive():
+            self.upload_worker.notify()
+        else:
             self.update_cloud_attendance()
 
-    def update_cloud_attendance(self):
+    def update_cloud_attendance(self, progress=None):
+        if not self.upload_backoff.ready():
+            logger.info("Cloud attendance upload is backing off, skipping")
+            return 0
         logger.info("Uploading attendance data to cloud:")
-        pending_attn_data = AttendanceData.objects.filter(synced=False)
-        if not pending_attn_data.exists():
-            logger.error("No pending attendance data to sync, exiting")
-            return
-
-        pay_load = [{
-            "user_id": data.user_id,
-            "timestamp": data.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-        } for data in pending_attn_data]
-        response = requests.post(
-            f"{settings.CLOUD_SERVER}/zkteco/sync/bridge/attendance_data/?token={settings.CLOUD_API_TOKEN}",
-            json=pay_load,
-            timeout=7,
+        uploaded = 0
+        for chunk in self.pending_attendance_chunks(settings.CLOUD_UPLOAD_CHUNK_SIZE):
+            chunk_uploaded, can_continue = self.upload_attendance_chunk(chunk)
+            uploaded += chunk_uploaded
+            if progress:
+                progress.update(uploaded=uploaded)
+            if not can_continue:
+                logger.error("Attendance upload stopped after %s records, remaining rows will be retried", uploaded)
+                return uploaded
+
+        if not uploaded:
+            logger.info("No pending attendance data to sync, exiting")
+            return uploaded
+        logger.info("Attendance Synced Successfully! uploaded: %s", uploaded)
+        return uploaded
+
+    def probe_local_users(self, state):
+        return local_users_changed(self.local_api_call(url=f"{employees_url(self.site)}?page_size=1&page=1"), state)
+
+    # returns (changed, etag)
+    def probe_cloud_users(self, state):
+        url = cloud_users_url(self.site, 1, per_page=1)
+        headers = {"Content-Type": "application/json"}
+        if state.etag:
+            headers["If-None-Match"] = state.etag
+        started = time.monotonic()
+        response = self.transport.get(url, headers=headers, timeout=20)
+        log_cloud_response(url, response, started)
+        return cloud_users_changed(response, state)
+
+    def apply_user_sync_plan(self, plan, progress=None):
+        self.ensure_area_dept()
+        operations = user_sync_operations(plan, employees_url(self.site), self.create_user, self.update_user, self.delete_user)
+        executor = BoundedExecutor(
+            max_workers=settings.USER_SYNC_WORKERS,
+            per_host_limit=settings.USER_SYNC_HOST_CONCURRENCY,
+            rate=settings.USER_SYNC_RATE,
         )
-        logger.info(f"Got response from cloud attn update api, status: {response.status_code}, response: {response.text}")
-        if response.status_code == 201:
-            pending_attn_data.update(synced=True)
-
-        logger.info("Attendance Synced Successfully!")
-
-    def update_users(self):
-        local_users = self.get_local_users()
-        cloud_users = self.get_cloud_users()
-        for cloud_user in cloud_users:
-            user_found = False
-            for local_user in local_users:
-                if int(cloud_user['id']) == int(local_user['emp_code']):
-                    user_found = True
-                    if local_user['first_name'] != f"{cloud_user['unique_id']} {cloud_user['name']}":
-                        self.update_user(local_user['id'], cloud_user)
-            if not user_found:
-                self.create_user(cloud_user)
-
-        cloud_ids = {u["id"] for u in cloud_users}
-        for local_user in local_users:
-            if int(local_user['emp_code']) not in cloud_ids:
-                self.delete_user(local_user['id'])
-
-        logger.info("Users Synced Successfully!")
+        if progress:
+            progress.update(phase="applying", total=len(operations))
+        result = executor.run(operations, progress)
+        logger.info("User sync applied, %s", result)
+        for name, error in result.failures:
+            logger.debug("User sync operation failed: %s, error: %s", name, error)
+        return result
+
+    def update_users(self, full_scan=None, progress=None):
+        run = user_mirror.UserSyncRun(self.local_source, self.cloud_source, full_scan, progress)
+        cloud_changed, cloud_etag = self.probe_cloud_users(run.cloud_state)
+        local_changed = run.full_scan or self.probe_local_users(run.local_state)
+        if not (run.full_scan or cloud_changed or local_changed):
+            return run.skip()
+
+        run.report(phase="fetching")
+        local_users = self.get_local_users() if local_changed else user_mirror.mirrored_records(self.local_source)
+        cloud_users = self.get_cloud_users() if run.full_scan or cloud_changed else user_mirror.mirrored_records(self.cloud_source)
+        plan = run.plan(local_users, cloud_users)
+        if plan:
+            run.applied(self.apply_user_sync_plan(plan, progress), self.get_local_users())
+        return run.finish(cloud_etag)
 
     def create_user(self, cloud_user):
-        logger.info(f"Creating new user: {cloud_user}")
+        logger.info("Creating new user: %s", cloud_user.get('id'))
+        logger.debug("Cloud user: %s", truncate(cloud_user, settings.LOG_PAYLOAD_LIMIT))
         response = self.local_api_call(
-            url=f"{settings.LOCAL_SERVER}/personnel/api/employees/",
+            url=employees_url(self.site),
             method="post",
-            data={
-                "emp_code": cloud_user["id"],
-                "department": self.dept_id,
-                "area": [self.area_id],
-                "first_name": f"{cloud_user['unique_id']} {cloud_user['name']}",
-                # "card_no": cloud_user['rfid_number'],
-            },
+            data=employee_payload(cloud_user, self.area_id, self.dept_id),
         )
-        if not (200 <= response.status_code <= 299):
-            logger.error(f"User Creation Failed \n{response.status_code}\n{response.text}")
-            return
-        # time.sleep(0.5)
-        logger.info(f"User Created: {cloud_user['name']}")
+        check_user_response(response, "Creation")
+        logger.info("User Created: %s", cloud_user['name'])
 
     def update_user(self, local_user_id, cloud_user):
-        logger.info(f"Updating user, local user id: {local_user_id}, cloud user: {cloud_user}")
+        logger.info("Updating user, local user id: %s, cloud user: %s", local_user_id, cloud_user.get('id'))
+        logger.debug("Cloud user: %s", truncate(cloud_user, settings.LOG_PAYLOAD_LIMIT))
         response = self.local_api_call(
-            url=f"{settings.LOCAL_SERVER}/personnel/api/employees/{local_user_id}/",
+            url=employees_url(self.site, local_user_id),
             method="put",
-            data={
-                "emp_code": cloud_user["id"],
-                "area": [self.area_id],
-                "department": self.dept_id,
-                "first_name": f"{cloud_user['unique_id']} {cloud_user['name']}",
-            },
+            data=employee_payload(cloud_user, self.area_id, self.dept_id),
         )
-        if not (200 <= response.status_code <= 299):
-            raise Exception(f"User Update Failed \n {response.text}")
-        # time.sleep(0.5)
-        logger.info(f"User Updated: {cloud_user['name']}")
+        check_user_response(response, "Update")
+        logger.info("User Updated: %s", cloud_user['name'])
 
     def delete_user(self, local_user_id):
-        logger.info(f"Deleting user, local user id: {local_user_id}")
-        response = self.local_api_call(
-            url=f"{settings.LOCAL_SERVER}/personnel/api/employees/{local_user_id}/",
-            method="delete"
-        )
-        if not (200 <= response.status_code <= 299):
-            raise Exception(f"User Deletion Failed \n {response.text}")
-        # time.sleep(0.5)
-        logger.info(f"User Deleted: {local_user_id}")
+        logger.info("Deleting user, local user id: %s", local_user_id)
+        response = self.local_api_call(url=employees_url(self.site, local_user_id), method="delete")
+        check_user_response(response, "Deletion")
+        logger.info("User Deleted: %s", local_user_id)
 
     def delete_attn_data(self, attn_id):
-        logger.info(f"Deleting attendance data, attn id: {attn_id}")
+        logger.info("Deleting attendance data, attn id: %s", attn_id)
         response = self.local_api_call(
-            url=f"{settings.LOCAL_SERVER}/iclock/api/transactions/{attn_id}/",
+            url=f"{self.site.local_url}/iclock/api/transactions/{attn_id}/",
             method="delete"
         )
         # time.sleep(0.2)
 
+    def ensure_area_dept(self):
+        if not (self.area_id and self.dept_id):
+            cached = {
+                self.resource_keys[key]: resource_id for key, resource_id in
+                LocalResource.objects.filter(key__in=self.resource_keys).values_list('key', 'resource_id')
+            }
+            self.area_id, self.dept_id = cached.get("area"), cached.get("department")
+            self.area_dept_checked_at = LocalResource.objects.filter(key__in=self.resource_keys).aggregate(
+                oldest=Min('resolved_at'))['oldest']
+
+        if not (self.area_id and self.dept_id):
+            self.area_dept_verification()
+            return
+
+        ttl = timedelta(hours=settings.AREA_DEPT_TTL_HOURS)
+        if not self.area_dept_checked_at or datetime.datetime.now() - self.area_dept_checked_at > ttl:
+            self.revalidate_area_dept()
+
+    def revalidate_area_dept(self):
+        with self.area_dept_lock:
+            if self.area_dept_revalidating:
+                return
+            self.area_dept_revalidating = True
+
+        def revalidate():
+            try:
+                self.area_dept_verification()
+            except Exception as e:
+                logger.warning("Area and Dept revalidation failed, keeping cached ids: %s", e)
+            finally:
+                self.area_dept_revalidating = False
+                close_old_connections()
+        threading.Thread(target=revalidate, name="area-dept-revalidate", daemon=True).start()
+
+    def find_local_resource(self, key):
+        path, code_field, _ = LOCAL_RESOURCES[key]
+        url = f"{self.site.local_url}{path}?{code_field}={WI3BIT_CODE}"
+        response = self.local_api_call(url=url)
+        if response.status_code == 200:
+            for item in response.json()['data']:
+                if item[code_field] == WI3BIT_CODE:
+                    return item['id']
+        else:
+            logger.info("%s API Failed, Status: %s, Response: %s", key, response.status_code, response.text)
+
+        # the code filter was ignored or unsupported, walk every page
+        for item in self.local_page_stream(f"{key}s", f"{self.site.local_url}{path}?page_size=100"):
+            if item[code_field] == WI3BIT_CODE:
+                return item['id']
+        return None
+
+    def resolve_local_resource(self, key):
+        path, _, create_data = LOCAL_RESOURCES[key]
+        resource_id = self.find_local_resource(key)
+        if not resource_id:
+            logger.info("%s not found, creating new %s", key, key)
+            post_res = self.local_api_call(url=f"{self.site.local_url}{path}", method="post", data=create_data)
+            if not(200 <= post_res.status_code <= 299):
+                raise Exception(f"{key} validation failed \n {post_res.text}")
+            resource_id = post_res.json()['id']
+            logger.info("%s created successfully", key)
+        db_write(
+            LocalResource.objects.update_or_create,
+            key=scoped_key(self.site, key), defaults={"resource_id": resource_id, "resolved_at": datetime.datetime.now()},
+        )
+        return resource_id
+
     def area_dept_verification(self):
         logger.info("Verifying Area and Dept")
-        # Area
-        response = self.local_api_call(url=f"{settings.LOCAL_SERVER}/personnel/api/areas/")
-        if not response.status_code == 200:
-            logger.info(f"Area API Failed, Status: {response.status_code}, Response: {response.text}")
-
-        for area in response.json()['data']:
-            if area['area_code'] == "wi3bit":
-                self.area_id = area['id']
-                break
-
-        if not self.area_id:
-            logger.info("Area not found, creating new area")
-            post_res = self.local_api_call(
-                url=f"{settings.LOCAL_SERVER}/personnel/api/areas/",
-                method="post",
-                data={"area_code": "wi3bit", "area_name": f"Wi3bit (Don't Delete)"}
-            )
-            if not(200 <= post_res.status_code <= 299):
-                raise Exception(f"Area validation failed \n {post_res.text}")
-            self.area_id = post_res.json()['id']
-            logger.info("Area created successfully")
-
-        # Dept
-        response = self.local_api_call(url=f"{settings.LOCAL_SERVER}/personnel/api/departments/")
-        if not response.status_code == 200:
-            logger.info(f"Dept API Failed, Status: {response.status_code}, Response: {response.text}")
-
-        for dept in response.json()['data']:
-            if dept['dept_code'] == "wi3bit":
-                self.dept_id = dept['id']
-                break
-
-        if not self.dept_id:
-            logger.info("Dept not found, creating new dept")
-            post_res = self.local_api_call(
-                url=f"{settings.LOCAL_SERVER}/personnel/api/departments/",
-                method="post",
-                data={"dept_code": "wi3bit", "dept_name": "Wi3bit (Don't Delete)",}
-            )
-            if not(200 <= post_res.status_code <= 299):
-                raise Exception(f"Dept validation failed \n {post_res.text}")
-            self.dept_id = post_res.json()['id']
-            logger.info("Dept created successfully")
+        self.area_id = self.resolve_local_resource("area")
+        self.dept_id = self.resolve_local_resource("department")
+        self.area_dept_checked_at = datetime.datetime.now()
         logger.info("Area and Dept verified successfully")
 
         # logger.info("Verifying devices")
-        # response = self.local_api_call(url=f"{settings.LOCAL_SERVER}/iclock/api/terminals/")
+        # response = self.local_api_call(url=f"{self.site.local_url}/iclock/api/terminals/")
         # for device in response.json()['data']:
         #     if device["area"] != self.area_id:
         #         logger.info(f"Device: {device['sn']} is not in wi3bit area, updating it")
         #         post_res = self.local_api_call(
-        #             url=f"{settings.LOCAL_SERVER}/iclock/api/terminals/{device['id']}/",
+        #             url=f"{self.site.local_url}/iclock/api/terminals/{device['id']}/",
         #             method="put",
         #             data={
         #                 "sn": device['sn'],
@@ -273,27 +486,29 @@ class Wi3bitSyncBridge:
         #             logger.info(f"Device: {device['sn']} updated successfully")
 
     def local_api_call(self, url, method='get', data=None, timeout=5, retry=True):
-        logger.info(f"Local API Calling: {url} with method: {method}, data: {data}, timeout: {timeout}, token: {self.token}")
-        def get_response():
-            headers = {"Content-Type": "application/json", "Authorization": f"JWT {self.token}"}
-            if method.lower() == "get":
-                return requests.get(url, headers=headers, timeout=timeout)
-            elif method.lower() == "post":
-                return requests.post(url, data=json.dumps(data or {}), headers=headers, timeout=timeout)
-            elif method.lower() == "put":
-                return requests.put(url, data=json.dumps(data or {}), headers=headers, timeout=timeout)
-            elif method.lower() == "delete":
-                return requests.delete(url, headers=headers, timeout=timeout)
-            logger.info(f"Invalid method: {method}")
+        logger.debug("Local API Calling: %s %s, data: %s", method, endpoint_of(url), truncate(data, settings.LOG_PAYLOAD_LIMIT))
+        def get_response(token):
+            headers = {"Content-Type": "application/json", "Authorization": f"JWT {token}"}
+            if method.lower() in ("get", "delete"):
+                return self.transport.request(method, url, headers=headers, timeout=timeout)
+            elif method.lower() in ("post", "put"):
+                return self.transport.request(method, url, data=json.dumps(data or {}), headers=headers, timeout=timeout)
+            logger.info("Invalid method: %s", method)
             raise Exception(f"Invalid method: {method}")
 
-        response = get_response()
-        logger.info(f"Local API Responded: {response.status_code}, Response: {response.text[:100]}... {len(response.text) > 100 and '...' or ''}")
-        if retry and (400 <= response.status_code <= 499):
-            logger.info(f"Got {response.status_code} status code, getting new token and retrying")
-            self.token = self.get_token(renew=True)
-            response = get_response()
+        token = self.tokens.get()
+        started = time.monotonic()
+        response = get_response(token)
+        logger.info(
+            "Local API responded: %s", response.status_code,
+            extra={"endpoint": endpoint_of(url), "method": method.upper(), "status": response.status_code,
+                   "latency": round(time.monotonic() - started, 3)},
+        )
+        logger.debug("Local API response: %s", truncate(response.text, settings.LOG_PAYLOAD_LIMIT))
+        if retry and response.status_code in (401, 403):
+            logger.info("Got %s status code, getting new token and retrying", response.status_code)
+            response = get_response(self.tokens.refresh(stale_token=token))
             if not (200 <= response.status_code <= 299):
-                logger.info(f"Got new token but failed again, exiting with error: {response.text}")
+                logger.info("Got new token but failed again, exiting with error: %s", truncate(response.text, settings.LOG_PAYLOAD_LIMIT))
                 raise Exception(response.text)
         return response
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 import os
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -76,6 +76,9 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'timeout': 20,
+        },
     }
 }
 
@@ -129,6 +132,80 @@ LOCAL_SERVER_PASS = config('LOCAL_SERVER_PASS', default="", cast=str)
 CLOUD_API_TOKEN = config('CLOUD_API_TOKEN', default="", cast=str)
 DEV_SERVER = config('DEV_SERVER', default=False, cast=bool)
 
+USER_SYNC_WORKERS = config('USER_SYNC_WORKERS', default=4, cast=int)
+USER_SYNC_HOST_CONCURRENCY = config('USER_SYNC_HOST_CONCURRENCY', default=4, cast=int)
+# requests per second against ZKBioTime while applying a user sync plan, 0 leaves it to the worker/host limits
+USER_SYNC_RATE = config('USER_SYNC_RATE', default=0, cast=float)
+USER_SYNC_FULL_SCAN_MINUTES = config('USER_SYNC_FULL_SCAN_MINUTES', default=60, cast=int)
+
+HTTP_POOL_SIZE = config('HTTP_POOL_SIZE', default=10, cast=int)
+HTTP_CONNECT_TIMEOUT = config('HTTP_CONNECT_TIMEOUT', default=3, cast=float)
+HTTP_READ_TIMEOUT = config('HTTP_READ_TIMEOUT', default=10, cast=float)
+HTTP_RETRIES = config('HTTP_RETRIES', default=2, cast=int)
+HTTP_BACKOFF = config('HTTP_BACKOFF', default=0.5, cast=float)
+
+CLOUD_PREFETCH_WORKERS = config('CLOUD_PREFETCH_WORKERS', default=4, cast=int)
+CLOUD_USERS_MAX_PAGES = config('CLOUD_USERS_MAX_PAGES', default=15, cast=int)
+
+# "async" runs all upstream I/O on one event loop, it needs httpx installed
+BRIDGE_ENGINE = config('BRIDGE_ENGINE', default="sync", cast=str)
+ASYNC_LOCAL_CONCURRENCY = config('ASYNC_LOCAL_CONCURRENCY', default=32, cast=int)
+ASYNC_CLOUD_CONCURRENCY = config('ASYNC_CLOUD_CONCURRENCY', default=8, cast=int)
+ASYNC_MAX_CONNECTIONS = config('ASYNC_MAX_CONNECTIONS', default=64, cast=int)
+ASYNC_PAGE_WINDOW = config('ASYNC_PAGE_WINDOW', default=8, cast=int)
+ASYNC_UPLOAD_WINDOW = config('ASYNC_UPLOAD_WINDOW', default=4, cast=int)
+
+ATTN_INCREMENTAL_OVERLAP = config('ATTN_INCREMENTAL_OVERLAP', default=60, cast=int)
+ATTN_CATCHUP_INTERVAL_MINUTES = config('ATTN_CATCHUP_INTERVAL_MINUTES', default=30, cast=int)
+ATTN_MIN_CATCHUP_MINUTES = config('ATTN_MIN_CATCHUP_MINUTES', default=35, cast=int)
+ATTN_MAX_CATCHUP_DAYS = config('ATTN_MAX_CATCHUP_DAYS', default=10, cast=int)
+ATTN_LATENESS_SAFETY_FACTOR = config('ATTN_LATENESS_SAFETY_FACTOR', default=1.5, cast=float)
+# the daily sweep reaches at least this far behind the checkpoint even when no late punches were seen
+ATTN_DEEP_CATCHUP_MIN_HOURS = config('ATTN_DEEP_CATCHUP_MIN_HOURS', default=72, cast=int)
+ATTN_PAGE_SIZE = config('ATTN_PAGE_SIZE', default=500, cast=int)
+
+CLOUD_UPLOAD_CHUNK_SIZE = config('CLOUD_UPLOAD_CHUNK_SIZE', default=500, cast=int)
+CLOUD_UPLOAD_TIMEOUT = config('CLOUD_UPLOAD_TIMEOUT', default=20, cast=float)
+# "columnar-v1" sends gzipped, delta-encoded columns and falls back to "json" if the cloud rejects it
+CLOUD_UPLOAD_FORMAT = config('CLOUD_UPLOAD_FORMAT', default="json", cast=str)
+CLOUD_UPLOAD_FORMAT_RECHECK = config('CLOUD_UPLOAD_FORMAT_RECHECK', default=6 * 60 * 60, cast=int)
+
+OUTBOX_MAX_ATTEMPTS = config('OUTBOX_MAX_ATTEMPTS', default=8, cast=int)
+OUTBOX_BASE_BACKOFF = config('OUTBOX_BASE_BACKOFF', default=30, cast=float)
+OUTBOX_MAX_BACKOFF = config('OUTBOX_MAX_BACKOFF', default=3600, cast=float)
+
+UPLOAD_DEBOUNCE_SECONDS = config('UPLOAD_DEBOUNCE_SECONDS', default=2, cast=float)
+UPLOAD_MAX_DELAY_SECONDS = config('UPLOAD_MAX_DELAY_SECONDS', default=10, cast=float)
+
+BRIDGE_LEASE_TTL = config('BRIDGE_LEASE_TTL', default=60, cast=int)
+# the web process runs the scheduler itself whenever no run_bridge worker holds the lease
+BRIDGE_WEB_STANDBY = config('BRIDGE_WEB_STANDBY', default=True, cast=bool)
+
+SQLITE_BUSY_TIMEOUT = config('SQLITE_BUSY_TIMEOUT', default=20, cast=float)
+SQLITE_CACHE_KB = config('SQLITE_CACHE_KB', default=20000, cast=int)
+DB_WRITER_ENABLED = config('DB_WRITER_ENABLED', default=True, cast=bool)
+DB_WRITER_BATCH_SIZE = config('DB_WRITER_BATCH_SIZE', default=50, cast=int)
+
+TOKEN_REFRESH_MARGIN = config('TOKEN_REFRESH_MARGIN', default=300, cast=int)
+
+BRIDGE_JOB_POLL_SECONDS = config('BRIDGE_JOB_POLL_SECONDS', default=2, cast=int)
+# scheduler threads per site, each site runs its jobs on its own pool
+SITE_SCHEDULER_WORKERS = config('SITE_SCHEDULER_WORKERS', default=4, cast=int)
+
+AREA_DEPT_TTL_HOURS = config('AREA_DEPT_TTL_HOURS', default=24, cast=int)
+
+ADMS_ENABLED = config('ADMS_ENABLED', default=False, cast=bool)
+# only these serials and those listed on a Site may push, an empty list with no site serials accepts nothing
+ADMS_ALLOWED_SERIALS = config('ADMS_ALLOWED_SERIALS', default="", cast=Csv())
+ADMS_DELAY = config('ADMS_DELAY', default=10, cast=int)
+ADMS_ERROR_DELAY = config('ADMS_ERROR_DELAY', default=30, cast=int)
+ADMS_TRANS_TIMES = config('ADMS_TRANS_TIMES', default="00:00;14:05", cast=str)
+# with devices pushing punches the transactions poll is only a safety net
+ATTN_HEARTBEAT_SECONDS = config('ATTN_HEARTBEAT_SECONDS', default=300 if ADMS_ENABLED else 60, cast=int)
+
+BRIDGE_METRICS_FILE = BASE_DIR / "bridge_metrics.prom"
+BRIDGE_METRICS_EXPORT_SECONDS = config('BRIDGE_METRICS_EXPORT_SECONDS', default=15, cast=int)
+
 ERROR_LOG_FILE_PATH = BASE_DIR / "django.log"
 
 import os
@@ -136,33 +213,54 @@ from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+LOG_LEVEL = config('LOG_LEVEL', default="INFO", cast=str)
+LOG_PAYLOAD_LIMIT = config('LOG_PAYLOAD_LIMIT', default=200, cast=int)
+LOG_JSON_FILE = config('LOG_JSON_FILE', default=False, cast=bool)
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
     "formatters": {
         "verbose": {
+            "()": "shared.log_pipeline.RedactingFormatter",
             "format": "[{asctime}] {levelname} {name}: {message}",
             "style": "{",
         },
+        "json": {
+            "()": "shared.log_pipeline.JsonFormatter",
+        },
     },
     "handlers": {
         "console": {
-            "level": "DEBUG",
-            "class": "logging.StreamHandler",
+            "level": LOG_LEVEL,
+            "class": "shared.log_pipeline.BackgroundStreamHandler",
             "formatter": "verbose",
         },
         "file": {
-            "level": "DEBUG",
-            "class": "logging.handlers.RotatingFileHandler",
+            "level": LOG_LEVEL,
+            "class": "shared.log_pipeline.BackgroundRotatingFileHandler",
             "filename": BASE_DIR / "django.log",
             "formatter": "verbose",
-            "maxBytes": 1 * 1024 * 1024,
+            "maxBytes": 10 * 1024 * 1024,
             "backupCount": 5,
             "encoding": "utf-8",
         },
     },
     "root": {
         "handlers": ["console", "file"],
-        "level": "DEBUG",
+        "level": LOG_LEVEL,
     },
 }
+
+# JSON lines for log shippers, the handler sits on root next to django.log so each record is written once per file
+if LOG_JSON_FILE:
+    LOGGING["handlers"]["json_file"] = {
+        "level": LOG_LEVEL,
+        "class": "shared.log_pipeline.BackgroundRotatingFileHandler",
+        "filename": BASE_DIR / "bridge.json.log",
+        "formatter": "json",
+        "maxBytes": 10 * 1024 * 1024,
+        "backupCount": 3,
+        "encoding": "utf-8",
+    }
+    LOGGING["root"]["handlers"].append("json_file")
@@ -18,3 +18,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wi3bit_zkteco.settings')
 
 application = get_wsgi_application()
+
+# only processes that serve requests load this module, migrate, shell and run_bridge never start the standby
+from django.conf import settings  # noqa: E402
+
+if settings.BRIDGE_WEB_STANDBY and os.getenv('DISABLE_SCHEDULER') != '1':
+    from shared.leader import start_web_standby
+    start_web_standby(settings.BRIDGE_LEASE_TTL)